@@ -3,9 +3,13 @@ import logging
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from db_engine import database_url, engine_options
+from db_routing import RoutingSession, replica_binds, replicas_cli
+
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -14,24 +18,45 @@ class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", os.urandom(24))
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
 
 # Configure the database using environment variables
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///healthcare.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+# Engine profile (SQLite pragmas or PostgreSQL pool sizing; see db_engine.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Read replicas for @read_only views (see db_routing.py)
+app.config["SQLALCHEMY_BINDS"] = replica_binds()
 
 # Initialize the app with the extension
 db.init_app(app)
+app.cli.add_command(replicas_cli)
+
+
+
+def add_missing_columns():
+    # db.create_all() only creates missing tables. Add nullable columns that were
+    # introduced after a table was first created so existing databases keep working.
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                app.logger.info(f"Added column {table.name}.{column.name}")
+
 
 with app.app_context():
     # Import models here to avoid circular imports
     import models  # noqa: F401
     db.create_all()
+    add_missing_columns()
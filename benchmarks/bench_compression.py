@@ -0,0 +1,127 @@
+#bench_compression.py
+# Size and encode/decode time of AI analyses stored as plaintext, zlib, zlib
+# with the built-in dictionary and (if zstandard is installed) zstd with it,
+# then the SQLite file size before and after `flask compression migrate`.
+#
+# Usage: python benchmarks/bench_compression.py [--checks 2000] [--repeat 20]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + db_file)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import main  # noqa: E402,F401
+import compressed_text  # noqa: E402
+from app import app, db  # noqa: E402
+from compressed_text import compress_text, decompress_text, compressed_columns, migrate_column  # noqa: E402
+from models import User, Patient, SymptomCheck  # noqa: E402
+
+CONDITIONS = ['Tension headache', 'Migraine', 'Sinusitis', 'Viral infection', 'Dehydration', 'Allergic rhinitis']
+CONFIDENCE = ['High', 'Medium', 'Low']
+FINDINGS = [
+    'The reported pain pattern is typical of {c}.',
+    'Duration of {d} days suggests a self-limiting course.',
+    'Sensitivity to light is commonly associated with {c}.',
+    'Fever above 38.5C would make {c} more likely.',
+    'Symptoms worsening in the evening may indicate fatigue or eye strain.',
+]
+
+
+def analysis(rng):
+    conditions = rng.sample(CONDITIONS, 3)
+    lines = ['Possible Conditions:']
+    for c in conditions:
+        lines.append(f"- {c} ({rng.choice(CONFIDENCE)} confidence): {rng.choice(FINDINGS).format(c=c, d=rng.randint(1, 9))}")
+    lines += ['', 'Key Symptoms Analysis:']
+    lines += [f"- {rng.choice(FINDINGS).format(c=rng.choice(conditions), d=rng.randint(1, 9))}" for _ in range(6)]
+    lines += ['', 'Risk Factors:', '- Stress', '- Poor sleep', '', 'Recommended Next Steps:',
+              '1. Stay hydrated and get plenty of rest.', '2. Consult a healthcare provider if symptoms persist or worsen.',
+              '', 'Warning Signs:', '- Sudden severe headache', '- Confusion or difficulty speaking', '',
+              'Preventive Measures:', '1. Maintain a healthy diet and regular exercise.', '',
+              'This is for educational purposes only and not a substitute for professional medical diagnosis.']
+    return '\n'.join(lines)
+
+
+def codecs():
+    builtin = compressed_text.BUILTIN_DICTIONARY
+    yield 'plaintext', lambda s: s.encode(), lambda b: b.decode()
+    yield 'zlib', lambda s: zlib.compress(s.encode(), 6), lambda b: zlib.decompress(b).decode()
+    yield 'zlib + dictionary', lambda s: compress_text(s, 1).encode(), lambda b: decompress_text(b.decode())
+    if compressed_text.zstandard is not None:
+        zstd = compressed_text.zstandard
+        d = zstd.ZstdCompressionDict(builtin)
+        c, dc = zstd.ZstdCompressor(level=6, dict_data=d), zstd.ZstdDecompressor(dict_data=d)
+        yield 'zstd + dictionary', lambda s: c.compress(s.encode()), lambda b: dc.decompress(b).decode()
+
+
+def seed(samples):
+    user = User(email='bench@example.com', password_hash=generate_password_hash('bench'), user_type='patient')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(user_id=user.id, name='Bench Patient')
+    db.session.add(patient)
+    db.session.flush()
+    # Written as plaintext, as rows stored before compressed_text.py were
+    db.session.execute(text(
+        "INSERT INTO symptom_check (patient_id, symptoms, ai_analysis, image_analysis, created_at) "
+        "VALUES (:patient_id, 'headache', :analysis, NULL, CURRENT_TIMESTAMP)"
+    ), [{'patient_id': patient.id, 'analysis': s} for s in samples])
+    db.session.commit()
+
+
+def file_size():
+    db.session.execute(text('VACUUM'))
+    return os.path.getsize(db_file)
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    samples = [analysis(rng) for _ in range(args.checks)]
+    logical = sum(len(s.encode()) for s in samples)
+    print(f"{len(samples)} analyses, {logical / len(samples):.0f} bytes on average")
+    for label, encode, decode in codecs():
+        stored = [encode(s) for s in samples]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for s in samples:
+                encode(s)
+        encode_us = (time.perf_counter() - start) / (args.repeat * len(samples)) * 1e6
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for b in stored:
+                decode(b)
+        decode_us = (time.perf_counter() - start) / (args.repeat * len(samples)) * 1e6
+        size = sum(len(b) for b in stored)
+        print(f"{label:<18} {size / len(samples):>7.0f} bytes/row  {logical / size:>5.1f}x  "
+              f"encode={encode_us:.1f}us  decode={decode_us:.1f}us")
+
+    with app.app_context():
+        seed(samples)
+        before = file_size()
+        start = time.perf_counter()
+        for model, column_name in compressed_columns():
+            migrate_column(db.session, model, column_name)
+        elapsed = time.perf_counter() - start
+        after = file_size()
+        print(f"SQLite file: {before} -> {after} bytes after migrate + VACUUM "
+              f"({100 - after * 100 // before}% smaller, migrate took {elapsed:.2f}s)")
+        db.session.expunge_all()
+        assert [c.ai_analysis for c in SymptomCheck.query.order_by(SymptomCheck.id)] == samples
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,115 @@
+#bench_dashboard.py
+# Bytes hydrated and ORM load time for the patient dashboard's recent symptom
+# checks, loading full rows (how the dashboard used to query) versus the
+# summary columns (check_summary.py), plus the time for a whole dashboard
+# render.
+#
+# Usage: python benchmarks/bench_dashboard.py [--checks 200] [--repeat 200]
+import argparse
+import base64
+import os
+import sys
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.orm import load_only, undefer_group  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import main  # noqa: E402,F401
+from app import app, db  # noqa: E402
+from check_summary import SUMMARY_COLUMNS  # noqa: E402
+from models import User, Patient, SymptomCheck  # noqa: E402
+
+ANALYSIS = (
+    "Possible Conditions:\n- Tension headache (High confidence): pressure around the forehead\n"
+    "- Migraine (Medium confidence): throbbing pain, light sensitivity\n\n"
+    "Key Symptoms Analysis:\n" + "- Detailed discussion of the reported symptom and its significance.\n" * 20 +
+    "\nRecommended Next Steps:\n" + "- Rest, fluids and over-the-counter pain relief as directed.\n" * 10
+)
+IMAGE = base64.b64encode(b'\xff\xd8\xff' + os.urandom(150_000)).decode()
+
+hydrated = {'bytes': 0}
+
+
+@event.listens_for(SymptomCheck, 'load')
+def _count_bytes(check, context):
+    for value in vars(check).values():
+        if isinstance(value, (str, bytes)):
+            hydrated['bytes'] += len(value)
+
+
+def seed(checks):
+    user = User(email='bench@example.com', password_hash=generate_password_hash('bench'), user_type='patient')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(user_id=user.id, name='Bench Patient')
+    db.session.add(patient)
+    db.session.flush()
+    for i in range(checks):
+        db.session.add(SymptomCheck(
+            patient_id=patient.id,
+            symptoms=f'headache and light sensitivity for {i % 7 + 1} days, worse in the evening',
+            severity='moderate',
+            medical_history='Seasonal allergies. ' * 10,
+            ai_analysis=ANALYSIS,
+            image_data=IMAGE if i % 3 == 0 else None,
+            image_analysis=ANALYSIS if i % 3 == 0 else None
+        ))
+    db.session.commit()
+    return user, patient
+
+
+def recent_checks(patient_id, options):
+    return SymptomCheck.query.options(*options).filter_by(
+        patient_id=patient_id
+    ).order_by(
+        SymptomCheck.created_at.desc()
+    ).limit(3).all()
+
+
+def measure(patient_id, options, repeat):
+    hydrated['bytes'] = 0
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        recent_checks(patient_id, options)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return hydrated['bytes'] // repeat, timings[len(timings) // 2] * 1000
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        user, patient = seed(args.checks)
+        user_id, patient_id = user.id, patient.id
+        full = [undefer_group('analysis'), undefer_group('image')]
+        summary = [load_only(*SUMMARY_COLUMNS)]
+        for label, options in (('full rows (before)', full), ('summary columns', summary)):
+            size, p50 = measure(patient_id, options, args.repeat)
+            print(f"recent checks, {label:<19} {size:>9} bytes hydrated  p50={p50:.3f}ms")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['user_type'] = 'patient'
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        client.get('/dashboard').get_data()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"GET /dashboard: p50={timings[len(timings) // 2] * 1000:.2f}ms "
+          f"p99={timings[int(len(timings) * 0.99)] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main_()
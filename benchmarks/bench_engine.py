@@ -0,0 +1,169 @@
+#bench_engine.py
+# Mixed concurrent traffic under each database engine profile (db_engine.py):
+# patients booking appointments (writes: appointment, notifications, outbox
+# events) while doctors poll their notification count and page (reads).
+# Each profile runs in a fresh process on a fresh database, since the profile
+# is read when the app is imported.
+#
+# Usage: python benchmarks/bench_engine.py [--threads 8] [--requests 200] [--write-ratio 0.2]
+#                                          [--profiles basic,sqlite] [--pg-url postgresql://...]
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(args):
+    sys.path.insert(0, ROOT)
+    import main  # noqa: F401
+    from app import app, db
+    from models import Appointment, Doctor, Patient, User
+    from werkzeug.security import generate_password_hash
+
+    run = uuid.uuid4().hex[:8]
+    password_hash = generate_password_hash('bench')
+    with app.app_context():
+        engine = db.engine
+        pragmas = {}
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                    pragmas[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+        doctors = []
+        for i in range(args.threads):
+            user = User(email=f'doctor{i}-{run}@bench.local', password_hash=password_hash, user_type='doctor')
+            db.session.add(user)
+            db.session.flush()
+            doctor = Doctor(user_id=user.id, name=f'Doctor {i}', specialization='General Practice')
+            db.session.add(doctor)
+            db.session.flush()
+            doctors.append((user.id, doctor.id))
+        patients = []
+        for i in range(args.threads):
+            user = User(email=f'patient{i}-{run}@bench.local', password_hash=password_hash, user_type='patient')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Patient(user_id=user.id, name=f'Patient {i}'))
+            patients.append(user.id)
+        db.session.commit()
+        appointments_before = Appointment.query.count()
+
+    results = {'read': [], 'write': []}
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(args.threads)
+
+    def worker(index):
+        rng = random.Random(index)
+        patient = app.test_client()
+        with patient.session_transaction() as session:
+            session['user_id'] = patients[index]
+            session['user_type'] = 'patient'
+        doctor = app.test_client()
+        with doctor.session_transaction() as session:
+            session['user_id'] = doctors[index][0]
+            session['user_type'] = 'doctor'
+        start_barrier.wait()
+        for n in range(args.requests):
+            if rng.random() < args.write_ratio:
+                kind = 'write'
+                call = lambda: patient.post('/book-appointment', data={  # noqa: E731
+                    'doctor_id': doctors[rng.randrange(len(doctors))][1],
+                    'date': '2031-01-%02d' % (n % 28 + 1), 'time': '%02d:%02d' % (9 + n % 8, n % 4 * 15),
+                    'reason': 'Benchmark booking'})
+            else:
+                kind = 'read'
+                path = '/api/notifications/count' if rng.random() < 0.8 else '/notifications'
+                call = lambda: doctor.get(path)  # noqa: E731
+            began = time.perf_counter()
+            try:
+                response = call()
+                ok = response.status_code < 400
+                response.close()
+            except Exception as e:
+                ok = False
+                with lock:
+                    errors.append(str(e))
+            elapsed = time.perf_counter() - began
+            with lock:
+                results[kind].append(elapsed)
+                if not ok:
+                    errors.append(f'{kind} failed')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - began
+
+    with app.app_context():
+        booked = Appointment.query.count() - appointments_before
+
+    def percentiles(timings):
+        timings = sorted(timings)
+        if not timings:
+            return {'p50': 0, 'p99': 0}
+        return {'p50': timings[len(timings) // 2] * 1000, 'p99': timings[int(len(timings) * 0.99)] * 1000}
+
+    print(json.dumps({
+        'profile': os.environ.get('DB_ENGINE_PROFILE'),
+        'backend': engine.dialect.name,
+        'pragmas': pragmas,
+        'requests': len(results['read']) + len(results['write']),
+        'throughput': (len(results['read']) + len(results['write'])) / wall,
+        'read': percentiles(results['read']),
+        'write': percentiles(results['write']),
+        # Booking redirects whether or not it succeeded, so compare with rows written
+        'failed_bookings': len(results['write']) - booked,
+        'errors': len(errors),
+    }))
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='per thread')
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--profiles', default='basic,sqlite')
+    parser.add_argument('--pg-url', help='also run the basic and postgresql profiles against this database')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    runs = []
+    for profile in args.profiles.split(','):
+        runs.append((profile, 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')))
+    if args.pg_url:
+        runs += [('basic', args.pg_url), ('postgresql', args.pg_url)]
+
+    for profile, url in runs:
+        env = dict(os.environ, DB_ENGINE_PROFILE=profile, DATABASE_URL=url, DATABASE_REPLICA_URLS='')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--threads', str(args.threads),
+             '--requests', str(args.requests), '--write-ratio', str(args.write_ratio)],
+            env=env, capture_output=True, text=True
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith('{')]
+        if output.returncode or not lines:
+            print(f"{profile} ({url}): failed\n{output.stderr[-2000:]}")
+            continue
+        result = json.loads(lines[-1])
+        print(f"{profile:<10} {result['backend']:<10} {result['throughput']:7.1f} req/s  "
+              f"read p50={result['read']['p50']:.1f}ms p99={result['read']['p99']:.1f}ms  "
+              f"write p50={result['write']['p50']:.1f}ms p99={result['write']['p99']:.1f}ms  "
+              f"failed bookings={result['failed_bookings']} errors={result['errors']}  {result['pragmas'] or ''}")
+
+
+if __name__ == '__main__':
+    main_()
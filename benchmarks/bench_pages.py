@@ -0,0 +1,87 @@
+#bench_pages.py
+# Bytes per page and render time for the landing page, before and after the
+# page cache (page_cache.py) and fingerprinted, precompressed static assets
+# (static_assets.py).
+#
+# Usage: python benchmarks/bench_pages.py [--repeat 200]
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sys
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402,F401
+import page_cache  # noqa: E402
+import static_assets  # noqa: E402
+from app import app  # noqa: E402
+
+STATIC_RE = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+
+
+def page_bytes(client, path, accept_encoding):
+    headers = {'Accept-Encoding': accept_encoding}
+    response = client.get(path, headers=headers)
+    html = response.get_data()
+    html_bytes = total = len(html)
+    if response.headers.get('Content-Encoding') == 'gzip':
+        html = gzip.decompress(html)
+    assets = STATIC_RE.findall(html.decode('utf-8'))
+    for url in assets:
+        asset = client.get(url, headers=headers)
+        total += len(asset.get_data())
+        asset.close()
+    return html_bytes, total, len(assets)
+
+
+def render_ms(client, path, repeat, clear):
+    timings = []
+    for _ in range(repeat):
+        if clear:
+            page_cache.page_cache.clear()
+            page_cache.fragment_cache.clear()
+        start = time.perf_counter()
+        client.get(path).get_data()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--keep-build', action='store_true', help='leave static/dist in place')
+    args = parser.parse_args()
+
+    client = app.test_client()
+    dist = os.path.join(app.static_folder, static_assets.DIST_DIR)
+    had_build = os.path.isdir(dist)
+
+    p50, p99 = render_ms(client, '/', args.repeat, clear=True)
+    print(f"render /, no page cache:   p50={p50:.2f}ms p99={p99:.2f}ms")
+    p50, p99 = render_ms(client, '/', args.repeat, clear=False)
+    print(f"render /, page cache hit:  p50={p50:.2f}ms p99={p99:.2f}ms")
+
+    static_assets.manifest.clear()
+    html, total, count = page_bytes(client, '/', 'identity')
+    print(f"bytes /, plain static:     html={html} total={total} ({count} local assets)")
+
+    stats = static_assets.build_assets()
+    page_cache.page_cache.clear()
+    for encoding in ('gzip', 'br, gzip'):
+        html, total, count = page_bytes(client, '/', encoding)
+        print(f"bytes /, built ({encoding}):{' ' * (9 - len(encoding))}html={html} total={total} ({count} local assets)")
+    print(f"build: {stats['files']} files, {stats['bytes']} raw bytes, gzip {stats['gzip_bytes']}, "
+          f"brotli {stats['brotli_bytes'] or 'n/a'}")
+
+    if not had_build and not args.keep_build:
+        shutil.rmtree(dist)
+        static_assets.manifest.clear()
+
+
+if __name__ == '__main__':
+    main_()
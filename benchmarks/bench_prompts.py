@@ -0,0 +1,67 @@
+#bench_prompts.py
+# Prompt size and build latency versus input length, comparing the old
+# unbounded f-string prompt with the budgeted builder in prompts.py.
+#
+# Usage: python benchmarks/bench_prompts.py [--repeat 2000]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts import SYMPTOM_PREFIX, build_symptom_prompt, estimate_tokens  # noqa: E402
+
+WORDS = ('fever headache cough nausea fatigue rash dizziness chest pain shortness breath '
+         'diabetes hypertension asthma medication daily twice allergy penicillin surgery '
+         'knee back pain since years ago history mother father smoker').split()
+
+
+def random_text(length, rng):
+    out = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        out.append(word)
+        size += len(word) + 1
+        if rng.random() < 0.08:
+            out[-1] += '.'
+    return ' '.join(out)[:length]
+
+
+def naive_prompt(symptoms, age, gender, duration, severity, medical_history):
+    # Equivalent of the original inline f-string in routes.symptom_checker
+    return (f"{SYMPTOM_PREFIX}\nPatient Information:\n- Age: {age}\n- Gender: {gender}\n"
+            f"- Symptoms: {symptoms}\n- Duration: {duration}\n- Severity: {severity}\n"
+            f"- Medical History: {medical_history}\n")
+
+
+def timed(fn, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'input chars':>12} {'naive tok':>10} {'budget tok':>11} {'naive us':>9} {'budget us':>10} truncated")
+    for length in (100, 1_000, 5_000, 20_000, 100_000):
+        symptoms = random_text(length // 4, rng)
+        history = random_text(length, rng)
+        fields = (symptoms, '42', 'Female', '1-2 weeks', 'Moderate', history)
+
+        naive, naive_us = timed(naive_prompt, args.repeat, *fields)
+        built, built_us = timed(build_symptom_prompt, args.repeat, *fields)
+        print(f"{length:>12} {estimate_tokens(naive):>10} {built.tokens:>11} "
+              f"{naive_us:>9.1f} {built_us:>10.1f} {','.join(built.truncated_fields) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+#bench_routes.py
+# Latency, throughput and queries per request for the main routes, on a
+# synthetic population (synthetic_data.py). Each scenario signs in as a
+# seeded sample of the generated doctors or patients and requests one route;
+# symptom_checker uses reanalysis.FakeModel instead of Gemini.
+#
+#   client  requests go through the Flask test client, one at a time
+#   http    the app is served by a threaded werkzeug server in a separate
+#           process and --processes load generator processes send requests
+#           to it over keep-alive HTTP connections
+#
+# Queries are counted with a before_cursor_execute listener (reported to the
+# load generators in a response header in http mode).
+#
+# Results can be saved as a JSON baseline and later runs compared with it:
+# a scenario regresses when its p50 or p95 grows by more than --tolerance, or
+# it runs more queries per request. The comparison exits with status 1 on a
+# regression. Compare runs of the same scale and seed on the same machine.
+# The baseline records the population's reference day (synthetic_data.py
+# --today) and --compare generates with it unless --today is given, so a
+# baseline saved on another day is compared against the same rows.
+#
+# Usage: python benchmarks/bench_routes.py [--database sqlite:///bench.db] [--reuse] [--scale small] [--seed 1]
+#                                          [--mode client|http|both] [--requests 200] [--processes 4]
+#                                          [--scenarios dashboard_patient,api_doctors] [--fake-latency 0]
+#                                          [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+#                                          [--today YYYY-MM-DD]
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data  # noqa: E402
+
+QUERY_HEADER = 'X-Bench-Queries'
+
+# Users each scenario is spread over
+SAMPLE_USERS = 20
+
+
+def _symptom_body(rng):
+    return {
+        'symptoms': ', '.join(rng.sample(synthetic_data.SYMPTOMS, 2)), 'age': str(rng.randint(18, 80)),
+        'gender': rng.choice(['male', 'female']), 'duration': rng.choice(synthetic_data.DURATIONS),
+        'severity': 'moderate', 'medical_history': '',
+    }
+
+
+# name: (user type, method, path, JSON body builder or None)
+SCENARIOS = {
+    'dashboard_patient': ('patient', 'GET', '/dashboard', None),
+    'dashboard_doctor': ('doctor', 'GET', '/dashboard', None),
+    'appointments_patient': ('patient', 'GET', '/appointments', None),
+    'appointments_doctor': ('doctor', 'GET', '/appointments', None),
+    'doctor_finder': ('patient', 'GET', '/doctor-finder', None),
+    'doctor_finder_filtered': ('patient', 'GET', '/doctor-finder?specialization=cardio', None),
+    'api_doctors': ('patient', 'GET', '/api/doctors', None),
+    'api_notification_count': ('doctor', 'GET', '/api/notifications/count', None),
+    'symptom_checker': ('patient', 'POST', '/symptom-checker', _symptom_body),
+}
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] if timings else 0.0
+
+
+def summarize(timings, queries, errors, wall):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'mean_ms': sum(timings) / len(timings) * 1000 if timings else 0.0,
+        'throughput': len(timings) / wall if wall else 0.0,
+        'queries_per_request': sum(queries) / len(queries) if queries else 0.0,
+        'max_queries': max(queries) if queries else 0,
+    }
+
+
+def sample_users(seed):
+    """{user type: [user id, ...]}, the same sample for the same seed."""
+    from sqlalchemy import select
+    from app import app, db
+    from models import User
+    rng = random.Random(f"{seed}-bench")
+    users = {}
+    with app.app_context():
+        for user_type in ('doctor', 'patient'):
+            ids = db.session.execute(
+                select(User.id).where(User.user_type == user_type,
+                                      User.email.endswith('@' + synthetic_data.EMAIL_DOMAIN))
+                .order_by(User.id)
+            ).scalars().all()
+            if not ids:
+                raise SystemExit('No synthetic users in this database; run without --reuse')
+            users[user_type] = sorted(rng.sample(ids, min(SAMPLE_USERS, len(ids))))
+    return users
+
+
+def use_fake_model(latency):
+    import routes
+    from reanalysis import FakeModel
+    routes.text_model = FakeModel(latency=latency, seed=0)
+    routes.vision_model = FakeModel(latency=latency, seed=0)
+
+
+def quiet():
+    # Per-request log lines would dominate the timings
+    from app import app
+    app.logger.setLevel(logging.WARNING)
+
+
+class QueryCounter:
+    """Counts statements executed on the app's engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+# Test client mode
+
+def run_client(args, users):
+    from app import app, db
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+    results = {}
+    for name in args.scenarios:
+        user_type, method, path, body = SCENARIOS[name]
+        rng = random.Random(f"{args.seed}-{name}")
+        clients = []
+        for user_id in users[user_type]:
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+                session['user_type'] = user_type
+            clients.append(client)
+
+        def call():
+            client = rng.choice(clients)
+            response = client.open(path, method=method, json=body(rng) if body else None)
+            ok = response.status_code < 400
+            response.close()
+            return ok
+
+        for _ in range(args.warmup):
+            call()
+        timings, queries, errors = [], [], 0
+        began = time.perf_counter()
+        for _ in range(args.requests):
+            before = counter.count
+            start = time.perf_counter()
+            ok = call()
+            timings.append(time.perf_counter() - start)
+            queries.append(counter.count - before)
+            errors += not ok
+        results[name] = summarize(timings, queries, errors, time.perf_counter() - began)
+        report('client', name, results[name])
+    return results
+
+
+# HTTP mode
+
+def serve(args):
+    """Server process: the app on a threaded werkzeug server, with query counts in a header."""
+    import threading
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import main  # noqa: F401
+    from app import app, db
+    quiet()
+    use_fake_model(args.fake_latency)
+    local = threading.local()
+    with app.app_context():
+        from sqlalchemy import event
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(conn, cursor, statement, parameters, context, executemany):
+            local.count = getattr(local, 'count', 0) + 1
+
+    @app.before_request
+    def start_count():
+        local.count = 0
+
+    @app.after_request
+    def add_count(response):
+        response.headers[QUERY_HEADER] = str(getattr(local, 'count', 0))
+        return response
+
+    class Handler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', args.port, app, threaded=True, request_handler=Handler)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def _session_cookie(user_id, user_type):
+    """A signed-in session cookie, signed with the SESSION_SECRET the server uses."""
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+    signer = Flask(__name__)
+    signer.secret_key = os.environ['SESSION_SECRET']
+    serializer = SecureCookieSessionInterface().get_signing_serializer(signer)
+    return 'session=' + serializer.dumps({'user_id': user_id, 'user_type': user_type})
+
+
+def http_worker(task):
+    """One load generator process's share of a scenario."""
+    port, name, user_ids, requests, seed, worker = task
+    user_type, method, path, body = SCENARIOS[name]
+    rng = random.Random(f"{seed}-{name}-{worker}")
+    cookies = [_session_cookie(user_id, user_type) for user_id in user_ids]
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    timings, queries, errors = [], [], 0
+    for _ in range(requests):
+        headers = {'Cookie': rng.choice(cookies)}
+        payload = None
+        if body:
+            payload = json.dumps(body(rng))
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            errors += 1
+            continue
+        timings.append(time.perf_counter() - start)
+        queries.append(int(response.getheader(QUERY_HEADER, 0)))
+        errors += response.status >= 400
+    connection.close()
+    return timings, queries, errors
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_http(args, users):
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+         '--fake-latency', str(args.fake_latency)],
+        env=os.environ.copy(), stdout=subprocess.PIPE, text=True
+    )
+    try:
+        if server.stdout.readline().strip() != 'ready':
+            raise SystemExit('The benchmark server did not start')
+        results = {}
+        with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+            for name in args.scenarios:
+                user_ids = users[SCENARIOS[name][0]]
+                share = max(args.requests // args.processes, 1)
+                pool.map(http_worker, [(port, name, user_ids, max(args.warmup // args.processes, 1),
+                                        args.seed + 1000, worker) for worker in range(args.processes)])
+                began = time.perf_counter()
+                parts = pool.map(http_worker, [(port, name, user_ids, share, args.seed, worker)
+                                               for worker in range(args.processes)])
+                wall = time.perf_counter() - began
+                results[name] = summarize([t for part in parts for t in part[0]],
+                                          [q for part in parts for q in part[1]],
+                                          sum(part[2] for part in parts), wall)
+                report('http', name, results[name])
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# Reporting and baselines
+
+def report(mode, name, result):
+    print(f"{mode:<6} {name:<24} {result['throughput']:8.1f} req/s  p50={result['p50_ms']:7.1f}ms  "
+          f"p95={result['p95_ms']:7.1f}ms  p99={result['p99_ms']:7.1f}ms  "
+          f"queries={result['queries_per_request']:5.1f} (max {result['max_queries']})  "
+          f"errors={result['errors']}", flush=True)
+
+
+def environment(args):
+    import sqlalchemy
+    from sqlalchemy.engine import make_url
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': make_url(os.environ['DATABASE_URL']).get_backend_name(),
+        'scale': args.scale,
+        'seed': args.seed,
+        'today': args.today.isoformat() if args.today else None,
+        'counts': synthetic_data.counts_for(args.scale, **{name: getattr(args, name)
+                                                           for name in synthetic_data.SCALES['small']}),
+        'requests': args.requests,
+        'processes': args.processes,
+        'fake_latency': args.fake_latency,
+    }
+
+
+def compare(baseline, results, tolerance):
+    """Print changes against a baseline; returns the regressed (mode, scenario) pairs."""
+    regressions = []
+    for mode, scenarios in results.items():
+        for name, result in scenarios.items():
+            before = baseline['results'].get(mode, {}).get(name)
+            if before is None:
+                continue
+            problems = [
+                f"{key} {before[key]:.1f} -> {result[key]:.1f}ms"
+                for key in ('p50_ms', 'p95_ms') if result[key] > before[key] * (1 + tolerance)
+            ]
+            if result['queries_per_request'] > before['queries_per_request'] + 0.01:
+                problems.append(f"queries {before['queries_per_request']:.1f} -> "
+                                f"{result['queries_per_request']:.1f}")
+            change = (result['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0.0
+            print(f"{mode:<6} {name:<24} p50 {change:+6.1f}%  "
+                  + ('REGRESSED: ' + ', '.join(problems) if problems else 'ok'))
+            if problems:
+                regressions.append((mode, name))
+    return regressions
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='database URL (default: a new SQLite file)')
+    parser.add_argument('--reuse', action='store_true', help='use the population already in --database')
+    synthetic_data.add_arguments(parser)
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='client')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='per scenario, not measured')
+    parser.add_argument('--processes', type=int, default=4, help='load generators in http mode')
+    parser.add_argument('--fake-latency', type=float, default=0.0, help='seconds per fake model call')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with a JSON baseline saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed latency growth, as a fraction')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+
+    if args.reuse and not args.database:
+        parser.error('--reuse needs --database')
+    args.scenarios = args.scenarios.split(',')
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    # Inherited by the server and load generator processes
+    os.environ['DATABASE_URL'] = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_REPLICA_URLS'] = ''
+    os.environ['OUTBOX_DISPATCHER_THREAD'] = ''
+    os.environ.setdefault('SESSION_SECRET', os.urandom(16).hex())
+    import main  # noqa: F401
+    quiet()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if args.today is None and baseline['environment'].get('today'):
+            args.today = date.fromisoformat(baseline['environment']['today'])
+    if not args.reuse:
+        synthetic_data.generate(args)
+    users = sample_users(args.seed)
+    use_fake_model(args.fake_latency)
+
+    results = {}
+    if args.mode in ('client', 'both'):
+        results['client'] = run_client(args, users)
+    if args.mode in ('http', 'both'):
+        results['http'] = run_http(args, users)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(args), 'results': results}, f, indent=2)
+        print(f"Saved {args.save}")
+    if baseline:
+        recorded = baseline['environment']
+        today = args.today.isoformat() if args.today else None
+        if recorded.get('scale') != args.scale or recorded.get('seed') != args.seed or recorded.get('today') != today:
+            print('Warning: the baseline was recorded with a different scale, seed or reference day')
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,102 @@
+#bench_similarity.py
+# Recall and latency of the symptom similarity index (similarity.py) over a
+# synthetic corpus of symptom descriptions and paraphrased queries.
+#
+# Usage: python benchmarks/bench_similarity.py [--size 20000] [--queries 500]
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from similarity import SimilarityIndex, vectorize  # noqa: E402
+
+# (canonical phrase, paraphrases)
+SYMPTOMS = [
+    ('headache', ['head pain', 'head ache', 'pounding head']),
+    ('fever', ['high temperature', 'feverish', 'running a temperature']),
+    ('cough', ['coughing', 'dry cough', 'hacking cough']),
+    ('sore throat', ['scratchy throat', 'throat pain', 'painful throat']),
+    ('nausea', ['feeling sick', 'queasy', 'nauseous']),
+    ('vomiting', ['throwing up', 'puking', 'vomit']),
+    ('stomach pain', ['tummy ache', 'belly pain', 'abdominal pain']),
+    ('fatigue', ['tired', 'exhausted', 'tiredness']),
+    ('dizziness', ['dizzy', 'lightheaded', 'room spinning']),
+    ('rash', ['skin rash', 'red spots', 'itchy skin']),
+    ('shortness of breath', ['short of breath', 'breathless', 'hard to breathe']),
+    ('chest pain', ['chest tightness', 'pain in chest', 'chest pressure']),
+    ('back pain', ['lower back ache', 'sore back', 'backache']),
+    ('joint pain', ['aching joints', 'sore knees', 'stiff joints']),
+    ('runny nose', ['nose running', 'blocked nose', 'sniffles']),
+    ('diarrhea', ['loose stools', 'upset stomach', 'runs']),
+]
+DURATIONS = [('2 days', 'two days'), ('3 days', 'three days'), ('a week', '1 week'), ('5 days', 'five days')]
+GENDERS = ['Male', 'Female', 'Other']
+SEVERITIES = ['Mild', 'Moderate', 'Severe']
+
+
+def make_case(rng):
+    picks = rng.sample(range(len(SYMPTOMS)), rng.randint(2, 4))
+    duration = rng.choice(DURATIONS)
+    original = ', '.join(SYMPTOMS[i][0] for i in picks) + f' for {duration[0]}'
+    paraphrase = ' and '.join(rng.choice(SYMPTOMS[i][1]) for i in reversed(picks)) + f', {duration[1]}'
+    demographics = dict(age=rng.randint(5, 85), gender=rng.choice(GENDERS), severity=rng.choice(SEVERITIES))
+    return original, paraphrase, demographics
+
+
+def evaluate(index, queries, originals, k):
+    # A hit is any returned check with the same original description; the
+    # corpus contains many identical descriptions, so the exact id is not
+    # a meaningful target.
+    hits = 0
+    latencies = []
+    for expected_id, vector in queries:
+        start = time.perf_counter()
+        results = index.search(vector, k=k)
+        latencies.append(time.perf_counter() - start)
+        if any(originals[item_id] == originals[expected_id] for item_id, _, _ in results):
+            hits += 1
+    latencies = np.array(latencies) * 1000
+    return hits / len(queries), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [make_case(rng) for _ in range(args.size)]
+
+    start = time.perf_counter()
+    vectors = [vectorize(original, **demo) for original, _, demo in cases]
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"vectorized {args.size} checks in {build_ms:.0f} ms")
+
+    originals = [original for original, _, _ in cases]
+    query_ids = rng.sample(range(args.size), args.queries)
+    queries = [(i, vectorize(cases[i][1], **cases[i][2])) for i in query_ids]
+
+    for label, lists, probes in (('flat', 0, 0), ('ivf-64/8', 64, 8), ('ivf-128/8', 128, 8)):
+        index = SimilarityIndex(max_items=args.size, ivf_lists=lists, ivf_probes=probes)
+        start = time.perf_counter()
+        for item_id, vector in enumerate(vectors):
+            index.add(item_id, vector)
+        if lists:
+            index.train()
+        insert_ms = (time.perf_counter() - start) * 1000
+        recall, p50, p99 = evaluate(index, queries, originals, args.k)
+        print(f"{label:>10}: recall@{args.k}={recall:.3f} p50={p50:.2f}ms p99={p99:.2f}ms "
+              f"insert+train={insert_ms:.0f}ms memory={index.nbytes / 1e6:.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+#synthetic_data.py
+# Seeded synthetic population for benchmarks: users, doctors, patients,
+# appointments, notifications and symptom checks at a chosen scale. Dates are
+# relative to a reference day, --today (default: the current date), so the
+# same seed, scale and reference day always produce the same rows.
+#
+# Doctors and patients are spread around weighted city centres (with some in
+# the countryside between them), patients mostly book doctors in their own
+# city, and a few doctors and patients account for a large share of the
+# traffic, as in real usage. Notifications follow each appointment's history
+# and are stored as type and params (see notification_messages.py).
+#
+# Rows are written with bulk INSERTs in batches, so the ORM listeners (commit
+# hooks, summary fields) do not run; summary fields are computed here. Every
+# account shares one password, SYNTHETIC_PASSWORD, since hashing each one
+# would take longer than the rest of the generation. Use a fresh database.
+#
+# Usage: python benchmarks/synthetic_data.py [--database sqlite:///synthetic.db] [--scale small] [--seed 1]
+#                                            [--today YYYY-MM-DD] [--doctors N] [--patients N] [--appointments N]
+#                                            [--notifications N] [--symptom-checks N]
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYNTHETIC_PASSWORD = 'synthetic'
+EMAIL_DOMAIN = 'synthetic.local'
+
+SCALES = {
+    'tiny': {'doctors': 20, 'patients': 200, 'appointments': 1000, 'notifications': 2000, 'symptom_checks': 200},
+    'small': {'doctors': 200, 'patients': 2000, 'appointments': 10000, 'notifications': 20000,
+              'symptom_checks': 2000},
+    'medium': {'doctors': 2000, 'patients': 20000, 'appointments': 100000, 'notifications': 200000,
+               'symptom_checks': 20000},
+    'large': {'doctors': 10000, 'patients': 100000, 'appointments': 500000, 'notifications': 1000000,
+              'symptom_checks': 100000},
+}
+
+# (city, state, latitude, longitude, weight)
+CITIES = [
+    ('Mumbai', 'Maharashtra', 19.0760, 72.8777, 20),
+    ('Delhi', 'Delhi', 28.7041, 77.1025, 20),
+    ('Bengaluru', 'Karnataka', 12.9716, 77.5946, 14),
+    ('Hyderabad', 'Telangana', 17.3850, 78.4867, 10),
+    ('Chennai', 'Tamil Nadu', 13.0827, 80.2707, 10),
+    ('Kolkata', 'West Bengal', 22.5726, 88.3639, 10),
+    ('Pune', 'Maharashtra', 18.5204, 73.8567, 8),
+    ('Ahmedabad', 'Gujarat', 23.0225, 72.5714, 7),
+    ('Jaipur', 'Rajasthan', 26.9124, 75.7873, 5),
+    ('Lucknow', 'Uttar Pradesh', 26.8467, 80.9462, 5),
+    ('Nagpur', 'Maharashtra', 21.1458, 79.0882, 3),
+    ('Kolhapur', 'Maharashtra', 16.7050, 74.2433, 2),
+    ('Sindhudurg', 'Maharashtra', 16.3492, 73.5594, 1),
+]
+# Share of people placed anywhere in the bounding box instead of near a city
+RURAL_SHARE = 0.1
+BOUNDS = (8.0, 32.0, 68.0, 89.0)  # min lat, max lat, min lon, max lon
+CITY_SPREAD_KM = 8.0
+
+SPECIALIZATIONS = [
+    ('General Practitioner', 20), ('Pediatrician', 8), ('Dermatologist', 7), ('Cardiologist', 6),
+    ('Obstetrician/Gynecologist', 6), ('Orthopedic Surgeon', 6), ('Psychiatrist', 5), ('Neurologist', 4),
+    ('Gastroenterologist', 4), ('Ophthalmologist', 4), ('Otolaryngologist', 4), ('Endocrinologist', 3),
+    ('Pulmonologist', 3), ('Urologist', 3), ('Rheumatologist', 2), ('Oncologist', 2), ('Radiologist', 2),
+    ('Other', 1),
+]
+
+FIRST_NAMES = ['Aarav', 'Aditi', 'Amit', 'Ananya', 'Arjun', 'Deepa', 'Divya', 'Farhan', 'Gaurav', 'Ishaan',
+               'Kavya', 'Meera', 'Neha', 'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Riya', 'Rohan', 'Sanjay',
+               'Sara', 'Shreya', 'Suresh', 'Tanvi', 'Varun', 'Vikram', 'Yash', 'Zoya']
+LAST_NAMES = ['Bhat', 'Chopra', 'Desai', 'Gupta', 'Iyer', 'Jadhav', 'Joshi', 'Kapoor', 'Khan', 'Kulkarni',
+              'Mehta', 'Menon', 'Nair', 'Patel', 'Patil', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma']
+STREETS = ['MG Road', 'Station Road', 'Park Street', 'Hill Road', 'Link Road', 'Ring Road', 'Market Road',
+           'Church Street', 'College Road', 'Lake View Road']
+
+SYMPTOMS = ['headache', 'fever', 'dry cough', 'sore throat', 'fatigue', 'nausea', 'dizziness', 'back pain',
+            'skin rash', 'itching', 'joint pain', 'shortness of breath', 'chest tightness', 'runny nose',
+            'stomach ache', 'loss of appetite', 'blurred vision', 'ear pain', 'insomnia', 'anxiety']
+CONDITIONS = ['Viral infection', 'Tension headache', 'Migraine', 'Common cold', 'Influenza', 'Gastritis',
+              'Allergic rhinitis', 'Contact dermatitis', 'Muscle strain', 'Anxiety disorder', 'Sinusitis',
+              'Osteoarthritis', 'Asthma', 'Conjunctivitis', 'Otitis media']
+DURATIONS = ['1 day', '2-3 days', 'about a week', 'two weeks', 'over a month']
+SEVERITIES = [('mild', 5), ('moderate', 4), ('severe', 1)]
+REASONS = ['Follow-up consultation', 'Persistent symptoms', 'Routine check-up', 'Prescription renewal',
+           'Test results review', 'New symptoms', 'Second opinion']
+REJECTION_NOTES = ['Fully booked that day, please choose another slot.', 'Please see a specialist instead.',
+                   'Clinic closed for a public holiday.']
+CANCELLATION_NOTES = ['Feeling better now.', 'Schedule conflict.', 'Booked with another doctor.']
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def account_email(user_type, index, seed):
+    return f"{user_type}{index}.s{seed}@{EMAIL_DOMAIN}"
+
+
+def _weighted(pairs):
+    values = [value for value, _ in pairs]
+    cumulative = list(itertools.accumulate(weight for _, weight in pairs))
+    return lambda rng: values[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+
+
+_pick_specialization = _weighted(SPECIALIZATIONS)
+_pick_severity = _weighted(SEVERITIES)
+_pick_city = _weighted([(index, city[4]) for index, city in enumerate(CITIES)])
+
+
+def _location(rng):
+    """(city index or None, latitude, longitude)."""
+    if rng.random() < RURAL_SHARE:
+        return None, rng.uniform(BOUNDS[0], BOUNDS[1]), rng.uniform(BOUNDS[2], BOUNDS[3])
+    index = _pick_city(rng)
+    _, _, lat, lon, _ = CITIES[index]
+    north, east = rng.gauss(0, CITY_SPREAD_KM), rng.gauss(0, CITY_SPREAD_KM)
+    return (index, round(lat + north / 111.0, 6),
+            round(lon + east / (111.0 * math.cos(math.radians(lat))), 6))
+
+
+def _skewed_index(rng, count):
+    """Index in range(count), low indices more likely: the first 1% get 10% of the picks."""
+    return int(count * rng.random() ** 2)
+
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _phone(rng):
+    return f"+91 {rng.randint(70000, 99999)} {rng.randint(10000, 99999)}"
+
+
+def _address(rng):
+    return f"{rng.randint(1, 400)}, {rng.choice(STREETS)}"
+
+
+def _zip(rng, city_index):
+    return str(400001 + (city_index if city_index is not None else 99) * 1000 + rng.randrange(100))
+
+
+def _analysis(rng, symptoms):
+    conditions = rng.sample(CONDITIONS, 3)
+    confidence = ['High', 'Medium', 'Low']
+    lines = [f"- {condition} ({level} confidence): consistent with {symptoms}"
+             for condition, level in zip(conditions, confidence)]
+    return ("Possible Conditions:\n" + '\n'.join(lines) +
+            f"\n\nKey Symptoms Analysis:\n- {symptoms}\n\nRisk Factors:\n- None reported\n\n"
+            "Recommended Next Steps:\n- Rest and fluids\n- See a doctor if symptoms persist\n\n"
+            "When to Seek Immediate Medical Attention:\n- Difficulty breathing or chest pain\n\n"
+            "Recommended Medical Specialties:\n- General Practitioner")
+
+
+class Generator:
+    """Builds the population in a fresh database; call run()."""
+
+    def __init__(self, seed=1, batch_size=DEFAULT_BATCH_SIZE, today=None, echo=print, **counts):
+        self.seed = seed
+        self.batch_size = batch_size
+        self.echo = echo
+        self.counts = counts
+        # Dates are relative to this day, so upcoming appointments stay upcoming
+        self.today = today or date.today()
+        self.password_hash = None
+
+    def _rng(self, name):
+        return random.Random(f"{self.seed}-{name}")
+
+    def _insert(self, model, rows):
+        from app import db
+        table = model.__table__
+        began = time.perf_counter()
+        total = 0
+        for batch in iter(lambda: list(itertools.islice(rows, self.batch_size)), []):
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            total += len(batch)
+        elapsed = time.perf_counter() - began
+        self.echo(f"  {table.name:<14} {total:>9,} rows in {elapsed:6.1f}s ({total / max(elapsed, 1e-9):,.0f}/s)")
+        return total
+
+    def _next_id(self, model):
+        from app import db
+        from sqlalchemy import func, select
+        return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+    def run(self):
+        from app import db
+        from models import User
+        from werkzeug.security import generate_password_hash
+
+        if db.session.query(User.id).filter_by(email=account_email('doctor', 0, self.seed)).first():
+            raise SystemExit(f"Seed {self.seed} has already been generated in this database; use a fresh one")
+        self.password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+        began = time.perf_counter()
+        doctors = self.doctors()
+        patients = self.patients()
+        appointments = self.appointments(doctors, patients)
+        self.notifications(doctors, patients, appointments)
+        self.symptom_checks(patients)
+        self._reset_sequences()
+        self.echo(f"Generated in {time.perf_counter() - began:.1f}s")
+        return {'doctors': len(doctors), 'patients': len(patients), 'appointments': len(appointments)}
+
+    def _people(self, user_type, model, count, extra):
+        from models import User
+        rng = self._rng(user_type)
+        first_user, first_row = self._next_id(User), self._next_id(model)
+        people = []  # (user id, row id, city index)
+        users, rows = [], []
+        for index in range(count):
+            city, lat, lon = _location(rng)
+            user_id, row_id = first_user + index, first_row + index
+            joined = datetime.combine(self.today, dt_time()) - timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+            users.append({'id': user_id, 'email': account_email(user_type, index, self.seed),
+                          'password_hash': self.password_hash, 'user_type': user_type,
+                          'created_at': joined, 'updated_at': joined})
+            row = {
+                'id': row_id, 'user_id': user_id, 'name': _name(rng), 'phone': _phone(rng),
+                'address': _address(rng),
+                'city': CITIES[city][0] if city is not None else None,
+                'state': CITIES[city][1] if city is not None else None,
+                'zip_code': _zip(rng, city), 'latitude': lat, 'longitude': lon,
+            }
+            row.update(extra(rng))
+            rows.append(row)
+            people.append((user_id, row_id, city))
+        self._insert(User, iter(users))
+        self._insert(model, iter(rows))
+        return people
+
+    def doctors(self):
+        from models import Doctor
+        return self._people('doctor', Doctor, self.counts['doctors'], lambda rng: {
+            'name': 'Dr. ' + _name(rng), 'specialization': _pick_specialization(rng),
+            'bio': f"{rng.randint(2, 35)} years of clinical practice.",
+        })
+
+    def patients(self):
+        from models import Patient
+        return self._people('patient', Patient, self.counts['patients'], lambda rng: {
+            'dob': date(rng.randint(1940, 2022), rng.randint(1, 12), rng.randint(1, 28)),
+            'gender': rng.choice(['male', 'female', 'other']),
+        })
+
+    def appointments(self, doctors, patients):
+        """Returns (doctor index, patient index, status, created at, notes) per appointment."""
+        from models import Appointment
+        rng = self._rng('appointments')
+        by_city = {}
+        for index, (_, _, city) in enumerate(doctors):
+            by_city.setdefault(city, []).append(index)
+        first_id = self._next_id(Appointment)
+        appointments = []
+
+        def rows():
+            for n in range(self.counts['appointments']):
+                patient = _skewed_index(rng, len(patients))
+                nearby = by_city.get(patients[patient][2])
+                doctor = (rng.choice(nearby) if nearby and rng.random() < 0.8
+                          else _skewed_index(rng, len(doctors)))
+                day = self.today + timedelta(days=rng.randint(-365, 60))
+                created = datetime.combine(day, dt_time()) - timedelta(hours=rng.randint(2, 30 * 24))
+                if day >= self.today:
+                    status = rng.choices(['pending', 'approved', 'scheduled', 'cancelled'], [4, 4, 1, 1])[0]
+                else:
+                    status = rng.choices(['completed', 'rejected', 'cancelled'], [8, 1, 1])[0]
+                notes = (rng.choice(REJECTION_NOTES) if status == 'rejected'
+                         else rng.choice(CANCELLATION_NOTES) if status == 'cancelled' else None)
+                appointments.append((doctor, patient, status, created, notes))
+                yield {
+                    'id': first_id + n, 'doctor_id': doctors[doctor][1], 'patient_id': patients[patient][1],
+                    'date': day, 'time': dt_time(9 + rng.randrange(8), rng.choice([0, 15, 30, 45])),
+                    'status': status, 'reason': rng.choice(REASONS), 'notes': notes,
+                    'created_at': created, 'updated_at': created,
+                }
+
+        self._insert(Appointment, rows())
+        return [(first_id + n,) + appointment for n, appointment in enumerate(appointments)]
+
+    def notifications(self, doctors, patients, appointments):
+        from models import Notification
+        from notification_messages import notification_params
+        rng = self._rng('notifications')
+        now = datetime.combine(self.today, dt_time())
+
+        def events(status):
+            yield 'appointment_request', 'doctor'
+            yield 'appointment_pending', 'patient'
+            if status in ('approved', 'scheduled', 'completed'):
+                yield 'appointment_approved', 'patient'
+            if status == 'completed':
+                yield 'appointment_completed', 'patient'
+            if status == 'rejected':
+                yield 'appointment_rejected', 'patient'
+            if status == 'cancelled':
+                yield 'appointment_cancelled', 'doctor'
+
+        history = {status: list(events(status))
+                   for status in ('pending', 'approved', 'scheduled', 'completed', 'rejected', 'cancelled')}
+
+        def rows():
+            for _ in range(self.counts['notifications']):
+                appointment_id, doctor, patient, status, created, notes = appointments[
+                    rng.randrange(len(appointments))]
+                message_type, recipient = rng.choice(history[status])
+                sent = created + timedelta(minutes=rng.randint(0, 3 * 24 * 60))
+                # Older notifications have mostly been read
+                is_read = rng.random() < (0.9 if (now - sent).days > 7 else 0.3)
+                yield {
+                    'user_id': (doctors[doctor] if recipient == 'doctor' else patients[patient])[0],
+                    'appointment_id': appointment_id, 'message': '', 'type': message_type,
+                    'params': notification_params(notes if message_type in ('appointment_rejected',
+                                                                            'appointment_cancelled') else None),
+                    'is_read': is_read, 'created_at': sent,
+                }
+
+        self._insert(Notification, rows())
+
+    def symptom_checks(self, patients):
+        from check_summary import summary_values
+        from models import SymptomCheck
+        from routes import ANALYSIS_VERSION
+        rng = self._rng('symptom_checks')
+        now = datetime.combine(self.today, dt_time())
+
+        def rows():
+            for _ in range(self.counts['symptom_checks']):
+                symptoms = ', '.join(rng.sample(SYMPTOMS, rng.randint(1, 4)))
+                analysis = _analysis(rng, symptoms)
+                row = {
+                    'patient_id': patients[_skewed_index(rng, len(patients))][1], 'symptoms': symptoms,
+                    'age': rng.randint(1, 90), 'gender': rng.choice(['male', 'female', 'other']),
+                    'duration': rng.choice(DURATIONS), 'severity': _pick_severity(rng),
+                    'medical_history': rng.choice(['', 'None', 'Asthma', 'Type 2 diabetes', 'Hypertension']),
+                    'ai_analysis': analysis, 'analysis_version': ANALYSIS_VERSION,
+                    'prompt_tokens': rng.randint(300, 900),
+                    'created_at': now - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+                }
+                row.update(summary_values(symptoms, analysis, None))
+                yield row
+
+        self._insert(SymptomCheck, rows())
+
+    def _reset_sequences(self):
+        from app import db
+        from sqlalchemy import text
+        from models import User, Doctor, Patient, Appointment
+        if db.engine.dialect.name != 'postgresql':
+            return
+        # Rows were inserted with explicit ids; move the id sequences past them
+        for model in (User, Doctor, Patient, Appointment):
+            table = db.engine.dialect.identifier_preparer.format_table(model.__table__)
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+            ))
+        db.session.commit()
+
+
+def counts_for(scale, **overrides):
+    counts = dict(SCALES[scale])
+    counts.update({name: value for name, value in overrides.items() if value is not None})
+    return counts
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected YYYY-MM-DD')
+
+
+def add_arguments(parser):
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', type=_date, help='reference day the dates are relative to (default: today)')
+    for name in SCALES['small']:
+        parser.add_argument('--' + name.replace('_', '-'), type=int, help=f"overrides the scale's {name}")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+
+def generate(args):
+    """Generate from parsed add_arguments() options; main must already be imported.
+
+    Sets args.today to the reference day used when it was not given.
+    """
+    from app import app
+    counts = counts_for(args.scale, **{name: getattr(args, name) for name in SCALES['small']})
+    args.today = args.today or date.today()
+    print(f"Generating seed {args.seed} as of {args.today}: "
+          + ', '.join(f"{value:,} {name}" for name, value in counts.items()))
+    with app.app_context():
+        return Generator(seed=args.seed, batch_size=args.batch_size, today=args.today, **counts).run()
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default='sqlite:///' + os.path.join(ROOT, 'synthetic.db'))
+    add_arguments(parser)
+    args = parser.parse_args()
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('DATABASE_REPLICA_URLS', '')
+    sys.path.insert(0, ROOT)
+    import main  # noqa: F401
+    generate(args)
+
+
+if __name__ == '__main__':
+    main_()
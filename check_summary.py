@@ -0,0 +1,144 @@
+#check_summary.py
+# Summary fields for symptom checks.
+#
+# List views (the dashboard's recent checks) only show a date, a symptom
+# snippet, the top condition and severity, so those are computed once when a
+# check is written and stored next to it. The heavy analysis and image columns
+# are deferred on the model and only loaded when a check is opened.
+# `flask summaries backfill` fills the fields in for rows written before they
+# existed; run it when deploying the columns. Until then list views show a
+# placeholder for those rows rather than loading the deferred columns.
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select, update
+
+from app import app, db
+from models import SymptomCheck
+
+SNIPPET_LENGTH = 160
+CONDITION_LENGTH = 120
+
+CONDITIONS_SECTION = 'Possible Conditions:'
+
+# Columns a list view needs; use with load_only(*SUMMARY_COLUMNS)
+SUMMARY_COLUMNS = [
+    SymptomCheck.id, SymptomCheck.created_at, SymptomCheck.severity, SymptomCheck.symptom_snippet,
+    SymptomCheck.top_condition, SymptomCheck.has_image, SymptomCheck.has_analysis,
+]
+
+_SOURCE_FIELDS = ('symptoms', 'ai_analysis', 'image_data', 'image_sha256')
+
+_LIST_PREFIX_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*')
+# "Migraine (High confidence): ..." -> "Migraine"
+_CONDITION_RE = re.compile(r'^(.+?)\s*(?:\(|:|–|—| - |$)')
+
+
+def snippet(text, length=SNIPPET_LENGTH):
+    text = ' '.join((text or '').split())
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1].rsplit(' ', 1)[0] or text[:length - 1]
+    return cut + '…'
+
+
+def top_condition(analysis):
+    """First condition listed under "Possible Conditions:" in a text analysis."""
+    if not analysis:
+        return None
+    start = analysis.find(CONDITIONS_SECTION)
+    if start < 0:
+        return None
+    for line in analysis[start + len(CONDITIONS_SECTION):].split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if line.endswith(':') and not _LIST_PREFIX_RE.match(line):
+            break  # next section heading; no conditions listed
+        if line.startswith('['):
+            continue  # template placeholder echoed back by the model
+        item = _LIST_PREFIX_RE.sub('', line)
+        match = _CONDITION_RE.match(item)
+        name = match.group(1).strip() if match else item
+        if name:
+            return snippet(name, CONDITION_LENGTH)
+    return None
+
+
+def summary_values(symptoms, ai_analysis, image_data):
+    return {
+        'symptom_snippet': snippet(symptoms),
+        'top_condition': top_condition(ai_analysis),
+        'has_image': bool(image_data),
+        'has_analysis': bool(ai_analysis),
+    }
+
+
+def _apply(check, changed_only):
+    state = inspect(check)
+    if changed_only and not any(state.attrs[name].history.has_changes() for name in _SOURCE_FIELDS):
+        return
+    # On update, deferred columns that were neither loaded nor set keep their
+    # stored summary instead of being loaded here
+    unloaded = state.unloaded if changed_only else set()
+    values = summary_values(
+        check.symptoms,
+        None if 'ai_analysis' in unloaded else check.ai_analysis,
+        check.image_sha256 or (None if 'image_data' in unloaded else check.image_data),
+    )
+    if 'ai_analysis' in unloaded:
+        del values['top_condition'], values['has_analysis']
+    if 'image_data' in unloaded and not check.image_sha256:
+        del values['has_image']
+    for name, value in values.items():
+        setattr(check, name, value)
+
+
+@event.listens_for(SymptomCheck, 'before_insert')
+def _summarize_new_check(mapper, connection, check):
+    _apply(check, changed_only=False)
+
+
+@event.listens_for(SymptomCheck, 'before_update')
+def _summarize_changed_check(mapper, connection, check):
+    _apply(check, changed_only=True)
+
+
+def backfill(batch_size=500):
+    """Fill summary fields on rows written before they existed. Returns rows updated."""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(
+                SymptomCheck.id, SymptomCheck.symptoms, SymptomCheck.ai_analysis,
+                (SymptomCheck.image_data.isnot(None) | SymptomCheck.image_sha256.isnot(None)).label('has_image')
+            ).where(
+                SymptomCheck.id > last_id,
+                SymptomCheck.has_analysis.is_(None)
+            ).order_by(SymptomCheck.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        # Bulk UPDATE by primary key; bypasses the listeners above
+        db.session.execute(update(SymptomCheck), [
+            dict(summary_values(row.symptoms, row.ai_analysis, None), id=row.id, has_image=bool(row.has_image))
+            for row in rows
+        ])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+
+
+summaries_cli = AppGroup('summaries', help='Maintain symptom check summary fields.')
+
+
+@summaries_cli.command('backfill')
+@click.option('--batch-size', default=500, show_default=True)
+def backfill_command(batch_size):
+    """Compute summary fields for symptom checks that lack them."""
+    click.echo(f"Updated {backfill(batch_size)} symptom checks")
+
+
+app.cli.add_command(summaries_cli)
@@ -0,0 +1,146 @@
+#commit_hooks.py
+# Callbacks that run after a transaction commits, for in-memory indexes that
+# mirror table rows. Changes are captured at flush time (while the rows are
+# still attached to the session) and handed to the callbacks only once the
+# transaction has committed; a rollback discards them.
+#
+# Snapshots only hold attributes already loaded on the object: reading a
+# deferred or expired column in after_flush would load it from the database
+# in the middle of the flush. Hooks must cope with missing fields.
+#
+# Hooks only see commits made in their own process. For a model registered
+# with versioned=True every transaction that changes its rows also bumps a
+# DataVersion row, in the same transaction; an index compares the version it
+# was built at with table_version() before use and reloads when another
+# process (a web worker, a `flask doctors import`) has changed the table.
+# Such hooks get (version before, version after) the commit, and apply the
+# changes only if their index was at the version before.
+import logging
+
+from sqlalchemy import event, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+_hooks = []
+
+_versioned = set()
+
+_CHANGES_KEY = 'commit_hook_changes'
+_VERSIONS_KEY = 'commit_hook_versions'
+
+
+def after_commit(model, fields, versioned=False):
+    """Register fn(changes) to run after commits touching `model` rows.
+
+    `changes` is a list of (op, snapshot) tuples where op is 'insert', 'update'
+    or 'delete' and snapshot is a dict with `id` plus those of the requested
+    fields that were loaded on the object (all of them for a new object).
+    With versioned=True the model's table version is kept and the hook is
+    called as fn(changes, (version before, version after)).
+    """
+    def decorator(fn):
+        if versioned:
+            _versioned.add(model)
+        _hooks.append((model, ('id',) + tuple(fields), fn, versioned))
+        return fn
+    return decorator
+
+
+def table_version(session, model):
+    """Committed version of a versioned model's table (0 until it is first changed)."""
+    return session.execute(
+        select(DataVersion.version).where(DataVersion.name == model.__tablename__)
+    ).scalar() or 0
+
+
+def _bump_version(session, model):
+    """Add one to the table's version in the current transaction and remember it for the hooks."""
+    name = model.__tablename__
+    connection = session.connection()
+    table = DataVersion.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table).values(name=name, version=1)
+        stmt = stmt.on_conflict_do_update(index_elements=[table.c.name], set_={'version': table.c.version + 1})
+        version = connection.execute(stmt.returning(table.c.version)).scalar_one()
+    else:
+        if not connection.execute(
+            update(table).where(table.c.name == name).values(version=table.c.version + 1)
+        ).rowcount:
+            connection.execute(insert(table).values(name=name, version=1))
+        version = connection.execute(select(table.c.version).where(table.c.name == name)).scalar_one()
+    # The row stays locked until the transaction ends, so nobody else bumps it in between
+    versions = session.info.setdefault(_VERSIONS_KEY, {})
+    versions[name] = (versions[name][0] if name in versions else version - 1, version)
+
+
+def record(session, model, op, snapshots):
+    """Report changes made with bulk insert/update/delete statements.
+
+    Bulk statements bypass the flush, so callers that use them on hooked
+    models pass the affected rows here; missing fields are left out as for
+    unloaded attributes.
+    """
+    changes = session.info.setdefault(_CHANGES_KEY, [])
+    for index, (hook_model, fields, _, _) in enumerate(_hooks):
+        if issubclass(model, hook_model):
+            for snapshot in snapshots:
+                changes.append((index, op, {name: snapshot[name] for name in fields if name in snapshot}))
+    if snapshots:
+        for versioned_model in _versioned:
+            if issubclass(model, versioned_model):
+                _bump_version(session, versioned_model)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    if not _hooks:
+        return
+    changes = session.info.setdefault(_CHANGES_KEY, [])
+    changed = set()
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if op == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            state = None
+            for index, (model, fields, _, _) in enumerate(_hooks):
+                if isinstance(obj, model):
+                    state = state or inspect(obj)
+                    unloaded = state.unloaded
+                    snapshot = {name: state.attrs[name].loaded_value for name in fields if name not in unloaded}
+                    changes.append((index, op, snapshot))
+                    if model in _versioned:
+                        changed.add(model)
+    for model in changed:
+        _bump_version(session, model)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_hooks(session):
+    changes = session.info.pop(_CHANGES_KEY, None)
+    versions = session.info.pop(_VERSIONS_KEY, {})
+    if not changes:
+        return
+    by_hook = {}
+    for index, op, snapshot in changes:
+        by_hook.setdefault(index, []).append((op, snapshot))
+    for index, hook_changes in by_hook.items():
+        model, _, fn, versioned = _hooks[index]
+        try:
+            if versioned:
+                fn(hook_changes, versions[model.__tablename__])
+            else:
+                fn(hook_changes)
+        except Exception as e:
+            # Index maintenance must never fail a request that already committed
+            logger.error(f"Commit hook {fn.__name__} failed: {str(e)}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
+    session.info.pop(_VERSIONS_KEY, None)
@@ -0,0 +1,300 @@
+#compressed_text.py
+# Transparent compression for large, repetitive text columns.
+#
+# CompressedText is a TypeDecorator over Text. Values are compressed with zstd
+# (when the zstandard package is installed) or zlib, using a shared preset
+# dictionary primed with the section headings and phrases every AI analysis
+# repeats, and stored ASCII85-armoured behind a short header:
+#
+#     "\x1bCT1" <codec: z|s> <dictionary id: 2 hex digits> ":" <ascii85 payload>
+#
+# The armour keeps the columns TEXT, so existing tables need no type change
+# (PostgreSQL text cannot hold raw bytes, and converting to bytea rewrites the
+# table). Values without the header are legacy plaintext and are returned as
+# they are; short values are stored as plaintext too. Decompression happens
+# when a column is loaded, and the compressed columns are deferred, so that is
+# on first attribute access.
+#
+# `flask compression migrate` re-encodes existing rows in small batches;
+# `flask compression train` builds a dictionary from stored values;
+# `flask compression stats` reports stored versus logical bytes.
+import base64
+import os
+import zlib
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Text, func, select, update, bindparam, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+from app import app, db
+from config import COMPRESSION_LEVEL, COMPRESSION_MIN_BYTES, COMPRESSION_DICT_ID, COMPRESSION_DICT_DIR
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used without it
+    zstandard = None
+
+HEADER = '\x1bCT1'
+CODEC_ZLIB = 'z'
+CODEC_ZSTD = 's'
+
+# Dictionary 1. Frozen: rows written with it must stay readable, so changes
+# go into a new dictionary id instead. zlib favours matches near the end of
+# the dictionary, so the most common strings come last.
+BUILTIN_DICTIONARY = (
+    "This is for educational purposes only and not a substitute for professional medical diagnosis. "
+    "Note: This is an AI-generated analysis for informational purposes only. Please consult with a "
+    "healthcare provider for proper medical diagnosis and treatment.\n"
+    "consult a healthcare provider if symptoms persist or worsen. seek immediate medical attention if "
+    "you experience difficulty breathing, chest pain, high fever, confusion, severe pain, "
+    "Stay hydrated and get plenty of rest. over-the-counter pain relievers such as "
+    "acetaminophen or ibuprofen as directed. Maintain a healthy diet and regular exercise. "
+    "Dermatologist\n- General Practitioner\n- Neurologist\n- Cardiologist\n- Pulmonologist\n"
+    "- Gastroenterologist\n- Orthopedist\n- ENT Specialist\n- Allergist\n"
+    "Visual Findings:\n\nPotential Diagnoses:\n\nRecommended Medical Specialties:\n\nImportant Notes:\n"
+    "(Low confidence): (Medium confidence): (High confidence): The patient reports "
+    "symptoms may indicate commonly presents with characterized by\n"
+    "Risk Factors:\n- \n\nWarning Signs:\n- \n\nPreventive Measures:\n1. \n2. \n3. \n\n"
+    "Key Symptoms Analysis:\n- \n\nRecommended Next Steps:\n1. \n2. \n3. \n\n"
+    "Possible Conditions:\n- "
+).encode('utf-8')
+
+MAX_ZLIB_DICTIONARY = 32 * 1024
+
+_dictionaries = {0: b'', 1: BUILTIN_DICTIONARY}
+
+
+def load_dictionaries(directory=COMPRESSION_DICT_DIR):
+    """Load trained dictionaries saved as <id>.dict (ids 2-255)."""
+    if not directory or not os.path.isdir(directory):
+        return _dictionaries
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == '.dict' and stem.isdigit() and 2 <= int(stem) <= 255:
+            with open(os.path.join(directory, name), 'rb') as f:
+                _dictionaries[int(stem)] = f.read()
+    return _dictionaries
+
+
+def _zstd_dict(dictionary_id):
+    return zstandard.ZstdCompressionDict(_dictionaries[dictionary_id]) if dictionary_id else None
+
+
+def compress_text(value, dictionary_id=None):
+    """Encode a string for storage; returns it unchanged when compression does not pay."""
+    if value is None:
+        return None
+    raw = value.encode('utf-8')
+    if len(raw) < COMPRESSION_MIN_BYTES and not value.startswith(HEADER):
+        return value
+    dictionary_id = COMPRESSION_DICT_ID if dictionary_id is None else dictionary_id
+    dictionary = _dictionaries[dictionary_id]
+    if zstandard is not None:
+        codec = CODEC_ZSTD
+        compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=_zstd_dict(dictionary_id))
+        payload = compressor.compress(raw)
+    else:
+        codec = CODEC_ZLIB
+        compressor = zlib.compressobj(min(COMPRESSION_LEVEL, 9), zlib.DEFLATED, -15,
+                                      zdict=dictionary[-MAX_ZLIB_DICTIONARY:] or None) \
+            if dictionary else zlib.compressobj(min(COMPRESSION_LEVEL, 9), zlib.DEFLATED, -15)
+        payload = compressor.compress(raw) + compressor.flush()
+    encoded = f"{HEADER}{codec}{dictionary_id:02x}:{base64.a85encode(payload).decode('ascii')}"
+    # A plaintext value that happens to start with the header must be encoded
+    if len(encoded) >= len(value) and not value.startswith(HEADER):
+        return value
+    return encoded
+
+
+def decompress_text(value):
+    if value is None or not value.startswith(HEADER):
+        return value
+    codec = value[len(HEADER)]
+    dictionary_id = int(value[len(HEADER) + 1:len(HEADER) + 3], 16)
+    if dictionary_id not in _dictionaries:
+        load_dictionaries()
+    payload = base64.a85decode(value[len(HEADER) + 4:])
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('The zstandard package is required to read this value')
+        raw = zstandard.ZstdDecompressor(dict_data=_zstd_dict(dictionary_id)).decompress(payload)
+    else:
+        dictionary = _dictionaries[dictionary_id]
+        decompressor = zlib.decompressobj(-15, zdict=dictionary[-MAX_ZLIB_DICTIONARY:]) \
+            if dictionary else zlib.decompressobj(-15)
+        raw = decompressor.decompress(payload) + decompressor.flush()
+    return raw.decode('utf-8')
+
+
+def is_compressed(value):
+    return value is not None and value.startswith(HEADER)
+
+
+class CompressedText(TypeDecorator):
+    """Text column stored compressed; see the module docstring for the format."""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+
+load_dictionaries()
+
+
+# Maintenance commands
+
+def compressed_columns():
+    from models import SymptomCheck, ImageAnalysisSection, Patient
+    return [
+        (SymptomCheck, 'ai_analysis'),
+        (SymptomCheck, 'image_analysis'),
+        (ImageAnalysisSection, 'section_content'),
+        (Patient, 'medical_history'),
+    ]
+
+
+def _stored(model, column_name):
+    # The stored (encoded) value, bypassing CompressedText
+    return type_coerce(getattr(model, column_name), Text)
+
+
+def migrate_column(session, model, column_name, batch_size=200, dictionary_id=None, force=False):
+    """Re-encode one column in keyset batches, each committed on its own.
+
+    Rows already compressed are skipped unless force=True (used after a new
+    dictionary is activated). Returns (rows rewritten, bytes before, bytes after).
+    """
+    dictionary_id = COMPRESSION_DICT_ID if dictionary_id is None else dictionary_id
+    table = model.__table__
+    stored = _stored(model, column_name)
+    rewritten = before = after = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(model.id, stored).where(
+                model.id > last_id,
+                stored.isnot(None)
+            ).order_by(model.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return rewritten, before, after
+        last_id = rows[-1][0]
+
+        changes = []
+        for row_id, value in rows:
+            if is_compressed(value) and not force:
+                continue
+            encoded = compress_text(decompress_text(value), dictionary_id)
+            if encoded != value:
+                changes.append({'row_id': row_id, 'value': encoded})
+                before += len(value.encode('utf-8'))
+                after += len(encoded.encode('utf-8'))
+        if changes:
+            # Plain Text binding: the values are already encoded
+            session.execute(
+                update(table).where(table.c.id == bindparam('row_id')).values(
+                    {column_name: bindparam('value', type_=Text)}
+                ),
+                changes
+            )
+            rewritten += len(changes)
+        session.commit()
+
+
+def column_stats(session, model, column_name):
+    stored = _stored(model, column_name)
+    rows, compressed, stored_bytes = session.execute(
+        select(
+            func.count(stored),
+            func.count(stored).filter(stored.like(HEADER + '%')),
+            func.coalesce(func.sum(func.length(stored)), 0)
+        )
+    ).one()
+    logical_bytes = 0
+    for (value,) in session.execute(select(getattr(model, column_name)).where(stored.isnot(None))).yield_per(500):
+        logical_bytes += len(value)
+    return {'rows': rows, 'compressed': compressed, 'stored_chars': stored_bytes, 'logical_chars': logical_bytes}
+
+
+def train_dictionary(samples, size=16 * 1024):
+    """Build a dictionary from sample values.
+
+    With zstandard this is a trained zstd dictionary; otherwise the most
+    frequent lines are packed into a zlib preset dictionary, commonest last.
+    """
+    if zstandard is not None and len(samples) >= 10:
+        return zstandard.train_dictionary(size, [s.encode('utf-8') for s in samples]).as_bytes()
+    counts = Counter(line.strip() for sample in samples for line in sample.split('\n') if len(line.strip()) > 3)
+    chunks = []
+    total = 0
+    for line, count in counts.most_common():
+        if count < 2:
+            break
+        chunk = (line + '\n').encode('utf-8')
+        if total + len(chunk) > min(size, MAX_ZLIB_DICTIONARY):
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(reversed(chunks))
+
+
+compression_cli = AppGroup('compression', help='Manage compressed text columns.')
+
+
+@compression_cli.command('migrate')
+@click.option('--batch-size', default=200, show_default=True)
+@click.option('--force', is_flag=True, help='Re-encode values that are already compressed (e.g. with a new dictionary).')
+def migrate_command(batch_size, force):
+    """Compress existing plaintext values in place, in batches."""
+    for model, column_name in compressed_columns():
+        rewritten, before, after = migrate_column(db.session, model, column_name, batch_size, force=force)
+        saved = f", {100 - after * 100 // before}% smaller" if before else ''
+        click.echo(f"{model.__tablename__}.{column_name}: {rewritten} rows, {before} -> {after} bytes{saved}")
+
+
+@compression_cli.command('stats')
+def stats_command():
+    """Show stored and logical sizes of the compressed columns."""
+    for model, column_name in compressed_columns():
+        stats = column_stats(db.session, model, column_name)
+        ratio = stats['logical_chars'] / stats['stored_chars'] if stats['stored_chars'] else 0
+        click.echo(f"{model.__tablename__}.{column_name}: {stats['rows']} values ({stats['compressed']} compressed), "
+                   f"{stats['stored_chars']} stored / {stats['logical_chars']} logical chars ({ratio:.1f}x)")
+
+
+@compression_cli.command('train')
+@click.argument('dictionary_id', type=click.IntRange(2, 255))
+@click.option('--samples', default=2000, show_default=True)
+@click.option('--size', default=16 * 1024, show_default=True)
+def train_command(dictionary_id, samples, size):
+    """Train a dictionary from stored analyses and save it as <id>.dict.
+
+    Activate it with COMPRESSION_DICT_ID=<id>, then run `migrate --force`.
+    Keep every dictionary file that rows were written with.
+    """
+    path = os.path.join(COMPRESSION_DICT_DIR, f"{dictionary_id}.dict")
+    if os.path.exists(path):
+        raise click.ClickException(f"{path} exists; dictionaries are immutable once used")
+    values = []
+    for model, column_name in compressed_columns():
+        column = getattr(model, column_name)
+        values += db.session.execute(
+            select(column).where(column.isnot(None)).order_by(model.id.desc()).limit(samples)
+        ).scalars().all()
+    if not values:
+        raise click.ClickException('No stored values to train on')
+    dictionary = train_dictionary(values, size)
+    os.makedirs(COMPRESSION_DICT_DIR, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(dictionary)
+    click.echo(f"Wrote {len(dictionary)} byte dictionary from {len(values)} samples to {path}")
+
+
+app.cli.add_command(compression_cli)
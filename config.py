@@ -4,19 +4,127 @@ import os
 # Google Gemini API
 # Google Gemini API
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
+GEMINI_TEXT_MODEL = os.environ.get('GEMINI_TEXT_MODEL', 'gemini-2.0-flash')
+GEMINI_VISION_MODEL = os.environ.get('GEMINI_VISION_MODEL', 'gemini-pro-vision')
 
 
 # Database configuration
-DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///healthcare.db')
+DATABASE_URL = os.environ.get('DATABASE_URL')  # else built from the PG* variables, else sqlite:///healthcare.db
 PGPORT = os.environ.get('PGPORT')
 PGDATABASE = os.environ.get('PGDATABASE')
 PGPASSWORD = os.environ.get('PGPASSWORD')
 PGHOST = os.environ.get('PGHOST')
 PGUSER = os.environ.get('PGUSER')
 
+# Engine profiles (see db_engine.py): auto, sqlite, postgresql or basic
+DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'auto')
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds to wait for a pooled connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))  # 0 disables
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 60000))  # 0 disables
+DB_QUERY_CACHE_SIZE = int(os.environ.get('DB_QUERY_CACHE_SIZE', 1000))  # compiled statements kept by SQLAlchemy
+PG_PREPARE_THRESHOLD = int(os.environ.get('PG_PREPARE_THRESHOLD', 5))  # psycopg 3 only
+
+# Read replicas (see db_routing.py); comma-separated database URLs
+DATABASE_REPLICA_URLS = [u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', 5))  # reads stay on the primary after a write
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 10))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 3))
+
 # Application configuration
 DEBUG = True
 SECRET_KEY = os.environ.get('SESSION_SECRET', os.urandom(24))
 
 # Google Maps API
 MAPS_API_KEY = os.environ.get('MAPS_API_KEY', '')
+
+# Similar-analysis reuse (see similarity.py)
+SIMILARITY_DIM = int(os.environ.get('SIMILARITY_DIM', 1024))
+SIMILARITY_MAX_ITEMS = int(os.environ.get('SIMILARITY_MAX_ITEMS', 10000))
+SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.6))
+SIMILARITY_IVF_LISTS = int(os.environ.get('SIMILARITY_IVF_LISTS', 0))  # 0 disables IVF partitioning
+SIMILARITY_IVF_PROBES = int(os.environ.get('SIMILARITY_IVF_PROBES', 4))
+
+# Specialty-to-doctor routing (see doctor_routing.py)
+ROUTING_TOP_K = int(os.environ.get('ROUTING_TOP_K', 5))
+ROUTING_SPECIALTY_PENALTY_KM = float(os.environ.get('ROUTING_SPECIALTY_PENALTY_KM', 25))
+
+# Page/fragment caching and static assets (see page_cache.py, static_assets.py)
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))  # 0 disables caching
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 512))
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))  # for fingerprinted files
+
+# Notification outbox and delivery (see outbox.py)
+OUTBOX_CHANNELS = [c.strip() for c in os.environ.get('OUTBOX_CHANNELS', 'email').split(',') if c.strip()]
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 30))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 300))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 5))
+OUTBOX_DISPATCHER_THREAD = os.environ.get('OUTBOX_DISPATCHER_THREAD', '').lower() in ('1', 'true', 'yes')
+
+# Email delivery. Defaults point at a local SMTP stand-in, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
+SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 1025))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', '').lower() in ('1', 'true', 'yes')
+MAIL_FROM = os.environ.get('MAIL_FROM', 'notifications@healthconnect.local')
+SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
+
+# Retention and archival (see retention.py)
+RETENTION_NOTIFICATION_DAYS = int(os.environ.get('RETENTION_NOTIFICATION_DAYS', 90))  # read notifications only
+RETENTION_SYMPTOM_CHECK_DAYS = int(os.environ.get('RETENTION_SYMPTOM_CHECK_DAYS', 365))
+RETENTION_OUTBOX_DAYS = int(os.environ.get('RETENTION_OUTBOX_DAYS', 30))  # sent/failed events are deleted
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', 0.05))  # seconds between batches
+
+# Image uploads (see uploads.py)
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 5 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))  # larger uploads spill to disk
+UPLOAD_ORPHAN_GRACE_SECONDS = int(os.environ.get('UPLOAD_ORPHAN_GRACE_SECONDS', 24 * 3600))  # unreferenced files younger than this are kept
+
+# Compressed text columns (see compressed_text.py)
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 128))  # shorter values are stored as plaintext
+COMPRESSION_DICT_ID = int(os.environ.get('COMPRESSION_DICT_ID', 1))  # dictionary new values are written with; 0 for none
+COMPRESSION_DICT_DIR = os.environ.get('COMPRESSION_DICT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compression_dicts'))
+
+# Offline re-analysis of stored symptom checks (see reanalysis.py)
+REANALYSIS_WORKERS = int(os.environ.get('REANALYSIS_WORKERS', 4))
+REANALYSIS_RATE_PER_MINUTE = float(os.environ.get('REANALYSIS_RATE_PER_MINUTE', 60))  # model calls, all workers
+REANALYSIS_BATCH_SIZE = int(os.environ.get('REANALYSIS_BATCH_SIZE', 50))  # rows per write transaction
+REANALYSIS_MAX_RETRIES = int(os.environ.get('REANALYSIS_MAX_RETRIES', 3))
+
+# Notification text rendering (see notification_messages.py)
+NOTIFICATION_RENDER_CACHE_SIZE = int(os.environ.get('NOTIFICATION_RENDER_CACHE_SIZE', 4096))
+
+# Idempotency keys for symptom checks and bookings (see idempotency.py)
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))  # completed keys are kept this long
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 300))  # an in-flight claim is abandoned after this
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 60))  # duplicates wait this long for the first
+IDEMPOTENCY_POLL_SECONDS = float(os.environ.get('IDEMPOTENCY_POLL_SECONDS', 0.5))  # across processes
+
+# Doctor map clustering (see map_clusters.py)
+MAP_CLUSTER_MAX_ZOOM = int(os.environ.get('MAP_CLUSTER_MAX_ZOOM', 15))  # individual doctors above this zoom
+MAP_CLUSTER_CELL_PX = int(os.environ.get('MAP_CLUSTER_CELL_PX', 64))  # grid cell size on screen; a power of two
+MAP_CLUSTER_MAX_POINTS = int(os.environ.get('MAP_CLUSTER_MAX_POINTS', 500))  # individual doctors per response
+
+# Bulk doctor import (see doctor_import.py)
+DOCTOR_IMPORT_BATCH_SIZE = int(os.environ.get('DOCTOR_IMPORT_BATCH_SIZE', 500))  # rows per transaction
+DOCTOR_IMPORT_WORKERS = int(os.environ.get('DOCTOR_IMPORT_WORKERS', os.cpu_count() or 2))  # password hashing processes
+
+# Daily per-doctor statistics (see doctor_stats.py)
+DOCTOR_STATS_CHECK_WINDOW_DAYS = int(os.environ.get('DOCTOR_STATS_CHECK_WINDOW_DAYS', 7))  # symptom check this recent counts towards a booking
+DOCTOR_STATS_MAX_DAYS = int(os.environ.get('DOCTOR_STATS_MAX_DAYS', 365))  # longest range /api/doctors/me/stats returns
+DOCTOR_STATS_BACKFILL_CHUNK_DAYS = int(os.environ.get('DOCTOR_STATS_BACKFILL_CHUNK_DAYS', 7))  # days rebuilt per transaction
@@ -0,0 +1,110 @@
+#db_engine.py
+# Database URL and engine options, chosen by DB_ENGINE_PROFILE.
+#
+#   sqlite      WAL journal (readers no longer block the writer), synchronous=
+#               NORMAL, a busy timeout instead of immediate "database is
+#               locked" errors, memory-mapped reads and a larger page cache
+#   postgresql  a sized connection pool, server-side statement and
+#               idle-in-transaction timeouts, and prepared statements on
+#               psycopg 3 (psycopg2 has none; SQLAlchemy's compiled-statement
+#               cache is sized either way)
+#   basic       the options the app used before profiles
+#   auto        sqlite or postgresql, from the database URL (the default)
+#
+# Without DATABASE_URL the PG* variables are used when PGHOST is set, and a
+# local healthcare.db otherwise.
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, URL, make_url
+
+from config import (DATABASE_URL, PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD, DB_ENGINE_PROFILE,
+                    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE,
+                    SQLITE_CACHE_SIZE_KB, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+                    DB_STATEMENT_TIMEOUT_MS, DB_IDLE_IN_TRANSACTION_TIMEOUT_MS, DB_QUERY_CACHE_SIZE,
+                    PG_PREPARE_THRESHOLD)
+
+PROFILES = ('auto', 'sqlite', 'postgresql', 'basic')
+
+BASIC_OPTIONS = {
+    'pool_recycle': 300,
+    'pool_pre_ping': True,
+}
+
+# Set by engine_options() for the sqlite profile; applied to every new SQLite connection
+_sqlite_pragmas = []
+
+
+def database_url():
+    if DATABASE_URL:
+        return DATABASE_URL
+    if PGHOST:
+        return URL.create(
+            'postgresql', username=PGUSER, password=PGPASSWORD, host=PGHOST,
+            port=int(PGPORT) if PGPORT else None, database=PGDATABASE
+        ).render_as_string(hide_password=False)
+    return 'sqlite:///healthcare.db'
+
+
+def profile_for(url, profile=DB_ENGINE_PROFILE):
+    if profile not in PROFILES:
+        raise ValueError(f"DB_ENGINE_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+    if profile != 'auto':
+        return profile
+    backend = make_url(url).get_backend_name()
+    return backend if backend in ('sqlite', 'postgresql') else 'basic'
+
+
+def sqlite_pragmas():
+    return [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+    ]
+
+
+def engine_options(url, profile=DB_ENGINE_PROFILE):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL under a profile."""
+    profile = profile_for(url, profile)
+    if profile == 'sqlite':
+        _sqlite_pragmas[:] = sqlite_pragmas()
+        return {
+            'pool_pre_ping': True,
+            'query_cache_size': DB_QUERY_CACHE_SIZE,
+            # pysqlite's own lock wait, in seconds, for the first connection
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    if profile == 'postgresql':
+        server_options = []
+        if DB_STATEMENT_TIMEOUT_MS:
+            server_options.append(f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}")
+        if DB_IDLE_IN_TRANSACTION_TIMEOUT_MS:
+            server_options.append(f"-c idle_in_transaction_session_timeout={DB_IDLE_IN_TRANSACTION_TIMEOUT_MS}")
+        connect_args = {'options': ' '.join(server_options)} if server_options else {}
+        if make_url(url).get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = PG_PREPARE_THRESHOLD
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+            'pool_use_lifo': True,  # idle connections beyond the busy few can time out server-side
+            'query_cache_size': DB_QUERY_CACHE_SIZE,
+            'connect_args': connect_args,
+        }
+    return dict(BASIC_OPTIONS)
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not _sqlite_pragmas or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _sqlite_pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
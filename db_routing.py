@@ -0,0 +1,235 @@
+#db_routing.py
+# Read/write routing between the primary database and read replicas.
+#
+# Replicas are listed in DATABASE_REPLICA_URLS and configured as the binds
+# replica0, replica1, ... (no model is bound to them). RoutingSession sends the
+# queries of views marked @read_only to a healthy replica and everything else,
+# including flushes and INSERT/UPDATE/DELETE statements, to the primary.
+#
+# Read-your-writes: a commit that wrote anything stores its time in the user's
+# session, and for REPLICA_PIN_SECONDS afterwards (or longer, while replicas
+# lag behind that write) that user's reads stay on the primary.
+#
+# Replicas are health-checked (and, on PostgreSQL, their replay lag measured)
+# at most every REPLICA_HEALTH_INTERVAL seconds. A replica that is down or too
+# far behind is skipped, and a read-only view that fails on a replica with a
+# connection error is retried once on the primary.
+#
+# To try it locally with SQLite:
+#     DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db flask replicas sync
+#     flask replicas status
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+import click
+from flask import current_app, g, has_app_context, has_request_context, session as web_session
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.expression import UpdateBase
+
+from db_engine import engine_options
+from config import (DATABASE_REPLICA_URLS, REPLICA_PIN_SECONDS, REPLICA_HEALTH_INTERVAL, REPLICA_MAX_LAG_SECONDS,
+                    REPLICA_CONNECT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica'
+
+# Key in the user's session holding the time of their last write
+WRITE_AT_KEY = 'db_write_at'
+
+_WROTE_KEY = 'db_wrote'
+
+# Seconds behind the primary; 0 when fully replayed or not a streaming standby
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def replica_binds(urls=DATABASE_REPLICA_URLS):
+    """SQLALCHEMY_BINDS entries for the configured replicas."""
+    binds = {}
+    for index, url in enumerate(urls):
+        if url.startswith('postgres'):
+            options = engine_options(url)
+            # Fail fast so an unreachable replica does not stall requests
+            options['connect_args'] = dict(options.get('connect_args', {}), connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            binds[f'{REPLICA_PREFIX}{index}'] = dict(options, url=url)
+        else:
+            binds[f'{REPLICA_PREFIX}{index}'] = url
+    return binds
+
+
+def _replica_engines(engines):
+    return {key: engine for key, engine in engines.items() if key and key.startswith(REPLICA_PREFIX)}
+
+
+class ReplicaHealth:
+    """Last known health and lag of each replica; stale entries are re-checked on use."""
+
+    def __init__(self, interval=REPLICA_HEALTH_INTERVAL, max_lag=REPLICA_MAX_LAG_SECONDS):
+        self.interval = interval
+        self.max_lag = max_lag
+        self._state = {}
+        self._checking = set()
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def check(self, key, engine):
+        try:
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    lag = float(conn.execute(_PG_LAG_SQL).scalar() or 0)
+                else:
+                    conn.execute(text('SELECT 1'))
+                    lag = 0.0
+            state = {'healthy': lag <= self.max_lag, 'lag': lag, 'error': None if lag <= self.max_lag
+                     else f"{lag:.1f}s behind"}
+        except Exception as e:
+            state = {'healthy': False, 'lag': None, 'error': str(e)}
+        state['checked_at'] = time.monotonic()
+        with self._lock:
+            previous = self._state.get(key)
+            self._state[key] = state
+            self._checking.discard(key)
+        if previous and previous['healthy'] != state['healthy']:
+            logger.warning(f"Replica {key} is {'healthy' if state['healthy'] else 'unavailable'}: "
+                           f"{state['error'] or 'ok'}")
+        return state
+
+    def mark_down(self, key, error):
+        with self._lock:
+            self._state[key] = {'healthy': False, 'lag': None, 'error': str(error), 'checked_at': time.monotonic()}
+        logger.warning(f"Replica {key} marked unavailable: {str(error)}")
+
+    def status(self, key):
+        with self._lock:
+            return dict(self._state.get(key) or {})
+
+    def choose(self, engines, write_at=None):
+        """Bind key of a replica to read from, or None to use the primary."""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for key in engines:
+                state = self._state.get(key)
+                if (state is None or now - state['checked_at'] > self.interval) and key not in self._checking:
+                    self._checking.add(key)
+                    stale.append(key)
+        for key in stale:
+            self.check(key, engines[key])
+
+        since_write = time.time() - write_at if write_at else None
+        if since_write is not None and since_write < REPLICA_PIN_SECONDS:
+            return None
+        with self._lock:
+            usable = sorted(
+                key for key in engines
+                if self._state.get(key, {}).get('healthy')
+                # The replica must have replayed the user's last write
+                and (since_write is None or self._state[key]['lag'] < since_write)
+            )
+        if not usable:
+            return None
+        return usable[next(self._turn) % len(usable)]
+
+
+replica_health = ReplicaHealth()
+
+
+def _read_replica_key(engines):
+    if not has_app_context() or not g.get('db_read_only'):
+        return None
+    if 'db_replica' not in g:
+        replicas = _replica_engines(engines)
+        write_at = web_session.get(WRITE_AT_KEY) if has_request_context() else None
+        g.db_replica = replica_health.choose(replicas, write_at) if replicas else None
+    return g.db_replica
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica inside @read_only views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info[_WROTE_KEY] = True
+            elif not self.info.get(_WROTE_KEY):
+                key = _read_replica_key(self._db.engines)
+                if key is not None:
+                    return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(session):
+    if session.info.pop(_WROTE_KEY, False) and has_request_context():
+        web_session[WRITE_AT_KEY] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop(_WROTE_KEY, None)
+
+
+def read_only(view):
+    """Let a view that does not write read from a replica."""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        try:
+            return view(*args, **kwargs)
+        except OperationalError as e:
+            key = g.get('db_replica')
+            if key is None:
+                raise
+            # Fail over: retry once on the primary
+            replica_health.mark_down(key, e.orig)
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.db_read_only = False
+            g.db_replica = None
+            return view(*args, **kwargs)
+    return decorated_function
+
+
+replicas_cli = AppGroup('replicas', help='Inspect read replicas.')
+
+
+@replicas_cli.command('status')
+def replicas_status_command():
+    """Check every replica now and show its health and lag."""
+    engines = _replica_engines(current_app.extensions['sqlalchemy'].engines)
+    if not engines:
+        click.echo('No replicas configured (DATABASE_REPLICA_URLS)')
+    for key, engine in sorted(engines.items()):
+        state = replica_health.check(key, engine)
+        lag = f"{state['lag']:.1f}s behind" if state['lag'] is not None else 'lag unknown'
+        click.echo(f"{key} {engine.url.render_as_string(hide_password=True)}: "
+                   f"{'healthy' if state['healthy'] else 'unavailable'}, {lag}"
+                   + (f" ({state['error']})" if state['error'] else ''))
+
+
+@replicas_cli.command('sync')
+def replicas_sync_command():
+    """Copy a SQLite primary into SQLite replicas (for local testing)."""
+    db = current_app.extensions['sqlalchemy']
+    primary = db.engines[None]
+    engines = _replica_engines(db.engines)
+    if primary.dialect.name != 'sqlite' or any(e.dialect.name != 'sqlite' for e in engines.values()):
+        raise click.ClickException('sync only copies between SQLite databases; use streaming replication otherwise')
+    for key, engine in sorted(engines.items()):
+        source = sqlite3.connect(primary.url.database)
+        target = sqlite3.connect(engine.url.database)
+        with source, target:
+            source.backup(target)
+        source.close()
+        target.close()
+        click.echo(f"Copied {primary.url.database} to {key} ({engine.url.database})")
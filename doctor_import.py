@@ -0,0 +1,360 @@
+#doctor_import.py
+# Bulk onboarding of doctors from a CSV or NDJSON file.
+#
+#   flask doctors import FILE      create a User and Doctor for every valid row
+#   flask doctors import-status    show import checkpoints
+#
+# Columns: email, name and specialization are required; phone, address, city,
+# state, zip_code, latitude, longitude, bio and password are optional. Rows
+# without a password get a random invite token as their initial password,
+# written with the email to the --invites file once the row is committed.
+#
+# The file is streamed in batches. Emails are checked against a set of the
+# registered ones loaded in a single query (and against earlier rows of the
+# file). Password and token hashing, the slow part, runs in a process pool,
+# hashing the next batch while the current one is inserted. Each batch is
+# written with two multi-row INSERT ... RETURNING statements (users, then
+# doctors) in one transaction together with the import's checkpoint, so an
+# interrupted import resumes after the last committed row. A batch that hits
+# a constraint (an email registered meanwhile) is retried row by row. Row
+# errors are reported, and written to --errors, without stopping the import.
+#
+# Each batch also bumps the doctor table's version (see commit_hooks.py), so
+# running web servers reload their routing index and map clusters on their
+# next request; no restart is needed.
+import csv
+import hashlib
+import itertools
+import json
+import os
+import secrets
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from email_validator import EmailNotValidError, validate_email
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+import commit_hooks
+from app import app, db
+from config import DOCTOR_IMPORT_BATCH_SIZE, DOCTOR_IMPORT_WORKERS
+from models import User, Doctor, JobCheckpoint
+
+REQUIRED_COLUMNS = ('email', 'name', 'specialization')
+PROFILE_COLUMNS = ('name', 'specialization', 'phone', 'address', 'city', 'state', 'zip_code', 'latitude',
+                   'longitude', 'bio')
+
+# Row numbers of failed rows kept on a checkpoint
+MAX_FAILED_ROWS = 1000
+# Row errors echoed before only counting them
+MAX_ECHOED_ERRORS = 50
+
+CHECKPOINT_PREFIX = 'doctor-import:'
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path, file_format=None):
+    """Yield (row number, dict or RowError) for each data row of a CSV or NDJSON file."""
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for number, row in enumerate(reader, 1):
+                yield number, {(key or '').strip().lower(): value for key, value in row.items()}
+        else:
+            number = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, RowError(f"invalid JSON: {str(e)}")
+                    continue
+                if not isinstance(row, dict):
+                    yield number, RowError('expected a JSON object')
+                    continue
+                yield number, {str(key).strip().lower(): value for key, value in row.items()}
+
+
+def _text(row, name):
+    value = row.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    column = (Doctor.__table__.c.get(name) if name != 'email' else User.__table__.c.email)
+    length = getattr(column.type, 'length', None) if column is not None else None
+    if length and len(value) > length:
+        raise RowError(f"{name} is longer than {length} characters")
+    return value
+
+
+def _coordinate(row, name, limit):
+    value = row.get(name)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{name} is not a number")
+    if not -limit <= value <= limit:
+        raise RowError(f"{name} is out of range")
+    return value
+
+
+def validate_row(row):
+    """(email, profile dict, password or None) for a raw row; raises RowError."""
+    missing = [name for name in REQUIRED_COLUMNS if not _text(row, name)]
+    if missing:
+        raise RowError(f"missing {', '.join(missing)}")
+    try:
+        email = validate_email(_text(row, 'email'), check_deliverability=False).normalized
+    except EmailNotValidError as e:
+        raise RowError(f"invalid email: {str(e)}")
+    profile = {name: _text(row, name) for name in PROFILE_COLUMNS if name not in ('latitude', 'longitude')}
+    profile['latitude'] = _coordinate(row, 'latitude', 90)
+    profile['longitude'] = _coordinate(row, 'longitude', 180)
+    if (profile['latitude'] is None) != (profile['longitude'] is None):
+        raise RowError('latitude and longitude must be given together')
+    password = row.get('password')
+    return email, profile, str(password) if password not in (None, '') else None
+
+
+def registered_emails():
+    """Lower-cased emails of every user, in one query."""
+    return set(db.session.execute(select(func.lower(User.email))).scalars())
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _checkpoint(path, restart):
+    name = (CHECKPOINT_PREFIX + os.path.basename(path))[:80]
+    params = json.dumps({'file': os.path.abspath(path), 'sha256': file_digest(path)}, sort_keys=True)
+    checkpoint = JobCheckpoint.query.filter_by(name=name).first()
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=name)
+        db.session.add(checkpoint)
+    elif not restart and checkpoint.finished_at is None and checkpoint.params == params:
+        return checkpoint
+    # A new file, a changed one or a finished import starts over; rows already
+    # imported are then reported as registered
+    checkpoint.params = params
+    checkpoint.last_id = 0
+    checkpoint.processed = 0
+    checkpoint.failed = 0
+    checkpoint.failed_ids = None
+    checkpoint.last_error = None
+    checkpoint.started_at = datetime.utcnow()
+    checkpoint.updated_at = checkpoint.started_at
+    checkpoint.finished_at = None
+    db.session.commit()
+    return checkpoint
+
+
+def insert_doctors(rows):
+    """Insert (row number, email, profile, password hash) tuples; returns the new doctor ids."""
+    now = datetime.utcnow()
+    user_ids = db.session.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{'email': email, 'password_hash': password_hash, 'user_type': 'doctor', 'created_at': now,
+          'updated_at': now} for _, email, _, password_hash in rows]
+    ).scalars().all()
+    profiles = [dict(profile, user_id=user_id) for (_, _, profile, _), user_id in zip(rows, user_ids)]
+    doctor_ids = db.session.execute(
+        insert(Doctor).returning(Doctor.id, sort_by_parameter_order=True), profiles
+    ).scalars().all()
+    # Bulk statements bypass the flush; this also bumps the doctor table version that web servers check
+    commit_hooks.record(db.session, Doctor, 'insert',
+                        [dict(profile, id=doctor_id) for profile, doctor_id in zip(profiles, doctor_ids)])
+    return doctor_ids
+
+
+class Import:
+    """State of one run of `flask doctors import`."""
+
+    def __init__(self, checkpoint, errors_file=None, invites_file=None, echo=click.echo):
+        self.checkpoint = checkpoint
+        self.errors_file = errors_file
+        self.invites_file = invites_file
+        self.echo = echo
+        self.failed_rows = json.loads(checkpoint.failed_ids or '[]')
+        self.failed_before = checkpoint.failed
+        self.last_error = checkpoint.last_error
+        self.errors = 0
+        self.imported = 0
+
+    def error(self, number, email, message):
+        # Kept here and copied to the checkpoint on commit; a rollback would discard it
+        self.errors += 1
+        self.last_error = f"row {number}: {message}"[:1000]
+        self.failed_rows.append(number)
+        if self.errors <= MAX_ECHOED_ERRORS:
+            self.echo(f"  row {number}{f' ({email})' if email else ''}: {message}")
+        elif self.errors == MAX_ECHOED_ERRORS + 1:
+            self.echo('  further row errors are only counted' + (' and written to the errors file'
+                                                                  if self.errors_file else ''))
+        if self.errors_file:
+            self.errors_file.writerow([number, email or '', message])
+
+    def write(self, rows, last_number):
+        """Insert a batch and advance the checkpoint in one transaction; returns the rows committed."""
+        committed = rows
+        try:
+            if rows:
+                insert_doctors(rows)
+        except IntegrityError:
+            db.session.rollback()
+            committed = []
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        insert_doctors([row])
+                    committed.append(row)
+                except IntegrityError:
+                    self.error(row[0], row[1], 'email already registered')
+        self.checkpoint.last_id = last_number
+        self.checkpoint.processed += len(committed)
+        self.checkpoint.failed = self.failed_before + self.errors
+        self.checkpoint.last_error = self.last_error
+        self.checkpoint.failed_ids = json.dumps(self.failed_rows[-MAX_FAILED_ROWS:])
+        self.checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+        self.imported += len(committed)
+        return committed
+
+
+def run_import(path, file_format=None, batch_size=DOCTOR_IMPORT_BATCH_SIZE, workers=DOCTOR_IMPORT_WORKERS,
+               errors_path=None, invites_path=None, restart=False, echo=click.echo):
+    """Import doctors from a file; returns the checkpoint."""
+    checkpoint = _checkpoint(path, restart)
+    resume_after = checkpoint.last_id
+    known = registered_emails()
+    echo(f"Importing {path}" + (f", resuming after row {resume_after}" if resume_after else '')
+         + f" ({len(known)} registered emails)")
+
+    errors_handle = open(errors_path, 'a', newline='') if errors_path else None
+    invites_handle = open(invites_path, 'a', newline='') if invites_path else None
+    job = Import(checkpoint, csv.writer(errors_handle) if errors_handle else None,
+                 csv.writer(invites_handle) if invites_handle else None, echo)
+    started = time.monotonic()
+    seen = 0
+
+    def batches():
+        """Validated batches: (rows of (number, email, profile, secret, invite), last row number)."""
+        nonlocal seen
+        batch = []
+        number = resume_after
+        for number, row in read_rows(path, file_format):
+            if number <= resume_after:
+                continue
+            seen += 1
+            email = None
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                email, profile, password = validate_row(row)
+                if email.lower() in known:
+                    raise RowError('email already registered')
+                invite = None
+                if password is None:
+                    if not invites_path:
+                        raise RowError('no password (pass --invites to create invite tokens)')
+                    password = invite = secrets.token_urlsafe(16)
+                known.add(email.lower())
+                batch.append((number, email, profile, password, invite))
+            except RowError as e:
+                job.error(number, email or (row.get('email') if isinstance(row, dict) else None), str(e))
+            if len(batch) >= batch_size:
+                yield batch, number
+                batch = []
+        if batch or number > resume_after:
+            yield batch, number
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            def submit(batch):
+                rows, last_number = batch
+                return rows, last_number, [pool.submit(generate_password_hash, row[3]) for row in rows]
+
+            # Hash the next batch while this one is written
+            source = batches()
+            pending = deque(submit(batch) for batch in itertools.islice(source, 2))
+            while pending:
+                rows, last_number, hashes = pending.popleft()
+                hashed = [(number, email, profile, future.result())
+                          for (number, email, profile, _, _), future in zip(rows, hashes)]
+                committed = job.write(hashed, last_number)
+                if invites_handle:
+                    invites = {row[0]: row[4] for row in rows if row[4]}
+                    for number, email, _, _ in committed:
+                        if number in invites:
+                            job.invites_file.writerow([email, invites[number]])
+                    invites_handle.flush()
+                elapsed = time.monotonic() - started
+                echo(f"  through row {last_number}: {job.imported} imported, {job.errors} errors, "
+                     f"{seen / elapsed if elapsed else 0:.0f} rows/s")
+                batch = next(source, None)
+                if batch is not None:
+                    pending.append(submit(batch))
+        checkpoint.finished_at = datetime.utcnow()
+        db.session.commit()
+    finally:
+        if errors_handle:
+            errors_handle.close()
+        if invites_handle:
+            invites_handle.close()
+    echo(f"Imported {job.imported} doctors, {job.errors} rows with errors, "
+         f"in {time.monotonic() - started:.1f}s ({checkpoint.processed} imported from this file in total)")
+    return checkpoint
+
+
+doctors_cli = AppGroup('doctors', help='Manage doctor accounts.')
+
+
+@doctors_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']),
+              help='Default: csv for .csv files, NDJSON otherwise.')
+@click.option('--batch-size', default=DOCTOR_IMPORT_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--workers', default=DOCTOR_IMPORT_WORKERS, show_default=True, help='Password hashing processes.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Append row errors (row, email, error) to this CSV file.')
+@click.option('--invites', 'invites_path', type=click.Path(dir_okay=False),
+              help='Create invite tokens for rows without a password and append them (email, token) here.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint.')
+def import_command(path, **options):
+    """Create doctor accounts from a CSV or NDJSON file."""
+    run_import(path, **options)
+
+
+@doctors_cli.command('import-status')
+def import_status_command():
+    """Show the checkpoints of doctor imports."""
+    for checkpoint in JobCheckpoint.query.filter(
+        JobCheckpoint.name.like(CHECKPOINT_PREFIX + '%')
+    ).order_by(JobCheckpoint.name):
+        state = f"finished {checkpoint.finished_at:%Y-%m-%d %H:%M}" if checkpoint.finished_at else 'in progress'
+        click.echo(f"{checkpoint.name}: {state}, through row {checkpoint.last_id}, {checkpoint.processed} imported, "
+                   f"{checkpoint.failed} rows with errors")
+        if checkpoint.last_error:
+            click.echo(f"  last error: {checkpoint.last_error}")
+
+
+app.cli.add_command(doctors_cli)
@@ -0,0 +1,318 @@
+#doctor_routing.py
+# Route a symptom check to bookable doctors.
+#
+# Recommended specialties are pulled out of the "Recommended Medical
+# Specialties:" section of the stored analysis (the image analysis when it has
+# one, otherwise the text analysis) and looked up in an in-memory inverted
+# index of specialty -> doctor ids. Candidates are ranked by great-circle
+# distance from the patient, computed over NumPy arrays of doctor
+# coordinates. The index is loaded once and then kept current through commit
+# hooks whenever doctors are added, edited or removed in this process, and
+# reloaded when the doctor table's version (see commit_hooks.py) shows
+# changes made by another process.
+import re
+import threading
+
+import numpy as np
+
+from app import db
+from commit_hooks import after_commit, table_version
+from config import ROUTING_TOP_K, ROUTING_SPECIALTY_PENALTY_KM
+from models import Doctor, ImageAnalysisSection
+
+SPECIALTIES_SECTION = 'Recommended Medical Specialties:'
+
+EARTH_RADIUS_KM = 6371.0
+
+# Canonical specialty -> alternative names used by the model or by doctors
+SPECIALTY_ALIASES = {
+    'general medicine': ['general practitioner', 'general practice', 'general physician', 'gp', 'family medicine',
+                         'family physician', 'primary care', 'internal medicine', 'internist'],
+    'dermatology': ['dermatologist', 'skin specialist'],
+    'neurology': ['neurologist'],
+    'cardiology': ['cardiologist', 'heart specialist'],
+    'pulmonology': ['pulmonologist', 'chest physician', 'respiratory medicine', 'lung specialist'],
+    'gastroenterology': ['gastroenterologist', 'gi specialist'],
+    'orthopedics': ['orthopedic', 'orthopaedics', 'orthopedist', 'orthopedic surgeon', 'orthopaedic surgeon'],
+    'ent': ['otolaryngology', 'otolaryngologist', 'ear nose and throat', 'ear, nose and throat'],
+    'ophthalmology': ['ophthalmologist', 'eye specialist'],
+    'pediatrics': ['pediatrician', 'paediatrics', 'paediatrician'],
+    'psychiatry': ['psychiatrist', 'mental health'],
+    'endocrinology': ['endocrinologist', 'diabetologist'],
+    'rheumatology': ['rheumatologist'],
+    'urology': ['urologist'],
+    'nephrology': ['nephrologist', 'kidney specialist'],
+    'gynecology': ['gynecologist', 'obstetrics', 'obstetrician', 'obgyn', 'ob/gyn', 'gynaecology'],
+    'oncology': ['oncologist', 'cancer specialist'],
+    'allergy and immunology': ['allergist', 'immunologist', 'allergy', 'immunology'],
+    'infectious disease': ['infectious diseases', 'infectious disease specialist'],
+    'emergency medicine': ['emergency physician', 'emergency room', 'emergency department'],
+    'dentistry': ['dentist', 'dental'],
+}
+
+# Generic words that only name a specialty on their own ("Physician"), never
+# inside a phrase ("seek emergency care")
+EXACT_ALIASES = {'physician': 'general medicine', 'doctor': 'general medicine',
+                 'emergency': 'emergency medicine', 'er': 'emergency medicine'}
+
+_ALIAS_TO_SPECIALTY = {}
+for _canonical, _aliases in SPECIALTY_ALIASES.items():
+    _ALIAS_TO_SPECIALTY[_canonical] = _canonical
+    for _alias in _aliases:
+        _ALIAS_TO_SPECIALTY[_alias] = _canonical
+
+_CLEAN_RE = re.compile(r'[^a-z/,& ]+')
+_LIST_PREFIX_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*')
+# "Recommended Medical Specialties:", optionally as "**...:**" or "## ...:"
+_HEADING_RE = re.compile(r'^\s*(?:#+\s*)?\**\s*([A-Za-z][A-Za-z ]*?)\s*:\s*\**\s*$')
+_TERM_RE = re.compile(
+    r'\b(' + '|'.join(sorted(map(re.escape, _ALIAS_TO_SPECIALTY), key=len, reverse=True)) + r')\b'
+)
+
+
+def normalize_specialty(name):
+    """Map a free-text specialty (from a doctor profile or the model) to its canonical form."""
+    text = _CLEAN_RE.sub(' ', (name or '').lower()).strip()
+    text = re.sub(r'\s+', ' ', text)
+    if not text:
+        return None
+    if text in _ALIAS_TO_SPECIALTY:
+        return _ALIAS_TO_SPECIALTY[text]
+    if text in EXACT_ALIASES:
+        return EXACT_ALIASES[text]
+    match = _TERM_RE.search(text)
+    if match:
+        return _ALIAS_TO_SPECIALTY[match.group(1)]
+    # "Something-ologist" -> "something-ology" for specialties not listed above
+    if text.endswith('ologist'):
+        return text[:-len('ologist')] + 'ology'
+    return text
+
+
+def specialties_section(text):
+    """The lines of the "Recommended Medical Specialties:" section of a full analysis, or None."""
+    lines = None
+    for line in (text or '').split('\n'):
+        heading = _HEADING_RE.match(line)
+        if heading:
+            if lines is not None:
+                break
+            if heading.group(1).strip().lower() == SPECIALTIES_SECTION[:-1].lower():
+                lines = []
+        elif lines is not None:
+            lines.append(line)
+    return '\n'.join(lines) if lines else None
+
+
+def extract_specialties(text):
+    """Return canonical specialties of a "Recommended Medical Specialties" section, in order.
+
+    The text is the section itself, one specialty per list item.
+    """
+    found = []
+    if not text:
+        return found
+    for line in text.split('\n'):
+        item = _LIST_PREFIX_RE.sub('', line).strip()
+        # Drop the explanation after "Dermatologist: ..." / "Dermatology (for ...)"
+        item = re.split(r'[:(–—]| - ', item, maxsplit=1)[0].strip()
+        specialty = normalize_specialty(item) if item else None
+        if specialty and specialty not in found:
+            found.append(specialty)
+    return found
+
+
+def haversine_km(lat, lng, lats, lngs):
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class DoctorIndex:
+    """Inverted specialty index over doctors with coordinate arrays for ranking."""
+
+    def __init__(self, capacity=256):
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._lats = np.full(capacity, np.nan)
+        self._lngs = np.full(capacity, np.nan)
+        self._row_by_id = {}
+        self._free_rows = []
+        self._size = 0
+        self._specialty_by_id = {}
+        self._ids_by_specialty = {}
+        self._info = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._row_by_id)
+
+    def specialties(self):
+        return sorted(self._ids_by_specialty)
+
+    def upsert(self, doctor):
+        """Add or update a doctor from a dict with id, name, specialization, city, latitude, longitude."""
+        with self._lock:
+            doctor_id = doctor['id']
+            row = self._row_by_id.get(doctor_id)
+            if row is None:
+                row = self._free_rows.pop() if self._free_rows else self._append_row()
+                self._row_by_id[doctor_id] = row
+            self._ids[row] = doctor_id
+            self._lats[row] = doctor['latitude'] if doctor['latitude'] is not None else np.nan
+            self._lngs[row] = doctor['longitude'] if doctor['longitude'] is not None else np.nan
+
+            specialty = normalize_specialty(doctor['specialization'])
+            previous = self._specialty_by_id.get(doctor_id)
+            if previous != specialty:
+                if previous:
+                    self._discard_specialty(previous, doctor_id)
+                if specialty:
+                    self._ids_by_specialty.setdefault(specialty, set()).add(doctor_id)
+                self._specialty_by_id[doctor_id] = specialty
+
+            self._info[doctor_id] = {
+                'id': doctor_id,
+                'name': doctor['name'],
+                'specialization': doctor['specialization'],
+                'city': doctor.get('city'),
+            }
+
+    def remove(self, doctor_id):
+        with self._lock:
+            row = self._row_by_id.pop(doctor_id, None)
+            if row is None:
+                return
+            self._ids[row] = -1
+            self._lats[row] = self._lngs[row] = np.nan
+            self._free_rows.append(row)
+            specialty = self._specialty_by_id.pop(doctor_id, None)
+            if specialty:
+                self._discard_specialty(specialty, doctor_id)
+            self._info.pop(doctor_id, None)
+
+    def _discard_specialty(self, specialty, doctor_id):
+        ids = self._ids_by_specialty.get(specialty)
+        if ids is not None:
+            ids.discard(doctor_id)
+            if not ids:
+                del self._ids_by_specialty[specialty]
+
+    def _append_row(self):
+        if self._size == len(self._ids):
+            grow = len(self._ids)
+            self._ids = np.concatenate([self._ids, np.full(grow, -1, dtype=np.int64)])
+            self._lats = np.concatenate([self._lats, np.full(grow, np.nan)])
+            self._lngs = np.concatenate([self._lngs, np.full(grow, np.nan)])
+        self._size += 1
+        return self._size - 1
+
+    def rank(self, specialties, latitude=None, longitude=None, k=ROUTING_TOP_K):
+        """Return up to k doctors for the given specialties, nearest first.
+
+        Each step down the specialty list adds ROUTING_SPECIALTY_PENALTY_KM to
+        the score so the first recommendation wins unless it is much farther
+        away. Doctors without coordinates (or a patient without coordinates)
+        rank after all located doctors.
+        """
+        with self._lock:
+            rows = []
+            priorities = []
+            matched = []
+            seen = set()
+            for priority, specialty in enumerate(specialties):
+                for doctor_id in self._ids_by_specialty.get(specialty, ()):
+                    if doctor_id in seen:
+                        continue
+                    seen.add(doctor_id)
+                    rows.append(self._row_by_id[doctor_id])
+                    priorities.append(priority)
+                    matched.append(specialty)
+            if not rows:
+                return []
+
+            rows = np.array(rows)
+            priorities = np.array(priorities, dtype=np.float64)
+            if latitude is not None and longitude is not None:
+                distances = haversine_km(latitude, longitude, self._lats[rows], self._lngs[rows])
+            else:
+                distances = np.full(len(rows), np.nan)
+            scores = np.where(np.isnan(distances), np.inf, distances) + priorities * ROUTING_SPECIALTY_PENALTY_KM
+            # Stable ordering for equal scores: specialty priority, then doctor id
+            order = np.lexsort((self._ids[rows], priorities, scores))[:k]
+
+            results = []
+            for position in order:
+                doctor_id = int(self._ids[rows[position]])
+                distance = distances[position]
+                results.append(dict(
+                    self._info[doctor_id],
+                    matched_specialty=matched[position],
+                    distance_km=None if np.isnan(distance) else round(float(distance), 1)
+                ))
+            return results
+
+
+_index = None
+_index_version = None  # doctor table version the index reflects
+_index_lock = threading.Lock()
+
+_DOCTOR_FIELDS = ['name', 'specialization', 'city', 'latitude', 'longitude']
+
+
+def get_index():
+    global _index, _index_version
+    version = table_version(db.session, Doctor)
+    if _index is not None and _index_version == version:
+        return _index
+    with _index_lock:
+        if _index is None or _index_version != version:
+            index = DoctorIndex()
+            rows = db.session.query(
+                Doctor.id, Doctor.name, Doctor.specialization, Doctor.city, Doctor.latitude, Doctor.longitude
+            ).all()
+            for row in rows:
+                index.upsert(row._asdict())
+            _index, _index_version = index, version
+    return _index
+
+
+@after_commit(Doctor, _DOCTOR_FIELDS, versioned=True)
+def update_doctor_index(changes, versions):
+    global _index, _index_version
+    before, after = versions
+    with _index_lock:
+        if _index is None or _index_version != before:
+            return  # missed other changes; reloaded on next use
+        for op, doctor in changes:
+            if op == 'delete':
+                _index.remove(doctor['id'])
+            elif any(name not in doctor for name in _DOCTOR_FIELDS):
+                # Fields that were not loaded on the object; reload on next use
+                _index = None
+                return
+            else:
+                _index.upsert(doctor)
+        _index_version = after
+
+
+def specialties_for_check(symptom_check):
+    """Recommended specialties for a stored symptom check."""
+    section = db.session.query(ImageAnalysisSection.section_content).filter_by(
+        symptom_check_id=symptom_check.id,
+        section_title=SPECIALTIES_SECTION
+    ).first()
+    specialties = extract_specialties(section.section_content) if section else []
+    if not specialties:
+        specialties = extract_specialties(specialties_section(symptom_check.image_analysis))
+    if not specialties:
+        specialties = extract_specialties(specialties_section(symptom_check.ai_analysis))
+    return specialties
+
+
+def recommend_doctors(symptom_check, patient, k=ROUTING_TOP_K):
+    specialties = specialties_for_check(symptom_check)
+    if not specialties:
+        return specialties, []
+    doctors = get_index().rank(specialties, patient.latitude, patient.longitude, k=k)
+    return specialties, doctors
@@ -0,0 +1,230 @@
+#doctor_stats.py
+# Daily per-doctor appointment statistics.
+#
+# One DoctorDailyStats row per doctor and day holds the number of requests and
+# of transitions to each status that day, how many requests came from
+# patients who had run a symptom check in the DOCTOR_STATS_CHECK_WINDOW_DAYS
+# before, and the summed request-to-approval time. The rows are added to in
+# the transaction that books or updates an appointment (record_booking and
+# record_status_changes, called from routes.py) with one INSERT ... ON
+# CONFLICT DO UPDATE, so the dashboard reads at most a row per day instead of
+# scanning appointments and notifications.
+#
+#   flask doctor-stats backfill     rebuild days from the appointment and
+#                                   notification history
+#
+# History only records transitions that sent a notification: approvals and
+# rejections of requests, completions of scheduled appointments and
+# cancellations by the patient. Backfilled days therefore miss the other
+# transitions (to scheduled, cancellations by the doctor); days counted live
+# have them all. A backfill replaces the rows of the days it covers, so it
+# can be re-run, or resumed with --since.
+import bisect
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db
+from config import DOCTOR_STATS_CHECK_WINDOW_DAYS, DOCTOR_STATS_BACKFILL_CHUNK_DAYS
+from models import (Appointment, DoctorDailyStats, Notification, NotificationArchive, SymptomCheck,
+                    SymptomCheckArchive)
+
+STATUS_COUNTERS = ('approved', 'rejected', 'scheduled', 'completed', 'cancelled')
+COUNTERS = ('requested',) + STATUS_COUNTERS + ('after_symptom_check', 'approval_seconds', 'approvals_timed')
+
+# Notification types that record a status transition, for the backfill
+TRANSITION_TYPES = {
+    'appointment_approved': 'approved',
+    'appointment_rejected': 'rejected',
+    'appointment_completed': 'completed',
+    'appointment_cancelled': 'cancelled',
+}
+
+# Patient ids per IN (...) list in the backfill
+_IN_BATCH = 500
+
+
+def _upsert(deltas):
+    """Add {(doctor_id, day): Counter} to the rollup rows, in the current transaction."""
+    rows = [dict({name: counts.get(name, 0) for name in COUNTERS}, doctor_id=doctor_id, day=day)
+            for (doctor_id, day), counts in sorted(deltas.items()) if any(counts.values())]
+    if not rows:
+        return
+    table = DoctorDailyStats.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.doctor_id, table.c.day],
+            set_={name: table.c[name] + stmt.excluded[name] for name in COUNTERS}
+        )
+        db.session.execute(stmt, rows)
+        return
+    for row in rows:
+        result = db.session.execute(
+            update(table).where(table.c.doctor_id == row['doctor_id'], table.c.day == row['day']).values(
+                {name: table.c[name] + row[name] for name in COUNTERS}
+            )
+        )
+        if not result.rowcount:
+            db.session.execute(insert(table), row)
+
+
+def _had_symptom_check(patient_id, before):
+    since = before - timedelta(days=DOCTOR_STATS_CHECK_WINDOW_DAYS)
+    return db.session.query(exists().where(
+        SymptomCheck.patient_id == patient_id, SymptomCheck.created_at >= since, SymptomCheck.created_at <= before
+    )).scalar()
+
+
+def record_booking(appointment):
+    """Count a new appointment request; call before committing it."""
+    now = datetime.utcnow()
+    counts = Counter(requested=1)
+    if _had_symptom_check(appointment.patient_id, now):
+        counts['after_symptom_check'] = 1
+    _upsert({(appointment.doctor_id, now.date()): counts})
+
+
+def record_status_changes(changes):
+    """Count (appointment, old status, new status) transitions; call before committing them."""
+    now = datetime.utcnow()
+    deltas = defaultdict(Counter)
+    for appointment, old_status, new_status in changes:
+        if new_status == old_status or new_status not in STATUS_COUNTERS:
+            continue
+        counts = deltas[(appointment.doctor_id, now.date())]
+        counts[new_status] += 1
+        if new_status == 'approved' and old_status == 'pending' and appointment.created_at:
+            counts['approval_seconds'] += max(int((now - appointment.created_at).total_seconds()), 0)
+            counts['approvals_timed'] += 1
+    _upsert(deltas)
+
+
+def doctor_summary(doctor_id, days):
+    """Totals and a zero-filled daily series for a doctor's last `days` days (today included)."""
+    until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+    rows = {row.day: row for row in DoctorDailyStats.query.filter(
+        DoctorDailyStats.doctor_id == doctor_id, DoctorDailyStats.day >= since, DoctorDailyStats.day <= until
+    )}
+    totals = Counter()
+    daily = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = rows.get(day)
+        counts = {name: getattr(row, name) if row else 0 for name in COUNTERS}
+        totals.update(counts)
+        daily.append(dict({name: counts[name] for name in ('requested',) + STATUS_COUNTERS}, day=day.isoformat()))
+    decided = totals['approved'] + totals['rejected']
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'totals': {name: totals[name] for name in ('requested',) + STATUS_COUNTERS + ('after_symptom_check',)},
+        'approval_rate': round(totals['approved'] / decided, 3) if decided else None,
+        'avg_approval_hours': (round(totals['approval_seconds'] / totals['approvals_timed'] / 3600, 1)
+                               if totals['approvals_timed'] else None),
+        'daily': daily,
+    }
+
+
+def _check_times(patient_ids, since, until):
+    """{patient id: sorted symptom check times} between two datetimes, archived checks included."""
+    times = defaultdict(list)
+    patient_ids = sorted(patient_ids)
+    for model in (SymptomCheck, SymptomCheckArchive):
+        for i in range(0, len(patient_ids), _IN_BATCH):
+            rows = db.session.execute(select(model.patient_id, model.created_at).where(
+                model.patient_id.in_(patient_ids[i:i + _IN_BATCH]),
+                model.created_at >= since, model.created_at < until
+            ))
+            for patient_id, created_at in rows:
+                times[patient_id].append(created_at)
+    for values in times.values():
+        values.sort()
+    return times
+
+
+def rebuild_days(start, end):
+    """{(doctor_id, day): Counter} for days start <= day < end, from appointments and notifications."""
+    low, high = datetime.combine(start, time()), datetime.combine(end, time())
+    window = timedelta(days=DOCTOR_STATS_CHECK_WINDOW_DAYS)
+    deltas = defaultdict(Counter)
+
+    bookings = db.session.execute(select(Appointment.doctor_id, Appointment.patient_id, Appointment.created_at).where(
+        Appointment.created_at >= low, Appointment.created_at < high
+    )).all()
+    checks = _check_times({patient_id for _, patient_id, _ in bookings}, low - window, high)
+    for doctor_id, patient_id, created_at in bookings:
+        counts = deltas[(doctor_id, created_at.date())]
+        counts['requested'] += 1
+        times = checks.get(patient_id, ())
+        i = bisect.bisect_right(times, created_at)
+        if i and times[i - 1] >= created_at - window:
+            counts['after_symptom_check'] += 1
+
+    for model in (Notification, NotificationArchive):
+        rows = db.session.execute(
+            select(model.type, model.created_at, Appointment.doctor_id, Appointment.created_at)
+            .join(Appointment, Appointment.id == model.appointment_id)
+            .where(model.type.in_(TRANSITION_TYPES), model.created_at >= low, model.created_at < high)
+        )
+        for message_type, created_at, doctor_id, requested_at in rows:
+            status = TRANSITION_TYPES[message_type]
+            counts = deltas[(doctor_id, created_at.date())]
+            counts[status] += 1
+            if status == 'approved' and requested_at:
+                counts['approval_seconds'] += max(int((created_at - requested_at).total_seconds()), 0)
+                counts['approvals_timed'] += 1
+    return deltas
+
+
+def backfill(since=None, until=None, chunk_days=DOCTOR_STATS_BACKFILL_CHUNK_DAYS, echo=click.echo):
+    """Rebuild the rollup rows of days since..until (default: all history through today)."""
+    until = until or datetime.utcnow().date()
+    if since is None:
+        first = db.session.query(func.min(Appointment.created_at)).scalar()
+        if first is None:
+            echo('No appointments to backfill')
+            return 0
+        since = first.date()
+    rows = 0
+    start = since
+    while start <= until:
+        end = min(start + timedelta(days=chunk_days), until + timedelta(days=1))
+        deltas = rebuild_days(start, end)
+        db.session.execute(delete(DoctorDailyStats).where(DoctorDailyStats.day >= start, DoctorDailyStats.day < end))
+        _upsert(deltas)
+        db.session.commit()
+        rows += len(deltas)
+        echo(f"  {start} to {end - timedelta(days=1)}: {len(deltas)} doctor-days")
+        start = end
+    echo(f"Rebuilt {rows} doctor-days from {since} to {until}")
+    return rows
+
+
+doctor_stats_cli = AppGroup('doctor-stats', help='Maintain daily per-doctor statistics.')
+
+
+def _date(ctx, param, value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM-DD')
+
+
+@doctor_stats_cli.command('backfill')
+@click.option('--since', callback=_date, help='First day to rebuild (YYYY-MM-DD). Default: the first appointment.')
+@click.option('--until', callback=_date, help='Last day to rebuild (YYYY-MM-DD). Default: today.')
+@click.option('--chunk-days', default=DOCTOR_STATS_BACKFILL_CHUNK_DAYS, show_default=True,
+              help='Days rebuilt per transaction.')
+def backfill_command(since, until, chunk_days):
+    """Rebuild daily doctor statistics from appointment history."""
+    backfill(since, until, max(chunk_days, 1))
+
+
+app.cli.add_command(doctor_stats_cli)
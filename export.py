@@ -0,0 +1,304 @@
+#export.py
+# Streaming export of a patient's history (symptom checks, archived symptom
+# checks and appointments) as NDJSON, CSV, or a zip with the uploaded images.
+#
+# Rows are read with yield_per (a server-side cursor where the driver supports
+# one) and written out one record at a time from a generator, so memory use
+# does not grow with the size of the history. Images are only read when
+# requested, and in the zip they are copied in chunks in a separate pass.
+import base64
+import binascii
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+
+import click
+from flask import Response, request, session, stream_with_context, jsonify
+from flask.cli import AppGroup
+from sqlalchemy import func
+from sqlalchemy.orm import undefer, undefer_group
+
+from app import app, db
+from models import Appointment, Doctor, Patient, SymptomCheck, SymptomCheckArchive
+from retention import decode_payload
+from routes import login_required, patient_required
+from uploads import IMAGE_TYPES, COPY_CHUNK, sniff_image_type, open_check_image
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'zip': ('application/zip', 'zip'),
+}
+
+YIELD_PER = 100
+
+# Every record field; lists (archived image sections) are written as JSON
+CSV_COLUMNS = [
+    'record_type', 'id', 'created_at', 'symptoms', 'age', 'gender', 'duration', 'severity',
+    'medical_history', 'ai_analysis', 'image_analysis', 'image_sections', 'image_file', 'doctor',
+    'specialization', 'date', 'time', 'status', 'reason', 'notes',
+]
+
+# Archive payload fields that are internal and not exported
+_ARCHIVE_INTERNAL_FIELDS = ('patient_id', 'prompt_tokens')
+
+def image_filename(record_type, check_id, image_mime):
+    return f"images/{record_type}_{check_id}.{IMAGE_TYPES.get(image_mime, 'bin')}"
+
+
+def _base64_image_type(image_data):
+    """MIME type of a legacy base64 image, from its first bytes."""
+    try:
+        return sniff_image_type(base64.b64decode(image_data[:16]))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _image_base64(image_sha256, image_mime, image_data):
+    if image_data or not image_sha256:
+        return image_data
+    with open_check_image(image_sha256, image_mime) as f:
+        return base64.b64encode(f.read()).decode('ascii')
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _check_record(check):
+    return {
+        'record_type': 'symptom_check',
+        'id': check.id,
+        'created_at': _isoformat(check.created_at),
+        'symptoms': check.symptoms,
+        'age': check.age,
+        'gender': check.gender,
+        'duration': check.duration,
+        'severity': check.severity,
+        'medical_history': check.medical_history,
+        'ai_analysis': check.ai_analysis,
+        'image_analysis': check.image_analysis,
+    }
+
+
+def iter_records(patient_id, include_images=False, image_files=False):
+    """Yield export records for a patient, oldest first within each kind.
+
+    With image_files=True records name the image file written to the zip
+    instead of embedding the base64 data.
+    """
+    embed_images = include_images and not image_files
+    # image_data is the bulk of a row; it is only loaded when embedded. For
+    # zip exports only its first bytes are read, to name the image file.
+    image_head = func.substr(SymptomCheck.image_data, 1, 16).label('image_head')
+    checks = db.session.query(SymptomCheck, image_head).options(
+        undefer_group('analysis'),
+        *([undefer(SymptomCheck.image_data)] if embed_images else [])
+    ).filter(
+        SymptomCheck.patient_id == patient_id
+    ).order_by(SymptomCheck.id).yield_per(YIELD_PER)
+    for check, head in checks:
+        record = _check_record(check)
+        if embed_images:
+            record['image_data'] = _image_base64(check.image_sha256, check.image_mime, check.image_data)
+        elif image_files and (check.image_sha256 or head):
+            mime = check.image_mime if check.image_sha256 else _base64_image_type(head)
+            record['image_file'] = image_filename('symptom_check', check.id, mime)
+        yield record
+
+    archived = db.session.query(SymptomCheckArchive.payload).filter_by(
+        patient_id=patient_id
+    ).order_by(SymptomCheckArchive.id).yield_per(YIELD_PER)
+    for (payload,) in archived:
+        data = decode_payload(payload)
+        image_data = data.pop('image_data', None)
+        image_sha256 = data.pop('image_sha256', None)
+        image_mime = data.pop('image_mime', None)
+        for name in _ARCHIVE_INTERNAL_FIELDS:
+            data.pop(name, None)
+        record = dict(data, record_type='archived_symptom_check')
+        if embed_images:
+            record['image_data'] = _image_base64(image_sha256, image_mime, image_data)
+        elif image_files and (image_sha256 or image_data):
+            mime = image_mime if image_sha256 else _base64_image_type(image_data)
+            record['image_file'] = image_filename('archived_symptom_check', record['id'], mime)
+        yield record
+
+    appointments = db.session.query(
+        Appointment, Doctor.name, Doctor.specialization
+    ).join(
+        Doctor, Appointment.doctor_id == Doctor.id
+    ).filter(
+        Appointment.patient_id == patient_id
+    ).order_by(Appointment.id).yield_per(YIELD_PER)
+    for appointment, doctor_name, specialization in appointments:
+        yield {
+            'record_type': 'appointment',
+            'id': appointment.id,
+            'created_at': _isoformat(appointment.created_at),
+            'doctor': doctor_name,
+            'specialization': specialization,
+            'date': _isoformat(appointment.date),
+            'time': appointment.time.strftime('%H:%M') if appointment.time else None,
+            'status': appointment.status,
+            'reason': appointment.reason,
+            'notes': appointment.notes,
+        }
+
+
+def iter_images(patient_id):
+    """Yield (zip entry name, open image file) for every stored image, one at a time."""
+    rows = db.session.query(
+        SymptomCheck.id, SymptomCheck.image_sha256, SymptomCheck.image_mime, SymptomCheck.image_data
+    ).filter(
+        SymptomCheck.patient_id == patient_id,
+        SymptomCheck.image_data.isnot(None) | SymptomCheck.image_sha256.isnot(None)
+    ).order_by(SymptomCheck.id).yield_per(YIELD_PER)
+    yield from _opened_images(
+        ('symptom_check', row.id, row.image_sha256, row.image_mime, row.image_data) for row in rows
+    )
+
+    archived = db.session.query(SymptomCheckArchive.id, SymptomCheckArchive.payload).filter_by(
+        patient_id=patient_id
+    ).order_by(SymptomCheckArchive.id).yield_per(YIELD_PER)
+    for check_id, payload in archived:
+        data = decode_payload(payload)
+        yield from _opened_images([(
+            'archived_symptom_check', check_id,
+            data.get('image_sha256'), data.get('image_mime'), data.get('image_data')
+        )])
+
+
+def _opened_images(sources):
+    for record_type, check_id, image_sha256, image_mime, image_data in sources:
+        if not image_sha256 and not image_data:
+            continue
+        mime = image_mime if image_sha256 else _base64_image_type(image_data)
+        try:
+            image = open_check_image(image_sha256, image_mime, image_data)
+        except (OSError, binascii.Error, ValueError) as e:
+            app.logger.warning(f"Skipping unreadable image for {record_type} {check_id}: {str(e)}")
+            continue
+        yield image_filename(record_type, check_id, mime), image
+
+
+def _json_line(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def generate_ndjson(patient_id, include_images=False):
+    for record in iter_records(patient_id, include_images):
+        yield _json_line(record).encode('utf-8')
+
+
+def generate_csv(patient_id):
+    buffer = io.StringIO()
+    # A record field without a column raises instead of being dropped from the CSV only
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for record in iter_records(patient_id):
+        writer.writerow({name: json.dumps(value) if isinstance(value, (list, dict)) else value
+                         for name, value in record.items()})
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only stream the zip is written into; the generator drains it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def generate_zip(patient_id, include_images=True):
+    sink = _ChunkSink()
+    # The sink is not seekable, so zipfile writes data descriptors after each entry
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('history.ndjson', 'w') as entry:
+            for record in iter_records(patient_id, include_images, image_files=include_images):
+                entry.write(_json_line(record).encode('utf-8'))
+                if sink.chunks:
+                    yield sink.drain()
+
+        if include_images:
+            for name, image in iter_images(patient_id):
+                # Images are already compressed
+                info = zipfile.ZipInfo(name, date_time=datetime.utcnow().timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with image, archive.open(info, 'w') as entry:
+                    for chunk in iter(lambda: image.read(COPY_CHUNK), b''):
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+    yield sink.drain()
+
+
+def generate_export(patient_id, export_format, include_images):
+    if export_format == 'csv':
+        return generate_csv(patient_id)
+    if export_format == 'zip':
+        return generate_zip(patient_id, include_images)
+    return generate_ndjson(patient_id, include_images)
+
+
+@app.route('/api/export')
+@login_required
+@patient_required
+def export_history():
+    patient = Patient.query.filter_by(user_id=session.get('user_id')).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Format must be one of ndjson, csv, zip'}), 400
+    include_images = request.args.get('images', 'false').lower() in ('1', 'true', 'yes')
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"health-history-{datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+    # No Content-Length: the body is sent with chunked transfer encoding
+    response = Response(
+        stream_with_context(generate_export(patient.id, export_format, include_images)),
+        mimetype=mimetype
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+export_cli = AppGroup('export', help='Export patient history.')
+
+
+@export_cli.command('patient')
+@click.argument('patient_id', type=int)
+@click.option('--format', 'export_format', type=click.Choice(sorted(EXPORT_FORMATS)), default='ndjson',
+              show_default=True)
+@click.option('--images/--no-images', default=False, help='Include uploaded images.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default='-',
+              help='File to write (default: stdout).')
+def export_patient_command(patient_id, export_format, images, output):
+    """Stream one patient's history to a file."""
+    if not db.session.get(Patient, patient_id):
+        raise click.ClickException(f"Patient {patient_id} not found")
+    with click.open_file(output, 'wb') as f:
+        for chunk in generate_export(patient_id, export_format, images):
+            f.write(chunk)
+
+
+app.cli.add_command(export_cli)
@@ -0,0 +1,239 @@
+#idempotency.py
+# Idempotency keys for POSTs that create something (symptom checks,
+# appointment requests).
+#
+# The client sends a key with the request: an Idempotency-Key header from
+# JavaScript, or an `idempotency_key` hidden field in a plain form. The first
+# request with a key claims it (a unique row in idempotency_key, committed
+# before the view runs) and, when the view reports what it created with
+# mark_created(), its response is stored with the key for IDEMPOTENCY_TTL_SECONDS.
+# A retry with the same key gets the stored response back instead of a second
+# SymptomCheck and Gemini call.
+#
+# Duplicates that arrive while the first request is still running wait for
+# it (single-flight): in the same process on an Event, across processes by
+# polling the row, for up to IDEMPOTENCY_WAIT_SECONDS. A request that fails
+# releases its key so it can be retried; one whose worker died is taken over
+# once its claim is older than IDEMPOTENCY_LOCK_SECONDS. Expired keys are
+# deleted by `flask retention run`.
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, flash, g, jsonify, redirect, request, session
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_POLL_SECONDS
+from models import IdempotencyKey
+
+KEY_HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+_KEY_RE = re.compile(r'^[A-Za-z0-9_.:-]{8,100}$')
+
+# Response headers kept with a stored response
+_STORED_HEADERS = ('Content-Type', 'Location')
+
+# Requests running in this process: (user id, scope, key) -> Event set when they finish
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def new_key():
+    """A fresh key for a form's hidden field."""
+    return uuid.uuid4().hex
+
+
+def mark_created(resource_id):
+    """Called by an @idempotent view once it has committed what it created; its response is then kept."""
+    g.idempotency_resource_id = resource_id
+
+
+def request_fingerprint():
+    """Hash of the request's content, to refuse a key reused for a different request."""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode('utf-8'))
+    if request.is_json:
+        digest.update(request.get_data())
+    else:
+        # Form fields, and uploads by name and type only so the file is not read here
+        fields = sorted((name, value) for name, value in request.form.items(multi=True) if name != FORM_FIELD)
+        files = sorted((name, f.filename or '', f.mimetype or '') for name, f in request.files.items(multi=True))
+        digest.update(json.dumps([fields, files]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load(user_id, scope, key):
+    return db.session.execute(
+        select(IdempotencyKey.__table__).where(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.scope == scope, IdempotencyKey.key == key
+        )
+    ).mappings().first()
+
+
+def _claim(user_id, scope, key, fingerprint):
+    """(id of the row now owned by this request, None), or (None, the existing row)."""
+    existing = None
+    for _ in range(3):
+        now = datetime.utcnow()
+        try:
+            result = db.session.execute(insert(IdempotencyKey).values(
+                user_id=user_id, scope=scope, key=key, fingerprint=fingerprint, status='in_flight',
+                created_at=now, expires_at=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+            ))
+            db.session.commit()
+            return result.inserted_primary_key[0], None
+        except IntegrityError:
+            db.session.rollback()
+        existing = _load(user_id, scope, key)
+        if existing is None:
+            continue  # released in the meantime
+        if existing['expires_at'] > now:
+            return None, existing
+        # Past its TTL, or claimed by a worker that died: take it over
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.id == existing['id'], IdempotencyKey.expires_at == existing['expires_at']
+        ))
+        db.session.commit()
+    return None, existing
+
+
+def _wait(ident, user_id, scope, key):
+    """The key's row once it is no longer in flight (None if released), or the in-flight row on timeout."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        with _in_flight_lock:
+            done = _in_flight.get(ident)
+        if done is not None:
+            done.wait(max(remaining, 0))
+        elif remaining > 0:
+            time.sleep(min(IDEMPOTENCY_POLL_SECONDS, remaining))
+        row = _load(user_id, scope, key)
+        if row is None or row['status'] != 'in_flight' or row['expires_at'] <= datetime.utcnow():
+            return row
+        if time.monotonic() >= deadline:
+            return row
+
+
+def _complete(row_id, response, flashes, resource_id):
+    headers = {name: response.headers[name] for name in _STORED_HEADERS if name in response.headers}
+    try:
+        db.session.execute(update(IdempotencyKey).where(IdempotencyKey.id == row_id).values(
+            status='completed', resource_id=resource_id, response_status=response.status_code,
+            response_headers=json.dumps(headers), response_body=response.get_data(as_text=True),
+            flashes=json.dumps(flashes) if flashes else None,
+            expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Could not store idempotent response: {str(e)}")
+        _release(row_id)
+
+
+def _release(row_id):
+    try:
+        db.session.rollback()
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.id == row_id, IdempotencyKey.status == 'in_flight'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Could not release idempotency key: {str(e)}")
+
+
+def _replay(row):
+    for category, message in json.loads(row['flashes'] or '[]'):
+        flash(message, category)
+    response = current_app.response_class(row['response_body'] or '', status=row['response_status'])
+    for name, value in json.loads(row['response_headers'] or '{}').items():
+        response.headers[name] = value
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _reject(status, message):
+    if request.is_json or KEY_HEADER in request.headers:
+        response = jsonify({'success': False, 'message': message})
+        response.status_code = status
+        return response
+    flash(message, 'warning')
+    return redirect(request.path)
+
+
+def idempotent(scope):
+    """Deduplicate POSTs to a view by idempotency key; apply inside the login decorators."""
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get(KEY_HEADER) if request.method == 'POST' else None
+            if request.method == 'POST' and key is None:
+                key = request.form.get(FORM_FIELD) or None
+            if key is None:
+                return view(*args, **kwargs)
+            if not _KEY_RE.match(key):
+                return _reject(400, 'Invalid idempotency key')
+
+            user_id = session.get('user_id')
+            ident = (user_id, scope, key)
+            fingerprint = request_fingerprint()
+            for _ in range(3):
+                row_id, existing = _claim(user_id, scope, key, fingerprint)
+                if row_id is not None:
+                    return _run(view, args, kwargs, ident, row_id)
+                if existing is not None and existing['fingerprint'] != fingerprint:
+                    return _reject(422, 'This idempotency key was already used for a different request')
+                if existing is not None and existing['status'] == 'in_flight':
+                    existing = _wait(ident, user_id, scope, key)
+                    if existing is not None and existing['status'] == 'in_flight' \
+                            and existing['expires_at'] > datetime.utcnow():
+                        break
+                if existing is None or existing['status'] == 'in_flight':
+                    continue  # released or abandoned; claim it again
+                return _replay(existing)
+            response = _reject(409, 'This request is still being processed; please try again shortly')
+            response.headers['Retry-After'] = str(max(round(IDEMPOTENCY_POLL_SECONDS), 1))
+            return response
+        return decorated_function
+    return decorator
+
+
+def _run(view, args, kwargs, ident, row_id):
+    done = threading.Event()
+    with _in_flight_lock:
+        _in_flight[ident] = done
+    flashes_before = len(session.get('_flashes', []))
+    try:
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            _release(row_id)
+            raise
+        resource_id = g.pop('idempotency_resource_id', None)
+        if resource_id is not None and response.status_code < 400:
+            _complete(row_id, response, session.get('_flashes', [])[flashes_before:], resource_id)
+        else:
+            # Failures are not kept; a retry runs the view again
+            _release(row_id)
+        return response
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(ident, None)
+        done.set()
+
+
+def prune_expired_batch(now, batch_size):
+    """Delete up to batch_size expired keys (see retention.py); returns rows deleted."""
+    ids = select(IdempotencyKey.id).where(IdempotencyKey.expires_at < now).order_by(IdempotencyKey.id).limit(batch_size)
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids.scalar_subquery())))
+    db.session.commit()
+    return result.rowcount
@@ -1,5 +1,11 @@
 from app import app
 from routes import *
+import static_assets  # noqa: F401
+import retention  # noqa: F401
+import export  # noqa: F401
+import reanalysis  # noqa: F401
+import map_clusters  # noqa: F401
+import doctor_import  # noqa: F401
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5001, debug=True)
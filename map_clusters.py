@@ -0,0 +1,254 @@
+#map_clusters.py
+# Doctor map markers, clustered on the server by zoom level.
+#
+# Doctors are placed on a hierarchical grid over Web Mercator: at zoom z the
+# world is split into 2^z * 256 / MAP_CLUSTER_CELL_PX cells per axis (cells
+# about MAP_CLUSTER_CELL_PX screen pixels wide), so each cell has exactly four
+# children at z + 1. Every level keeps a count and coordinate sums per
+# occupied cell, which gives a cluster's size and centroid without touching
+# the doctors, and the finest level keeps the doctor ids in each cell.
+#
+# /api/doctors/clusters?bbox=west,south,east,north&zoom=z returns the
+# clusters in view up to MAP_CLUSTER_MAX_ZOOM (a cell holding one doctor is
+# returned as that doctor) and individual doctors above it. Like the routing
+# index (doctor_routing.py), the grid is loaded once and kept current through
+# commit hooks when doctors are added, moved or removed in this process; each
+# request compares the doctor table's version (see commit_hooks.py) with the
+# grid's and reloads it after changes made by other processes.
+import math
+import threading
+
+from flask import jsonify, request
+
+from app import app, db
+from commit_hooks import after_commit, table_version
+from config import MAP_CLUSTER_MAX_ZOOM, MAP_CLUSTER_CELL_PX, MAP_CLUSTER_MAX_POINTS
+from models import Doctor
+from routes import login_required
+
+MAX_LATITUDE = 85.05112878  # Web Mercator's limit
+MAX_ZOOM = 22
+
+_DOCTOR_FIELDS = ['name', 'specialization', 'address', 'city', 'state', 'latitude', 'longitude']
+
+
+def mercator(lat, lng):
+    """Position in the unit square, x east and y south."""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    x = (lng + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+
+class ClusterGrid:
+    """Per-zoom grid of doctor counts and coordinate sums, updated one doctor at a time."""
+
+    def __init__(self, max_zoom=MAP_CLUSTER_MAX_ZOOM, cell_px=MAP_CLUSTER_CELL_PX):
+        if cell_px & (cell_px - 1) or not 1 <= cell_px <= 256:
+            raise ValueError('MAP_CLUSTER_CELL_PX must be a power of two up to 256')
+        self.max_zoom = max_zoom
+        self._shift = 8 - (cell_px.bit_length() - 1)  # cells per axis at zoom z: 2 ** (z + shift)
+        # One {(x, y): [count, latitude sum, longitude sum]} per zoom level
+        self._levels = [{} for _ in range(max_zoom + 1)]
+        self._members = {}  # finest-level cell -> doctor ids
+        self._points = {}  # doctor id -> (latitude, longitude, finest-level cell)
+        self._info = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lng, zoom):
+        x, y = mercator(lat, lng)
+        cells = 1 << (zoom + self._shift)
+        return int(x * cells), int(y * cells)
+
+    def upsert(self, doctor):
+        """Add, move or update a doctor from a dict with id, the _DOCTOR_FIELDS and coordinates."""
+        with self._lock:
+            doctor_id = doctor['id']
+            lat, lng = _coordinate(doctor['latitude']), _coordinate(doctor['longitude'])
+            doctor = dict(doctor, latitude=lat, longitude=lng)
+            previous = self._points.get(doctor_id)
+            if previous and lat is not None and lng is not None and previous[:2] == (lat, lng):
+                self._info[doctor_id] = _public(doctor)
+                return
+            self.remove(doctor_id)
+            if lat is None or lng is None:
+                return
+            x, y = self._cell(lat, lng, self.max_zoom)
+            self._points[doctor_id] = (lat, lng, (x, y))
+            self._members.setdefault((x, y), set()).add(doctor_id)
+            for zoom in range(self.max_zoom, -1, -1):
+                cell = self._levels[zoom].setdefault((x, y), [0, 0.0, 0.0])
+                cell[0] += 1
+                cell[1] += lat
+                cell[2] += lng
+                x, y = x >> 1, y >> 1
+            self._info[doctor_id] = _public(doctor)
+
+    def remove(self, doctor_id):
+        with self._lock:
+            self._info.pop(doctor_id, None)
+            point = self._points.pop(doctor_id, None)
+            if point is None:
+                return
+            lat, lng, (x, y) = point
+            members = self._members[(x, y)]
+            members.discard(doctor_id)
+            if not members:
+                del self._members[(x, y)]
+            for zoom in range(self.max_zoom, -1, -1):
+                level = self._levels[zoom]
+                cell = level[(x, y)]
+                cell[0] -= 1
+                if cell[0]:
+                    cell[1] -= lat
+                    cell[2] -= lng
+                else:
+                    del level[(x, y)]
+                x, y = x >> 1, y >> 1
+
+    def _cells_in(self, level, zoom, west, south, east, north):
+        """Occupied cells of a level inside a bounding box (west <= east)."""
+        x0, y0 = self._cell(north, west, zoom)
+        x1, y1 = self._cell(south, east, zoom)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(level):
+            return [((x, y), level[(x, y)]) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                    if (x, y) in level]
+        return [(key, value) for key, value in level.items() if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+
+    def _only_member(self, zoom, x, y):
+        # Follow the one occupied child down to the finest level
+        for child_zoom in range(zoom + 1, self.max_zoom + 1):
+            level = self._levels[child_zoom]
+            x, y = next((cx, cy) for cx in (2 * x, 2 * x + 1) for cy in (2 * y, 2 * y + 1) if (cx, cy) in level)
+        return next(iter(self._members[(x, y)]))
+
+    def query(self, boxes, zoom, limit=MAP_CLUSTER_MAX_POINTS):
+        """(clusters, doctors, truncated) for (west, south, east, north) boxes at a zoom level."""
+        clusters, doctors = [], []
+        with self._lock:
+            if zoom > self.max_zoom:
+                level = self._levels[self.max_zoom]
+                for west, south, east, north in boxes:
+                    for key, _ in self._cells_in(level, self.max_zoom, west, south, east, north):
+                        for doctor_id in self._members[key]:
+                            lat, lng, _ = self._points[doctor_id]
+                            if south <= lat <= north and west <= lng <= east:
+                                doctors.append(self._info[doctor_id])
+            else:
+                level = self._levels[zoom]
+                for west, south, east, north in boxes:
+                    for (x, y), (count, lat_sum, lng_sum) in self._cells_in(level, zoom, west, south, east, north):
+                        if count == 1:
+                            doctors.append(self._info[self._only_member(zoom, x, y)])
+                        else:
+                            clusters.append({
+                                'latitude': round(lat_sum / count, 6),
+                                'longitude': round(lng_sum / count, 6),
+                                'count': count,
+                            })
+        doctors.sort(key=lambda doctor: doctor['id'])
+        truncated = len(doctors) > limit
+        return clusters, doctors[:limit], truncated
+
+
+def _coordinate(value):
+    # Values assigned from a form or JSON may still be strings when the commit hook sees them
+    if value is None or value == '':
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _public(doctor):
+    return {
+        'id': doctor['id'],
+        'name': doctor['name'],
+        'specialization': doctor['specialization'],
+        'address': doctor.get('address'),
+        'city': doctor.get('city'),
+        'state': doctor.get('state'),
+        'latitude': doctor['latitude'],
+        'longitude': doctor['longitude'],
+    }
+
+
+_grid = None
+_grid_version = None  # doctor table version the grid reflects
+_grid_lock = threading.Lock()
+
+
+def get_grid():
+    global _grid, _grid_version
+    version = table_version(db.session, Doctor)
+    if _grid is not None and _grid_version == version:
+        return _grid
+    with _grid_lock:
+        if _grid is None or _grid_version != version:
+            grid = ClusterGrid()
+            rows = db.session.query(
+                Doctor.id, Doctor.name, Doctor.specialization, Doctor.address, Doctor.city, Doctor.state,
+                Doctor.latitude, Doctor.longitude
+            ).filter(Doctor.latitude.isnot(None), Doctor.longitude.isnot(None))
+            for row in rows:
+                grid.upsert(row._asdict())
+            _grid, _grid_version = grid, version
+    return _grid
+
+
+@after_commit(Doctor, _DOCTOR_FIELDS, versioned=True)
+def update_cluster_grid(changes, versions):
+    global _grid, _grid_version
+    before, after = versions
+    with _grid_lock:
+        if _grid is None or _grid_version != before:
+            return  # missed other changes; reloaded on next use
+        for op, doctor in changes:
+            if op == 'delete':
+                _grid.remove(doctor['id'])
+            elif any(name not in doctor for name in _DOCTOR_FIELDS):
+                # Fields that were not loaded on the object; reload on next use
+                _grid = None
+                return
+            else:
+                _grid.upsert(doctor)
+        _grid_version = after
+
+
+def parse_bbox(value):
+    """[(west, south, east, north), ...] from "west,south,east,north"; split at the antimeridian."""
+    west, south, east, north = (float(part) for part in value.split(','))
+    if not all(math.isfinite(v) for v in (west, south, east, north)) or south > north:
+        raise ValueError('bbox must be west,south,east,north')
+    south, north = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360:
+        return [(-180.0, south, 180.0, north)]
+    # Leaflet reports longitudes beyond +-180 after panning across the antimeridian
+    west = (west + 180.0) % 360.0 - 180.0
+    east = (east + 180.0) % 360.0 - 180.0
+    if west <= east:
+        return [(west, south, east, north)]
+    return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+
+@app.route('/api/doctors/clusters')
+@login_required
+def doctor_clusters():
+    try:
+        boxes = parse_bbox(request.args.get('bbox', '-180,-90,180,90'))
+        zoom = request.args.get('zoom', 0, type=int)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    zoom = min(max(zoom, 0), MAX_ZOOM)
+    clusters, doctors, truncated = get_grid().query(boxes, zoom)
+    return jsonify({
+        'success': True,
+        'zoom': zoom,
+        'clustered': zoom <= MAP_CLUSTER_MAX_ZOOM,
+        'clusters': clusters,
+        'doctors': doctors,
+        'truncated': truncated,
+    })
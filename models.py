@@ -2,7 +2,9 @@
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from sqlalchemy.orm import deferred
 from flask_login import UserMixin
+from compressed_text import CompressedText
 
 
 class User(db.Model, UserMixin):
@@ -36,7 +38,8 @@ class Doctor(db.Model):
     zip_code = db.Column(db.String(20))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    bio = db.Column(db.Text)
+    # Deferred so list views don't load profile text; undefer_group('profile') where it is shown
+    bio = deferred(db.Column(db.Text), group='profile')
     
     # Relationships
     appointments = db.relationship('Appointment', backref='doctor', lazy='dynamic', cascade='all, delete-orphan')
@@ -55,8 +58,9 @@ class Patient(db.Model):
     zip_code = db.Column(db.String(20))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    medical_history = db.Column(db.Text)
-    allergies = db.Column(db.Text)
+    # Deferred so list views don't load clinical text
+    medical_history = deferred(db.Column(CompressedText), group='clinical')
+    allergies = deferred(db.Column(db.Text), group='clinical')
     
     # Relationships
     appointments = db.relationship('Appointment', backref='patient', lazy='dynamic', cascade='all, delete-orphan')
@@ -87,10 +91,20 @@ class SymptomCheck(db.Model):
     gender = db.Column(db.String(10))
     duration = db.Column(db.String(100))
     severity = db.Column(db.String(20))
-    medical_history = db.Column(db.Text)
-    ai_analysis = db.Column(db.Text)
-    image_data = db.Column(db.Text)  # Store base64-encoded image data
-    image_analysis = db.Column(db.Text)  # Store image analysis results
+    # Heavy columns are deferred; list views use the summary fields below
+    medical_history = deferred(db.Column(db.Text), group='analysis')
+    ai_analysis = deferred(db.Column(CompressedText), group='analysis')
+    image_data = deferred(db.Column(db.Text), group='image')  # Base64 image data (uploads before uploads.py)
+    image_sha256 = db.Column(db.String(64), index=True)  # Content-addressed image file (see uploads.py)
+    image_mime = db.Column(db.String(30))
+    image_analysis = deferred(db.Column(CompressedText), group='analysis')  # Store image analysis results
+    prompt_tokens = db.Column(db.Integer)  # Estimated prompt tokens sent to the AI models
+    analysis_version = db.Column(db.String(80))  # Model and prompt version of ai_analysis (see reanalysis.py)
+    # Summary fields, filled in whenever a check is written (see check_summary.py)
+    symptom_snippet = db.Column(db.String(160))
+    top_condition = db.Column(db.String(120))
+    has_image = db.Column(db.Boolean)
+    has_analysis = db.Column(db.Boolean)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -101,7 +115,7 @@ class ImageAnalysisSection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     symptom_check_id = db.Column(db.Integer, db.ForeignKey('symptom_check.id'), nullable=False)
     section_title = db.Column(db.String(100), nullable=False)
-    section_content = db.Column(db.Text, nullable=False)
+    section_content = db.Column(CompressedText, nullable=False)
     section_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -110,10 +124,139 @@ class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=True)
-    message = db.Column(db.Text, nullable=False)
+    # Empty for new rows, which are rendered from type and params (see notification_messages.py)
+    message = db.Column(db.Text, nullable=False, default='')
     type = db.Column(db.String(50), nullable=False)  # appointment_request, approval, rejection, cancellation, etc.
+    params = db.Column(db.Text)  # JSON, e.g. {"notes": "..."}
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Display text, filled in by notification_messages.render_notifications()
+    text = None
     
     # Relationships
     user = db.relationship('User', backref=db.backref('notifications', lazy='dynamic', cascade='all, delete-orphan'))
+
+
+class OutboxEvent(db.Model):
+    # Delivery work (email, etc.) recorded in the same transaction as the change
+    # that caused it and sent later by the dispatcher in outbox.py
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    channel = db.Column(db.String(20), nullable=False)  # email, sendgrid, log
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), default='pending')  # pending, claimed, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_outbox_event_status_available', 'status', 'available_at'),
+        db.Index('ix_outbox_event_claim_token', 'claim_token'),
+    )
+
+
+class NotificationArchive(db.Model):
+    # Read notifications moved out of the notification table by retention.py.
+    # Keeps the original id; no foreign keys so archiving never blocks deletes.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    appointment_id = db.Column(db.Integer)
+    message = db.Column(db.Text, nullable=False, default='')
+    type = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text)
+    is_read = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    text = None
+
+
+class SymptomCheckArchive(db.Model):
+    # Old symptom checks moved out of the symptom_check table by retention.py.
+    # Only listing fields stay as columns; the full row and its image analysis
+    # sections are kept as zlib-compressed JSON in `payload`.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, nullable=False, index=True)
+    symptoms = db.Column(db.Text, nullable=False)
+    severity = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    # Stored image file the payload refers to, '' for none; NULL until read
+    # from the payload for rows archived before this column
+    image_sha256 = db.Column(db.String(64), index=True)
+
+
+class JobCheckpoint(db.Model):
+    # Progress of a resumable batch job (see reanalysis.py): rows up to last_id
+    # have been handled and their results committed in the same transaction
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+    params = db.Column(db.Text)  # JSON; a run with different params starts over
+    last_id = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    failed_ids = db.Column(db.Text)  # JSON list, most recent failures only
+    last_error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class IdempotencyKey(db.Model):
+    # A client-supplied key for a POST that creates something, and the response
+    # it got, so retries get the same result (see idempotency.py)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    scope = db.Column(db.String(50), nullable=False)  # the view, e.g. symptom_checker
+    key = db.Column(db.String(100), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the request content
+    status = db.Column(db.String(20), nullable=False, default='in_flight')  # in_flight, completed
+    resource_id = db.Column(db.Integer)  # what the request created, e.g. the SymptomCheck id
+    response_status = db.Column(db.Integer)
+    response_headers = db.Column(db.Text)  # JSON
+    response_body = db.Column(CompressedText)
+    flashes = db.Column(db.Text)  # JSON list of [category, message]
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'scope', 'key', name='uq_idempotency_key_user_scope_key'),
+    )
+
+
+class DoctorDailyStats(db.Model):
+    # Per-doctor appointment counts for one day (UTC), added to as appointments
+    # are booked and change status and rebuilt from history by
+    # `flask doctor-stats backfill` (see doctor_stats.py)
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    requested = db.Column(db.Integer, nullable=False, default=0)
+    approved = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    scheduled = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    # Requests from patients who ran a symptom check shortly before booking
+    after_symptom_check = db.Column(db.Integer, nullable=False, default=0)
+    # Request-to-approval time of the approvals of the day, summed
+    approval_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    approvals_timed = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'day', name='uq_doctor_daily_stats_doctor_day'),
+    )
+
+
+class DataVersion(db.Model):
+    # Counter bumped by every transaction that changes a table mirrored in
+    # memory, so other processes can tell their copy is stale (see commit_hooks.py)
+    name = db.Column(db.String(64), primary_key=True)  # the table name
+    version = db.Column(db.BigInteger, nullable=False, default=0)
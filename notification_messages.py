@@ -0,0 +1,192 @@
+#notification_messages.py
+# Notification text, rendered when it is read.
+#
+# A notification is stored as its type plus a small JSON `params` payload
+# (only what cannot be looked up, such as the reason given for a rejection);
+# `message` is left empty. The doctor, patient, date and time come from the
+# appointment when the notification is shown, so they follow profile changes,
+# and the wording lives in MESSAGE_TEMPLATES, compiled once at import time
+# and keyed by locale. Rendered strings are kept in an LRU cache.
+#
+# Rows written before this keep their pre-formatted message, which is shown
+# as-is; `flask notifications compact` converts them in batches.
+import json
+import re
+from functools import lru_cache
+from string import Formatter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, select, update
+
+from app import app, db
+from config import NOTIFICATION_RENDER_CACHE_SIZE
+from models import Appointment, Doctor, Patient, Notification, NotificationArchive
+
+DEFAULT_LOCALE = 'en'
+
+MESSAGE_TEMPLATES = {
+    'en': {
+        'appointment_request': "New appointment request from {patient} for {date} at {time}.",
+        'appointment_pending': "Your appointment request with Dr. {doctor} for {date} at {time} has been sent and is pending approval.",
+        'appointment_approved': "Dr. {doctor} has approved your appointment for {date} at {time}.",
+        'appointment_rejected': "Dr. {doctor} has declined your appointment request for {date} at {time}. Reason: {notes}",
+        'appointment_completed': "Your appointment with Dr. {doctor} on {date} at {time} has been marked as completed.",
+        'appointment_cancelled': "{patient} has cancelled their appointment for {date} at {time}. Reason: {notes}",
+    },
+}
+
+DATE_FORMAT = '%A, %B %d, %Y'
+TIME_FORMAT = '%I:%M %p'
+
+# Shown when the appointment no longer exists
+UNKNOWN = {'doctor': 'Unknown', 'patient': 'Unknown', 'date': 'Unknown date', 'time': 'Unknown time'}
+
+
+def _compile(template):
+    """Split a template into (literal, field name) pairs once."""
+    return tuple((literal, name) for literal, name, _, _ in Formatter().parse(template))
+
+
+_COMPILED = {
+    locale: {message_type: _compile(template) for message_type, template in templates.items()}
+    for locale, templates in MESSAGE_TEMPLATES.items()
+}
+
+
+def notification_params(notes=None):
+    """The params payload for a new notification, or None when there is nothing to keep."""
+    params = {}
+    if notes:
+        params['notes'] = notes
+    return json.dumps(params, separators=(',', ':')) if params else None
+
+
+@lru_cache(maxsize=NOTIFICATION_RENDER_CACHE_SIZE)
+def render_message(message_type, params, doctor, patient, date, time, locale=DEFAULT_LOCALE):
+    parts = _COMPILED.get(locale, _COMPILED[DEFAULT_LOCALE]).get(message_type)
+    if parts is None:
+        return ''
+    values = {'doctor': doctor or UNKNOWN['doctor'], 'patient': patient or UNKNOWN['patient'],
+              'date': date or UNKNOWN['date'], 'time': time or UNKNOWN['time'], 'notes': ''}
+    if params:
+        values.update(json.loads(params))
+    return ''.join(literal + (str(values.get(name, '')) if name is not None else '') for literal, name in parts)
+
+
+def appointment_context(appointment_ids):
+    """{appointment id: (doctor, patient, date, time)} with one query."""
+    appointment_ids = {appointment_id for appointment_id in appointment_ids if appointment_id}
+    if not appointment_ids:
+        return {}
+    rows = db.session.execute(
+        select(Appointment.id, Doctor.name, Patient.name, Appointment.date, Appointment.time)
+        .join(Doctor, Appointment.doctor_id == Doctor.id)
+        .join(Patient, Appointment.patient_id == Patient.id)
+        .where(Appointment.id.in_(appointment_ids))
+    ).all()
+    return {
+        appointment_id: (
+            doctor, patient,
+            date.strftime(DATE_FORMAT) if date else None,
+            time.strftime(TIME_FORMAT) if time else None
+        )
+        for appointment_id, doctor, patient, date, time in rows
+    }
+
+
+def render_messages(items, locale=DEFAULT_LOCALE):
+    """Text for (type, appointment_id, params, message) tuples; stored messages win."""
+    context = appointment_context(
+        appointment_id for _, appointment_id, _, message in items if not message
+    )
+    return [
+        message or render_message(message_type, params, *context.get(appointment_id, (None,) * 4), locale=locale)
+        for message_type, appointment_id, params, message in items
+    ]
+
+
+def render_notifications(notifications, locale=DEFAULT_LOCALE):
+    """Fill in `.text` on Notification or NotificationArchive rows; returns them."""
+    texts = render_messages(
+        [(n.type, n.appointment_id, n.params, n.message) for n in notifications], locale
+    )
+    for notification, text in zip(notifications, texts):
+        notification.text = text
+    return notifications
+
+
+# Migration of pre-formatted messages
+
+def _pattern(template):
+    # Names and notes may contain anything, so fields match lazily up to the
+    # next literal; the whole message must match
+    regex = ''.join(
+        re.escape(literal) + (f'(?P<{name}>.*?)' if name is not None else '')
+        for literal, name in _compile(template)
+    )
+    return re.compile(regex + r'\Z', re.DOTALL)
+
+
+_PATTERNS = {message_type: _pattern(template) for message_type, template in MESSAGE_TEMPLATES[DEFAULT_LOCALE].items()}
+
+
+def parse_message(message_type, message):
+    """(matched, params) for a pre-formatted message."""
+    pattern = _PATTERNS.get(message_type)
+    match = pattern.match(message) if pattern else None
+    if not match:
+        return False, None
+    return True, notification_params(match.groupdict().get('notes'))
+
+
+def compact_batch(model, last_id, batch_size):
+    """Convert one batch of rows with a stored message; returns (rows seen, rows compacted, last id)."""
+    table = model.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.type, table.c.message, table.c.appointment_id, Appointment.id.label('appointment_exists'))
+        .outerjoin(Appointment, Appointment.id == table.c.appointment_id)
+        .where(table.c.id > last_id, table.c.message != '')
+        .order_by(table.c.id).limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, 0, last_id
+    changes = []
+    for row in rows:
+        # Messages about deleted appointments keep their text
+        if row.appointment_exists is None:
+            continue
+        matched, params = parse_message(row.type, row.message)
+        if not matched:
+            continue
+        changes.append({'row_id': row.id, 'params': params})
+    if changes:
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('row_id')).values(message='', params=bindparam('params')),
+            changes
+        )
+    db.session.commit()
+    return len(rows), len(changes), rows[-1].id
+
+
+notifications_cli = AppGroup('notifications', help='Maintain stored notifications.')
+
+
+@notifications_cli.command('compact')
+@click.option('--batch-size', default=500, show_default=True)
+def compact_command(batch_size):
+    """Replace pre-formatted messages with type and params, in batches."""
+    for model in (Notification, NotificationArchive):
+        seen = compacted = 0
+        last_id = 0
+        while True:
+            batch_seen, batch_compacted, last_id = compact_batch(model, last_id, batch_size)
+            if not batch_seen:
+                break
+            seen += batch_seen
+            compacted += batch_compacted
+        click.echo(f"{model.__tablename__}: compacted {compacted} of {seen} messages "
+                   f"({seen - compacted} kept as text)")
+
+
+app.cli.add_command(notifications_cli)
@@ -0,0 +1,379 @@
+#outbox.py
+# Transactional outbox for notification delivery.
+#
+# Request handlers call enqueue() next to the Notification rows they create,
+# so delivery work is committed atomically with the change that caused it and
+# no network call happens inside a request. The dispatcher claims pending
+# events in batches (FOR UPDATE SKIP LOCKED on PostgreSQL, a single atomic
+# UPDATE on SQLite), coalesces them per recipient and channel, and sends them
+# through pluggable channels with exponential-backoff retries. A claim is a
+# lease of OUTBOX_LEASE_SECONDS that the dispatcher renews while it works
+# through a batch; claims of a dispatcher that died are released when it
+# runs out.
+#
+# Run it with `flask outbox dispatch`, or set OUTBOX_DISPATCHER_THREAD=true to
+# run it in a background thread of the web process.
+import json
+import smtplib
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func, insert, select, update
+
+from app import app, db
+from config import (OUTBOX_CHANNELS, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_SECONDS,
+                    OUTBOX_LEASE_SECONDS, OUTBOX_POLL_SECONDS, OUTBOX_DISPATCHER_THREAD, SMTP_HOST, SMTP_PORT,
+                    SMTP_USERNAME, SMTP_PASSWORD, SMTP_USE_TLS, MAIL_FROM, SENDGRID_API_KEY)
+from models import OutboxEvent, User
+from notification_messages import render_messages
+
+
+def enqueue(notifications, channels=None):
+    """Record delivery events for notifications in the current transaction.
+
+    `notifications` are dicts with the Notification columns user_id,
+    appointment_id, type and params. One event is written per configured
+    channel with a single multi-row insert; nothing is sent here, and the
+    text is rendered when the event is delivered.
+    """
+    channels = OUTBOX_CHANNELS if channels is None else channels
+    now = datetime.utcnow()
+    rows = [
+        {
+            'user_id': notification['user_id'],
+            'channel': channel,
+            'event_type': notification['type'],
+            'payload': json.dumps({
+                'appointment_id': notification.get('appointment_id'),
+                'params': notification.get('params'),
+            }, separators=(',', ':')),
+            'status': 'pending',
+            'attempts': 0,
+            'available_at': now,
+            'created_at': now,
+        }
+        for notification in notifications
+        for channel in channels
+    ]
+    if rows:
+        db.session.execute(insert(OutboxEvent), rows)
+    return len(rows)
+
+
+# Channels
+
+class DeliveryError(Exception):
+    pass
+
+
+_channels = {}
+
+
+def register_channel(name):
+    def decorator(cls):
+        _channels[name] = cls
+        return cls
+    return decorator
+
+
+class Channel(ABC):
+    """Delivers a batch of events for one recipient."""
+
+    @abstractmethod
+    def send(self, user, events):
+        """Deliver the events to the user; raise DeliveryError on failure."""
+
+
+def event_messages(events):
+    """Notification text for events; payloads queued before rendering moved still carry it."""
+    payloads = [json.loads(event.payload) for event in events]
+    return render_messages([
+        (event.event_type, payload.get('appointment_id'), payload.get('params'), payload.get('message'))
+        for event, payload in zip(events, payloads)
+    ])
+
+
+@register_channel('log')
+class LogChannel(Channel):
+    def send(self, user, events):
+        for event, message in zip(events, event_messages(events)):
+            app.logger.info(f"[outbox:{event.event_type}] to {user.email}: {message}")
+
+
+@register_channel('email')
+class EmailChannel(Channel):
+    def compose(self, user, events):
+        messages = event_messages(events)
+        message = EmailMessage()
+        message['From'] = MAIL_FROM
+        message['To'] = user.email
+        if len(messages) == 1:
+            message['Subject'] = 'HealthConnect: appointment update'
+        else:
+            message['Subject'] = f'HealthConnect: {len(messages)} appointment updates'
+        message.set_content('\n\n'.join(messages) + '\n\nLog in to HealthConnect to see the details.')
+        return message
+
+    def send(self, user, events):
+        message = self.compose(user, events)
+        try:
+            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as smtp:
+                if SMTP_USE_TLS:
+                    smtp.starttls()
+                if SMTP_USERNAME:
+                    smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
+                smtp.send_message(message)
+        except (OSError, smtplib.SMTPException) as e:
+            raise DeliveryError(f"SMTP delivery failed: {str(e)}")
+
+
+@register_channel('sendgrid')
+class SendGridChannel(EmailChannel):
+    def send(self, user, events):
+        if not SENDGRID_API_KEY:
+            raise DeliveryError('SENDGRID_API_KEY is not configured')
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail
+
+        composed = self.compose(user, events)
+        mail = Mail(
+            from_email=MAIL_FROM,
+            to_emails=user.email,
+            subject=composed['Subject'],
+            plain_text_content=composed.get_content()
+        )
+        try:
+            SendGridAPIClient(SENDGRID_API_KEY).send(mail)
+        except Exception as e:
+            raise DeliveryError(f"SendGrid delivery failed: {str(e)}")
+
+
+# Dispatcher
+
+def _pending_ids(now, limit):
+    return select(OutboxEvent.id).where(
+        OutboxEvent.status == 'pending',
+        OutboxEvent.available_at <= now
+    ).order_by(
+        OutboxEvent.id
+    ).limit(limit)
+
+
+def release_stale_claims(now=None):
+    """Return events claimed by a dispatcher that died mid-batch to the queue."""
+    now = now or datetime.utcnow()
+    result = db.session.execute(
+        update(OutboxEvent).where(
+            OutboxEvent.status == 'claimed',
+            OutboxEvent.claimed_at < now - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        ).values(status='pending', claim_token=None, claimed_at=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE):
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claim = dict(status='claimed', claim_token=token, claimed_at=now)
+
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent dispatchers skip rows another one has locked
+        ids = db.session.execute(
+            _pending_ids(now, limit).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if ids:
+            db.session.execute(update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(**claim))
+    else:
+        # SQLite has no row locks; one UPDATE with a subquery claims atomically
+        # because SQLite serializes writers.
+        db.session.execute(
+            update(OutboxEvent).where(
+                OutboxEvent.id.in_(_pending_ids(now, limit).scalar_subquery()),
+                OutboxEvent.status == 'pending'
+            ).values(**claim)
+        )
+    db.session.commit()
+    return OutboxEvent.query.filter_by(claim_token=token).order_by(OutboxEvent.id).all()
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def renew_claim(token):
+    """Extend the lease on the events still claimed with token; returns their ids."""
+    ids = db.session.execute(
+        update(OutboxEvent).where(
+            OutboxEvent.claim_token == token,
+            OutboxEvent.status == 'claimed'
+        ).values(claimed_at=datetime.utcnow()).returning(OutboxEvent.id)
+    ).scalars().all()
+    db.session.commit()
+    return set(ids)
+
+
+_RESULT_COLUMNS = ('status', 'sent_at', 'attempts', 'last_error', 'available_at')
+
+
+def _save_results(token, results):
+    """Write one group's outcome, only for events this dispatcher still holds."""
+    table = OutboxEvent.__table__
+    db.session.execute(
+        update(table).where(
+            table.c.id == bindparam('event_id'),
+            table.c.claim_token == token
+        ).values(claim_token=None, claimed_at=None, **{name: bindparam(name) for name in _RESULT_COLUMNS}),
+        results
+    )
+    db.session.commit()
+
+
+def dispatch_once(limit=OUTBOX_BATCH_SIZE):
+    """Claim and deliver one batch. Returns counts of sent/retried/failed events.
+
+    Each group's outcome is committed as soon as it is sent, and the lease on
+    the rest of the batch is renewed every third of OUTBOX_LEASE_SECONDS, so a
+    slow batch is never released to another dispatcher and sent twice.
+    """
+    events = claim_batch(limit)
+    counts = {'claimed': len(events), 'sent': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+    if not events:
+        return counts
+    token = events[0].claim_token
+    owned = {event.id for event in events}
+
+    users = {
+        user.id: user
+        for user in User.query.filter(User.id.in_({event.user_id for event in events})).all()
+    }
+    # Detached so the per-group commits below don't expire (and reload) them
+    db.session.expunge_all()
+
+    # Coalesce: one delivery per (channel, recipient)
+    groups = {}
+    for event in events:
+        groups.setdefault((event.channel, event.user_id), []).append(event)
+
+    renew_at = time.monotonic() + OUTBOX_LEASE_SECONDS / 3
+    for (channel_name, user_id), group in groups.items():
+        if time.monotonic() >= renew_at:
+            owned = renew_claim(token)
+            renew_at = time.monotonic() + OUTBOX_LEASE_SECONDS / 3
+        if not all(event.id in owned for event in group):
+            # The lease ran out anyway and another dispatcher has these events
+            counts['lost'] += len(group)
+            continue
+
+        error = None
+        channel_cls = _channels.get(channel_name)
+        user = users.get(user_id)
+        if channel_cls is None:
+            error = f"Unknown channel {channel_name}"
+        elif user is None:
+            error = f"User {user_id} not found"
+        else:
+            try:
+                channel_cls().send(user, group)
+            except Exception as e:
+                error = str(e)
+
+        now = datetime.utcnow()
+        results = []
+        for event in group:
+            result = {'event_id': event.id, 'status': 'sent', 'sent_at': None, 'attempts': event.attempts or 0,
+                      'last_error': event.last_error, 'available_at': event.available_at}
+            if error is None:
+                result['sent_at'] = now
+                counts['sent'] += 1
+            else:
+                result['attempts'] += 1
+                result['last_error'] = error
+                if result['attempts'] >= OUTBOX_MAX_ATTEMPTS or channel_cls is None or user is None:
+                    result['status'] = 'failed'
+                    counts['failed'] += 1
+                else:
+                    result['status'] = 'pending'
+                    result['available_at'] = now + retry_delay(result['attempts'])
+                    counts['retried'] += 1
+            results.append(result)
+        _save_results(token, results)
+        if error:
+            app.logger.warning(f"Outbox delivery via {channel_name} to user {user_id} failed: {error}")
+
+    return counts
+
+
+def run_dispatcher(stop_event=None, poll_seconds=OUTBOX_POLL_SECONDS, limit=OUTBOX_BATCH_SIZE):
+    """Dispatch until stop_event is set; sleeps only when the queue is empty."""
+    stop_event = stop_event or threading.Event()
+    last_release = 0
+    while not stop_event.is_set():
+        try:
+            if time.monotonic() - last_release > OUTBOX_LEASE_SECONDS / 2:
+                release_stale_claims()
+                last_release = time.monotonic()
+            counts = dispatch_once(limit)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Outbox dispatcher error: {str(e)}")
+            counts = {'claimed': 0}
+        finally:
+            db.session.remove()
+        if not counts['claimed']:
+            stop_event.wait(poll_seconds)
+
+
+def start_dispatcher_thread():
+    stop_event = threading.Event()
+
+    def run():
+        with app.app_context():
+            run_dispatcher(stop_event)
+
+    thread = threading.Thread(target=run, name='outbox-dispatcher', daemon=True)
+    thread.start()
+    return thread, stop_event
+
+
+def outbox_stats():
+    rows = db.session.query(OutboxEvent.status, func.count(OutboxEvent.id)).group_by(OutboxEvent.status).all()
+    return dict(rows)
+
+
+outbox_cli = AppGroup('outbox', help='Deliver queued notifications.')
+
+
+@outbox_cli.command('dispatch')
+@click.option('--once', is_flag=True, help='Deliver one batch and exit.')
+@click.option('--batch-size', default=OUTBOX_BATCH_SIZE, show_default=True)
+@click.option('--poll', default=OUTBOX_POLL_SECONDS, show_default=True, help='Seconds to wait when idle.')
+def dispatch_command(once, batch_size, poll):
+    """Run the outbox dispatcher."""
+    if once:
+        release_stale_claims()
+        click.echo(dispatch_once(batch_size))
+        return
+    try:
+        run_dispatcher(poll_seconds=poll, limit=batch_size)
+    except KeyboardInterrupt:
+        pass
+
+
+@outbox_cli.command('stats')
+def stats_command():
+    """Show event counts by status."""
+    for status, count in sorted(outbox_stats().items()):
+        click.echo(f"{status}: {count}")
+
+
+app.cli.add_command(outbox_cli)
+
+if OUTBOX_DISPATCHER_THREAD:
+    start_dispatcher_thread()
@@ -0,0 +1,125 @@
+#page_cache.py
+# In-process caching of rendered pages and template fragments.
+#
+# cached_page() stores whole responses for anonymous GET requests (the
+# landing page is the same for every visitor) in this process only; clients
+# are told to revalidate them. Far-future caching is left to fingerprinted
+# static assets (see static_assets.py). cache_fragment is a Jinja
+# global for caching pieces of a template that only vary by a few keys,
+# used with a call block:
+#
+#     {% call cache_fragment('footer', session.get('user_type')) %} ... {% endcall %}
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session, make_response
+from markupsafe import Markup
+
+from app import app
+from config import PAGE_CACHE_TIMEOUT, PAGE_CACHE_MAX_ENTRIES
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a timeout."""
+
+    def __init__(self, max_entries=PAGE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+page_cache = TTLCache()
+fragment_cache = TTLCache()
+
+
+def _cacheable_request():
+    # Logged-in pages and pages with pending flash messages are per-user
+    return (
+        PAGE_CACHE_TIMEOUT > 0
+        and request.method == 'GET'
+        and 'user_id' not in session
+        and '_flashes' not in session
+    )
+
+
+def cached_page(timeout=PAGE_CACHE_TIMEOUT):
+    """Cache the full response of a view for anonymous visitors."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _cacheable_request():
+                return f(*args, **kwargs)
+
+            key = (request.endpoint, request.full_path)
+            cached = page_cache.get(key)
+            if cached is None:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                body = response.get_data()
+                cached = {
+                    'body': body,
+                    # Compressed once here instead of on every hit
+                    'gzip_body': gzip.compress(body, mtime=0),
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body).hexdigest()
+                }
+                page_cache.set(key, cached, timeout)
+
+            if request.accept_encodings['gzip']:
+                response = make_response(cached['gzip_body'])
+                response.headers['Content-Encoding'] = 'gzip'
+                response.set_etag(cached['etag'] + '-gz')
+            else:
+                response = make_response(cached['body'])
+                response.set_etag(cached['etag'])
+            response.mimetype = cached['mimetype']
+            response.vary.add('Accept-Encoding')
+            response.vary.add('Cookie')
+            # The same URL is a redirect once the visitor logs in, so browsers
+            # and proxies must revalidate (cheap with the ETag) on every use
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
+
+
+@app.template_global()
+def cache_fragment(*key, timeout=PAGE_CACHE_TIMEOUT, caller=None):
+    if PAGE_CACHE_TIMEOUT <= 0:
+        return caller()
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(caller())
+        fragment_cache.set(key, html, timeout)
+    return html
@@ -0,0 +1,233 @@
+#prompts.py
+# Prompt construction for the Gemini text and vision models.
+#
+# Templates are compiled once at import time. The instruction block comes first
+# and never changes between requests, so providers that cache prompt prefixes
+# can reuse it; the patient-specific block is always appended last. Free-text
+# fields are held to a per-field token budget so a pasted history cannot blow
+# up prompt size, cost or latency.
+import hashlib
+import re
+from dataclasses import dataclass, field
+from string import Template
+
+# Rough characters-per-token ratio for English text on Gemini/GPT tokenizers.
+CHARS_PER_TOKEN = 4
+
+# Per-field token budgets. Fields not listed here are passed through unchanged.
+FIELD_BUDGETS = {
+    'symptoms': 600,
+    'medical_history': 400,
+    'duration': 16,
+    'severity': 16,
+    'gender': 8,
+    'age': 4,
+}
+
+# Inputs longer than budget * factor characters are clipped before processing.
+SCAN_WINDOW_FACTOR = 8
+
+TRUNCATION_MARKER = ' [...{omitted} characters omitted...] '
+
+SYMPTOM_PREFIX = """As a medical AI assistant, analyze the patient information given at the end of this prompt.
+
+Please provide a comprehensive analysis with the following structure:
+
+Possible Conditions:
+[List each condition with confidence level and brief description]
+- Condition (High/Medium/Low confidence): Description and typical presentation
+
+Key Symptoms Analysis:
+- [Analyze each reported symptom and its significance]
+
+Risk Factors:
+- [List relevant risk factors based on patient's profile]
+
+Recommended Next Steps:
+1. [Immediate actions or self-care measures]
+2. [When to seek professional medical care]
+3. [Suggested medical tests or examinations]
+
+Warning Signs:
+- [List specific symptoms or changes that require immediate medical attention]
+
+Preventive Measures:
+1. [Lifestyle modifications]
+2. [Preventive actions]
+3. [General health recommendations]
+
+Note: This is an AI-generated analysis for informational purposes only. Please consult with a healthcare provider for proper medical diagnosis and treatment.
+"""
+
+IMAGE_PREFIX = """As a medical AI assistant, analyze this medical image together with the patient information given at the end of this prompt.
+
+Please provide a detailed analysis of the visible symptoms or conditions in the image.
+Structure your analysis in the following sections:
+
+Visual Findings:
+[Describe all visible symptoms, abnormalities, or medical conditions shown in the image]
+
+Potential Diagnoses:
+[List possible diagnoses based on the visual findings, ordered by likelihood]
+
+Recommended Medical Specialties:
+[Suggest which medical specialists would be appropriate for follow-up care]
+
+Important Notes:
+[Include any critical observations or warnings about the condition]
+
+This is for educational purposes only and not a substitute for professional medical diagnosis.
+"""
+
+SYMPTOM_PATIENT_TEMPLATE = Template("""
+Patient Information:
+- Age: $age
+- Gender: $gender
+- Symptoms: $symptoms
+- Duration: $duration
+- Severity: $severity
+- Medical History: $medical_history
+""")
+
+IMAGE_PATIENT_TEMPLATE = Template("""
+Patient Information:
+- Age: $age
+- Gender: $gender
+- Reported Symptoms: $symptoms
+- Medical History: $medical_history
+""")
+
+
+def _template_version(*parts):
+    return hashlib.sha1(''.join(parts).encode('utf-8')).hexdigest()[:8]
+
+
+# Change whenever a template changes; stored with each analysis so old ones can
+# be found and re-run (see reanalysis.py)
+SYMPTOM_PROMPT_VERSION = _template_version(SYMPTOM_PREFIX, SYMPTOM_PATIENT_TEMPLATE.template)
+IMAGE_PROMPT_VERSION = _template_version(IMAGE_PREFIX, IMAGE_PATIENT_TEMPLATE.template)
+
+_WHITESPACE_RE = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?;\n])\s+')
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    prefix: str
+    tokens: int
+    prefix_tokens: int
+    field_tokens: dict = field(default_factory=dict)
+    truncated_fields: list = field(default_factory=list)
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _normalize(value):
+    value = '' if value is None else str(value)
+    value = _WHITESPACE_RE.sub(' ', value.strip())
+    return _BLANK_LINES_RE.sub('\n\n', value)
+
+
+def _summarize(value):
+    # Drop repeated sentences (copy/pasted histories often contain the same
+    # line several times) while keeping first-seen order.
+    seen = set()
+    kept = []
+    for sentence in _SENTENCE_SPLIT_RE.split(value):
+        key = sentence.strip().lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        kept.append(sentence.strip())
+    return ' '.join(kept)
+
+
+def fit_to_budget(value, max_tokens):
+    """Return (text, truncated) with text held to roughly max_tokens tokens.
+
+    Deterministic: the same input always yields the same output, so identical
+    submissions produce identical prompts.
+    """
+    value = '' if value is None else str(value)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    original_len = len(value)
+
+    # Only look at a bounded window of very long inputs so the cost of building
+    # a prompt depends on the budget, not on how much text was pasted.
+    window = max_chars * SCAN_WINDOW_FACTOR
+    if original_len > window:
+        value = value[:window * 3 // 4] + '\n' + value[original_len - window // 4:]
+
+    value = _normalize(value)
+    if len(value) <= max_chars and original_len <= window:
+        return value, False
+
+    value = _summarize(value)
+    if len(value) <= max_chars:
+        return value, True
+
+    # Keep the beginning and the end of the text; the most recent part of a
+    # history is usually appended at the bottom.
+    keep = max(max_chars - len(TRUNCATION_MARKER) - 8, 0)
+    head_len = keep * 2 // 3
+    tail_len = keep - head_len
+    head = value[:head_len]
+    tail = value[len(value) - tail_len:] if tail_len else ''
+    if ' ' in head:
+        head = head[:head.rindex(' ')]
+    if ' ' in tail:
+        tail = tail[tail.index(' ') + 1:]
+    omitted = original_len - len(head) - len(tail)
+    return head + TRUNCATION_MARKER.format(omitted=omitted) + tail, True
+
+
+def _build(prefix, template, fields):
+    values = {}
+    field_tokens = {}
+    truncated = []
+    for name, value in fields.items():
+        budget = FIELD_BUDGETS.get(name)
+        if budget is None:
+            text = _normalize(value)
+        else:
+            text, was_truncated = fit_to_budget(value, budget)
+            if was_truncated:
+                truncated.append(name)
+        values[name] = text
+        field_tokens[name] = estimate_tokens(text)
+
+    text = prefix + template.substitute(values)
+    return BuiltPrompt(
+        text=text,
+        prefix=prefix,
+        tokens=estimate_tokens(text),
+        prefix_tokens=estimate_tokens(prefix),
+        field_tokens=field_tokens,
+        truncated_fields=truncated
+    )
+
+
+def build_symptom_prompt(symptoms, age, gender, duration, severity, medical_history):
+    return _build(SYMPTOM_PREFIX, SYMPTOM_PATIENT_TEMPLATE, {
+        'age': age,
+        'gender': gender,
+        'symptoms': symptoms,
+        'duration': duration,
+        'severity': severity,
+        'medical_history': medical_history,
+    })
+
+
+def build_image_prompt(symptoms, age, gender, medical_history):
+    return _build(IMAGE_PREFIX, IMAGE_PATIENT_TEMPLATE, {
+        'age': age,
+        'gender': gender,
+        'symptoms': symptoms,
+        'medical_history': medical_history,
+    })
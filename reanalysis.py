@@ -0,0 +1,420 @@
+#reanalysis.py
+# Offline re-analysis of stored symptom checks.
+#
+#   flask reanalyze text            re-run the text analysis of checks whose
+#                                   analysis_version (model and prompt) is not
+#                                   the current one
+#   flask reanalyze image-sections  create the ImageAnalysisSection rows missing
+#                                   for checks with an image, calling the
+#                                   vision model only where there is no stored
+#                                   image analysis (--reanalyze redoes them all)
+#   flask reanalyze status          show job checkpoints
+#
+# Candidate rows are read in keyset batches by the main thread, which is the
+# only one using the database session. Model calls fan out over a bounded
+# thread pool and share one rate limiter; while a batch is being written the
+# next one is already with the workers. Each batch's results are written with
+# bulk statements in one transaction together with the job's checkpoint, so
+# an interrupted job resumes after the last committed batch. Pass --model fake
+# to run against a local stand-in for the Gemini models.
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, delete, exists, func, insert, select, update
+
+import commit_hooks
+import routes
+from app import app, db
+from check_summary import summary_values
+from config import (GEMINI_TEXT_MODEL, GEMINI_VISION_MODEL, REANALYSIS_WORKERS, REANALYSIS_RATE_PER_MINUTE,
+                    REANALYSIS_BATCH_SIZE, REANALYSIS_MAX_RETRIES)
+from models import SymptomCheck, ImageAnalysisSection, JobCheckpoint
+from prompts import build_symptom_prompt, build_image_prompt, SYMPTOM_PROMPT_VERSION, IMAGE_PROMPT_VERSION
+from routes import analyze_medical_image, format_symptom_analysis, parse_image_sections
+from uploads import open_check_image
+
+# Failed row ids kept on a checkpoint
+MAX_FAILED_IDS = 1000
+
+MAX_BACKOFF_SECONDS = 60
+
+
+class FakeModel:
+    """Local stand-in for a Gemini model: well-formed analyses after a fixed delay."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents):
+        prompt = contents if isinstance(contents, str) else contents[0]
+        time.sleep(self.latency)
+        with self._lock:
+            fail = self._random.random() < self.failure_rate
+        if fail:
+            raise RuntimeError('Fake model failure')
+        match = re.search(r'Symptoms: (.*)', prompt)
+        symptoms = match.group(1).strip() if match else 'the reported symptoms'
+        if 'Visual Findings:' in prompt:
+            text = (f"Visual Findings:\nFindings consistent with {symptoms}.\n\n"
+                    "Potential Diagnoses:\n1. Contact dermatitis\n\n"
+                    "Recommended Medical Specialties:\n- Dermatologist\n\n"
+                    "Important Notes:\nGenerated by the fake model.")
+        else:
+            text = (f"**Possible Conditions:**\n- Viral infection (Medium confidence): consistent with {symptoms}\n\n"
+                    f"Key Symptoms Analysis:\n- {symptoms}\n\nRisk Factors:\n- None reported\n\n"
+                    "Recommended Next Steps:\n1. Rest and fluids\n\nWarning Signs:\n- Worsening symptoms\n\n"
+                    "Preventive Measures:\n1. Generated by the fake model.")
+        return SimpleNamespace(text=text)
+
+
+class RateLimiter:
+    """Spaces calls evenly across all threads to at most `per_minute` a minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(self._next, time.monotonic())
+            self._next = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ModelCaller:
+    """Rate-limited model calls with exponential backoff, shared by the workers."""
+
+    def __init__(self, limiter, max_retries=REANALYSIS_MAX_RETRIES):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            with self._lock:
+                self.calls += 1
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(min(2 ** attempt + random.random(), MAX_BACKOFF_SECONDS))
+
+
+def _prompt_fields(row):
+    return {
+        'symptoms': row.symptoms or '',
+        'age': str(row.age) if row.age is not None else '',
+        'gender': row.gender or '',
+        'medical_history': row.medical_history or '',
+    }
+
+
+class TextReanalysis:
+    """Re-run the text analysis of checks written with another model or prompt."""
+
+    name = 'reanalyze-text'
+
+    def __init__(self, model, model_name, patient_id=None):
+        self.model = model
+        self.version = f"{model_name}:{SYMPTOM_PROMPT_VERSION}"
+        self.patient_id = patient_id
+
+    def params(self):
+        return {'version': self.version, 'patient_id': self.patient_id}
+
+    def criteria(self):
+        criteria = [SymptomCheck.analysis_version.is_(None) | (SymptomCheck.analysis_version != self.version)]
+        if self.patient_id:
+            criteria.append(SymptomCheck.patient_id == self.patient_id)
+        return criteria
+
+    def columns(self):
+        # Everything the similarity index hook needs, as in similarity.py
+        return [
+            SymptomCheck.id, SymptomCheck.patient_id, SymptomCheck.symptoms, SymptomCheck.age,
+            SymptomCheck.gender, SymptomCheck.duration, SymptomCheck.severity, SymptomCheck.medical_history,
+            (SymptomCheck.image_data.isnot(None) | SymptomCheck.image_sha256.isnot(None)).label('has_image'),
+        ]
+
+    def process(self, row, call):
+        fields = _prompt_fields(row)
+        prompt = build_symptom_prompt(fields['symptoms'], fields['age'], fields['gender'], row.duration or '',
+                                      row.severity or '', fields['medical_history'])
+        response = call(self.model.generate_content, prompt.text)
+        if not response or not response.text:
+            raise ValueError('Empty response from model')
+        return {'row': row, 'ai_analysis': format_symptom_analysis(response.text)}
+
+    def write(self, session, results):
+        # Bulk UPDATE by primary key bypasses check_summary's listeners and the
+        # flush, so summary fields and commit hooks are handled here
+        session.execute(update(SymptomCheck), [dict(
+            summary_values(result['row'].symptoms, result['ai_analysis'], result['row'].has_image),
+            id=result['row'].id,
+            ai_analysis=result['ai_analysis'],
+            analysis_version=self.version,
+        ) for result in results])
+        commit_hooks.record(session, SymptomCheck, 'update', [
+            dict(result['row']._mapping, ai_analysis=result['ai_analysis']) for result in results
+        ])
+
+
+class ImageSectionBackfill:
+    """Create missing image analysis sections, analysing the image where needed."""
+
+    name = 'reanalyze-image-sections'
+
+    def __init__(self, model, model_name, reanalyze=False):
+        self.model = model
+        self.version = f"{model_name}:{IMAGE_PROMPT_VERSION}"
+        self.reanalyze = reanalyze
+
+    def params(self):
+        return {'version': self.version if self.reanalyze else None, 'reanalyze': self.reanalyze}
+
+    def criteria(self):
+        criteria = [SymptomCheck.image_sha256.isnot(None) | SymptomCheck.image_data.isnot(None)]
+        if not self.reanalyze:
+            criteria.append(~exists().where(ImageAnalysisSection.symptom_check_id == SymptomCheck.id))
+        return criteria
+
+    def columns(self):
+        # The legacy base64 image is only read for checks that need the model
+        image_data = SymptomCheck.image_data if self.reanalyze else case(
+            (SymptomCheck.image_analysis.is_(None), SymptomCheck.image_data)
+        )
+        return [
+            SymptomCheck.id, SymptomCheck.symptoms, SymptomCheck.age, SymptomCheck.gender,
+            SymptomCheck.medical_history, SymptomCheck.image_sha256, SymptomCheck.image_mime,
+            SymptomCheck.image_analysis, image_data.label('image_data'),
+        ]
+
+    def process(self, row, call):
+        analysis = None if self.reanalyze else row.image_analysis
+        if not analysis:
+            fields = _prompt_fields(row)
+            prompt = build_image_prompt(fields['symptoms'], fields['age'], fields['gender'],
+                                        fields['medical_history'])
+            with open_check_image(row.image_sha256, row.image_mime, row.image_data) as image:
+                def analyse():
+                    image.seek(0)  # again on retries
+                    return analyze_medical_image(image, fields['symptoms'], fields['age'], fields['gender'],
+                                                 fields['medical_history'], prompt=prompt, model=self.model)
+                analysis = call(analyse)
+        return {'row': row, 'image_analysis': analysis, 'changed': analysis != row.image_analysis,
+                'sections': parse_image_sections(analysis)}
+
+    def write(self, session, results):
+        changed = [result for result in results if result['changed']]
+        if changed:
+            session.execute(update(SymptomCheck), [
+                {'id': result['row'].id, 'image_analysis': result['image_analysis']} for result in changed
+            ])
+        if self.reanalyze:
+            session.execute(delete(ImageAnalysisSection).where(
+                ImageAnalysisSection.symptom_check_id.in_([result['row'].id for result in results])
+            ))
+        sections = [
+            {'symptom_check_id': result['row'].id, 'section_title': title, 'section_content': content,
+             'section_order': order, 'created_at': datetime.utcnow()}
+            for result in results for title, content, order in result['sections']
+        ]
+        if sections:
+            session.execute(insert(ImageAnalysisSection), sections)
+
+
+def _checkpoint(job, restart):
+    params = json.dumps(job.params(), sort_keys=True)
+    checkpoint = JobCheckpoint.query.filter_by(name=job.name).first()
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=job.name)
+        db.session.add(checkpoint)
+    elif not restart and checkpoint.finished_at is None and checkpoint.params == params:
+        return checkpoint
+    checkpoint.params = params
+    checkpoint.last_id = 0
+    checkpoint.processed = 0
+    checkpoint.failed = 0
+    checkpoint.failed_ids = None
+    checkpoint.last_error = None
+    checkpoint.started_at = datetime.utcnow()
+    checkpoint.updated_at = checkpoint.started_at
+    checkpoint.finished_at = None
+    db.session.commit()
+    return checkpoint
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s"
+
+
+def run_job(job, workers=REANALYSIS_WORKERS, batch_size=REANALYSIS_BATCH_SIZE,
+            rate_per_minute=REANALYSIS_RATE_PER_MINUTE, restart=False, limit=None, echo=click.echo):
+    """Run a re-analysis job to completion (or `limit` rows); returns its checkpoint."""
+    checkpoint = _checkpoint(job, restart)
+    criteria = job.criteria()
+    total = db.session.execute(
+        select(func.count()).select_from(SymptomCheck).where(SymptomCheck.id > checkpoint.last_id, *criteria)
+    ).scalar()
+    if limit:
+        total = min(total, limit)
+    echo(f"{job.name}: {total} checks to process"
+         + (f", resuming after id {checkpoint.last_id}" if checkpoint.last_id else ''))
+
+    call = ModelCaller(RateLimiter(rate_per_minute))
+    failed_ids = json.loads(checkpoint.failed_ids or '[]')
+    last_read = checkpoint.last_id
+    remaining = total
+    done = 0
+    started = time.monotonic()
+
+    def next_batch():
+        nonlocal last_read, remaining
+        if remaining <= 0:
+            return None
+        rows = db.session.execute(
+            select(*job.columns()).where(SymptomCheck.id > last_read, *criteria)
+            .order_by(SymptomCheck.id).limit(min(batch_size, remaining))
+        ).all()
+        if not rows:
+            return None
+        last_read = rows[-1].id
+        remaining -= len(rows)
+        return rows, [pool.submit(job.process, row, call) for row in rows]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        batch = next_batch()
+        if batch:
+            in_flight.append(batch)
+        while in_flight:
+            # Keep the workers busy with the next batch while this one is written
+            batch = next_batch()
+            if batch:
+                in_flight.append(batch)
+            rows, futures = in_flight.popleft()
+            results = []
+            for row, future in zip(rows, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    app.logger.error(f"{job.name}: check {row.id} failed: {str(e)}")
+                    failed_ids.append(row.id)
+                    checkpoint.failed += 1
+                    checkpoint.last_error = f"check {row.id}: {str(e)}"[:1000]
+            try:
+                if results:
+                    job.write(db.session, results)
+                checkpoint.last_id = rows[-1].id
+                checkpoint.processed += len(results)
+                checkpoint.failed_ids = json.dumps(failed_ids[-MAX_FAILED_IDS:])
+                checkpoint.updated_at = datetime.utcnow()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                for _, pending in in_flight:
+                    for future in pending:
+                        future.cancel()
+                raise
+
+            done += len(rows)
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed else 0
+            eta = (total - done) / rate if rate else 0
+            echo(f"{job.name}: {done}/{total} ({checkpoint.failed} failed) through id {checkpoint.last_id}, "
+                 f"{rate:.1f} checks/s, {call.calls} model calls ({call.retries} retries), "
+                 f"ETA {_format_duration(eta)}")
+
+    stopped_at_limit = limit and remaining <= 0
+    if not stopped_at_limit:
+        checkpoint.finished_at = datetime.utcnow()
+        db.session.commit()
+    echo(f"{job.name}: {checkpoint.processed} processed, {checkpoint.failed} failed "
+         f"in {_format_duration(time.monotonic() - started)}")
+    return checkpoint
+
+
+def select_models(model, fake_latency, fake_failure_rate):
+    """{'text': (model, name), 'vision': (model, name)} for --model."""
+    if model == 'fake':
+        fake = FakeModel(latency=fake_latency, failure_rate=fake_failure_rate)
+        return {'text': (fake, 'fake'), 'vision': (fake, 'fake')}
+    return {'text': (routes.text_model, GEMINI_TEXT_MODEL), 'vision': (routes.vision_model, GEMINI_VISION_MODEL)}
+
+
+reanalyze_cli = AppGroup('reanalyze', help='Re-run AI analyses over stored symptom checks.')
+
+
+def _job_options(command):
+    options = [
+        click.option('--model', type=click.Choice(['gemini', 'fake']), default='gemini', show_default=True,
+                     help='Use the configured Gemini models or a local fake.'),
+        click.option('--fake-latency', default=0.2, show_default=True, help='Seconds per fake model call.'),
+        click.option('--fake-failure-rate', default=0.0, show_default=True),
+        click.option('--workers', default=REANALYSIS_WORKERS, show_default=True),
+        click.option('--rate', 'rate_per_minute', default=REANALYSIS_RATE_PER_MINUTE, show_default=True,
+                     help='Model calls per minute across all workers (0 for no limit).'),
+        click.option('--batch-size', default=REANALYSIS_BATCH_SIZE, show_default=True,
+                     help='Rows per write transaction.'),
+        click.option('--limit', type=int, help='Stop after this many checks.'),
+        click.option('--restart', is_flag=True, help='Ignore the saved checkpoint.'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+@reanalyze_cli.command('text')
+@_job_options
+@click.option('--patient', 'patient_id', type=int, help='Only this patient\'s checks.')
+def reanalyze_text_command(model, fake_latency, fake_failure_rate, patient_id, **options):
+    """Re-run text analyses written with another model or prompt version."""
+    text_model, model_name = select_models(model, fake_latency, fake_failure_rate)['text']
+    run_job(TextReanalysis(text_model, model_name, patient_id), **options)
+
+
+@reanalyze_cli.command('image-sections')
+@_job_options
+@click.option('--reanalyze', is_flag=True, help='Analyse every image again instead of only filling in sections.')
+def reanalyze_image_sections_command(model, fake_latency, fake_failure_rate, reanalyze, **options):
+    """Create missing image analysis sections for checks with an image."""
+    vision_model, model_name = select_models(model, fake_latency, fake_failure_rate)['vision']
+    run_job(ImageSectionBackfill(vision_model, model_name, reanalyze), **options)
+
+
+@reanalyze_cli.command('status')
+def reanalyze_status_command():
+    """Show the checkpoints of re-analysis jobs."""
+    for checkpoint in JobCheckpoint.query.filter(JobCheckpoint.name.like('reanalyze-%')).order_by(JobCheckpoint.name):
+        state = f"finished {checkpoint.finished_at:%Y-%m-%d %H:%M}" if checkpoint.finished_at else 'in progress'
+        click.echo(f"{checkpoint.name}: {state}, through id {checkpoint.last_id}, {checkpoint.processed} processed, "
+                   f"{checkpoint.failed} failed, params {checkpoint.params}")
+        if checkpoint.last_error:
+            click.echo(f"  last error: {checkpoint.last_error}")
+
+
+app.cli.add_command(reanalyze_cli)
@@ -0,0 +1,383 @@
+#retention.py
+# Retention and archival for the tables that grow without bound.
+#
+# `flask retention run` moves read notifications and old symptom checks into
+# archive tables (notification_archive, symptom_check_archive) and deletes
+# delivered outbox events and expired idempotency keys. Rows move in small batches, each its own short
+# transaction (copy + delete), so a run can be interrupted and restarted at
+# any point and never holds locks for long. Archived rows stay readable
+# through the /api/archive/... endpoints. Stored image files that no live or
+# archived check refers to (left by a failed commit) are deleted last.
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import click
+from flask import jsonify, request, session
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, select, text, update
+
+import commit_hooks
+from app import app, db
+from config import (RETENTION_NOTIFICATION_DAYS, RETENTION_SYMPTOM_CHECK_DAYS, RETENTION_OUTBOX_DAYS,
+                    RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE, UPLOAD_ORPHAN_GRACE_SECONDS)
+from idempotency import prune_expired_batch
+from models import (Notification, NotificationArchive, SymptomCheck, SymptomCheckArchive, ImageAnalysisSection,
+                    OutboxEvent, Patient, IdempotencyKey, JobCheckpoint)
+from notification_messages import render_notifications
+from routes import login_required, patient_required
+from uploads import iter_stored_images
+
+# JobCheckpoint row holding the counts of the most recent run, for `flask retention stats`
+RUN_CHECKPOINT = 'retention'
+
+_NOTIFICATION_COLUMNS = ['id', 'user_id', 'appointment_id', 'message', 'type', 'params', 'is_read', 'created_at']
+
+_SYMPTOM_CHECK_COLUMNS = ['id', 'patient_id', 'symptoms', 'age', 'gender', 'duration', 'severity',
+                          'medical_history', 'ai_analysis', 'image_data', 'image_sha256', 'image_mime',
+                          'image_analysis', 'prompt_tokens', 'created_at']
+
+
+def _cutoff(days):
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _locked(query):
+    # Concurrent runs on PostgreSQL skip each other's batches
+    if db.engine.dialect.name == 'postgresql':
+        return query.with_for_update(skip_locked=True)
+    return query
+
+
+def _run_batches(move_batch, batch_size, max_batches, pause):
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = move_batch(batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def encode_payload(data):
+    return zlib.compress(json.dumps(data, default=_json_default, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_payload(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def archive_notifications_batch(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    rows = db.session.execute(
+        _locked(
+            select(Notification.__table__).where(
+                Notification.is_read.is_(True),
+                Notification.created_at < cutoff
+            ).order_by(Notification.id).limit(batch_size)
+        )
+    ).mappings().all()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    now = datetime.utcnow()
+    db.session.execute(
+        insert(NotificationArchive),
+        [dict({name: row[name] for name in _NOTIFICATION_COLUMNS}, archived_at=now) for row in rows]
+    )
+    db.session.execute(delete(Notification).where(Notification.id.in_([row['id'] for row in rows])))
+    db.session.commit()
+    return len(rows)
+
+
+def archive_symptom_checks_batch(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    rows = db.session.execute(
+        _locked(
+            select(SymptomCheck.__table__).where(
+                SymptomCheck.created_at < cutoff
+            ).order_by(SymptomCheck.id).limit(batch_size)
+        )
+    ).mappings().all()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    ids = [row['id'] for row in rows]
+    sections = {}
+    for section in db.session.query(
+        ImageAnalysisSection.symptom_check_id, ImageAnalysisSection.section_title,
+        ImageAnalysisSection.section_content, ImageAnalysisSection.section_order
+    ).filter(
+        ImageAnalysisSection.symptom_check_id.in_(ids)
+    ).order_by(ImageAnalysisSection.section_order):
+        sections.setdefault(section.symptom_check_id, []).append({
+            'title': section.section_title, 'content': section.section_content, 'order': section.section_order
+        })
+
+    now = datetime.utcnow()
+    archived = []
+    for row in rows:
+        data = {name: row[name] for name in _SYMPTOM_CHECK_COLUMNS}
+        data['image_sections'] = sections.get(row['id'], [])
+        archived.append({
+            'id': row['id'],
+            'patient_id': row['patient_id'],
+            'symptoms': row['symptoms'],
+            'severity': row['severity'],
+            'created_at': row['created_at'],
+            'archived_at': now,
+            'image_sha256': row['image_sha256'] or '',
+            'payload': encode_payload(data)
+        })
+    db.session.execute(insert(SymptomCheckArchive), archived)
+    db.session.execute(delete(ImageAnalysisSection).where(ImageAnalysisSection.symptom_check_id.in_(ids)))
+    db.session.execute(delete(SymptomCheck).where(SymptomCheck.id.in_(ids)))
+    # Bulk deletes bypass the flush; let the similarity index drop these checks
+    commit_hooks.record(db.session, SymptomCheck, 'delete', [{'id': check_id} for check_id in ids])
+    db.session.commit()
+    return len(rows)
+
+
+def prune_outbox_batch(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    ids = select(OutboxEvent.id).where(
+        OutboxEvent.status.in_(['sent', 'failed']),
+        OutboxEvent.created_at < cutoff
+    ).order_by(OutboxEvent.id).limit(batch_size)
+    result = db.session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids.scalar_subquery())))
+    db.session.commit()
+    return result.rowcount
+
+
+def fill_archive_image_refs_batch(batch_size=RETENTION_BATCH_SIZE):
+    """Copy image_sha256 out of the payload of archive rows from before the column."""
+    rows = db.session.execute(
+        select(SymptomCheckArchive.id, SymptomCheckArchive.payload).where(
+            SymptomCheckArchive.image_sha256.is_(None)
+        ).order_by(SymptomCheckArchive.id).limit(batch_size)
+    ).all()
+    if rows:
+        db.session.execute(update(SymptomCheckArchive), [
+            {'id': row.id, 'image_sha256': decode_payload(row.payload).get('image_sha256') or ''} for row in rows
+        ])
+    db.session.commit()
+    return len(rows)
+
+
+def prune_orphan_images(grace_seconds=UPLOAD_ORPHAN_GRACE_SECONDS, batch_size=RETENTION_BATCH_SIZE):
+    """Delete stored image files no check refers to; returns files deleted."""
+    _run_batches(fill_archive_image_refs_batch, batch_size, None, 0)
+    referenced = set(db.session.execute(
+        select(SymptomCheck.image_sha256).where(SymptomCheck.image_sha256.isnot(None)).distinct()
+    ).scalars())
+    referenced.update(db.session.execute(
+        select(SymptomCheckArchive.image_sha256).where(SymptomCheckArchive.image_sha256 != '').distinct()
+    ).scalars())
+    db.session.commit()
+
+    # Files written (or reused) within the grace period may belong to a check not committed yet
+    cutoff = time.time() - grace_seconds
+    deleted = 0
+    for path, sha256 in iter_stored_images():
+        if sha256 in referenced:
+            continue
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+                deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+def run_retention(batch_size=RETENTION_BATCH_SIZE, max_batches=None, pause=RETENTION_BATCH_PAUSE):
+    """Apply all retention policies. Returns rows moved (or deleted) per table."""
+    notification_cutoff = _cutoff(RETENTION_NOTIFICATION_DAYS)
+    check_cutoff = _cutoff(RETENTION_SYMPTOM_CHECK_DAYS)
+    outbox_cutoff = _cutoff(RETENTION_OUTBOX_DAYS)
+
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    moved = {
+        'notification': _run_batches(
+            lambda size: archive_notifications_batch(notification_cutoff, size), batch_size, max_batches, pause),
+        # Symptom checks carry large text and images; keep their batches smaller
+        'symptom_check': _run_batches(
+            lambda size: archive_symptom_checks_batch(check_cutoff, size),
+            max(1, batch_size // 10), max_batches, pause),
+        'outbox_event': _run_batches(
+            lambda size: prune_outbox_batch(outbox_cutoff, size), batch_size, max_batches, pause),
+        'idempotency_key': _run_batches(
+            lambda size: prune_expired_batch(datetime.utcnow(), size), batch_size, max_batches, pause),
+        # After the symptom checks, so files of checks archived above stay referenced
+        'image_file': prune_orphan_images(batch_size=batch_size),
+    }
+    seconds = round(time.perf_counter() - started, 2)
+    _record_run(moved, started_at, seconds)
+    app.logger.info(f"Retention run: {moved} in {seconds}s")
+    return moved
+
+
+def _record_run(moved, started_at, seconds):
+    # Kept in the database so `flask retention stats`, a separate process, can show it
+    checkpoint = JobCheckpoint.query.filter_by(name=RUN_CHECKPOINT).first()
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=RUN_CHECKPOINT)
+        db.session.add(checkpoint)
+    checkpoint.params = json.dumps({'moved': moved, 'seconds': seconds}, sort_keys=True)
+    checkpoint.processed = sum(moved.values())
+    checkpoint.started_at = started_at
+    checkpoint.updated_at = checkpoint.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def last_retention_run():
+    """Counts, duration and times of the most recent completed run, or None."""
+    checkpoint = JobCheckpoint.query.filter_by(name=RUN_CHECKPOINT).first()
+    if checkpoint is None or not checkpoint.params:
+        return None
+    return dict(json.loads(checkpoint.params), started_at=checkpoint.started_at, finished_at=checkpoint.finished_at)
+
+
+def table_bytes(table_name):
+    """On-disk size of a table (with indexes and TOAST on PostgreSQL), if the database can report it."""
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            return db.session.execute(
+                text('SELECT pg_total_relation_size(:name)'), {'name': table_name}
+            ).scalar()
+        if dialect == 'sqlite':
+            # Needs SQLite built with SQLITE_ENABLE_DBSTAT_VTAB
+            return db.session.execute(
+                text('SELECT SUM(pgsize) FROM dbstat WHERE name = :name'), {'name': table_name}
+            ).scalar()
+    except Exception:
+        db.session.rollback()
+    return None
+
+
+def retention_stats():
+    stats = {}
+    for model in (Notification, NotificationArchive, SymptomCheck, SymptomCheckArchive, OutboxEvent, IdempotencyKey):
+        table_name = model.__tablename__
+        stats[table_name] = {
+            'rows': db.session.query(func.count(model.id)).scalar(),
+            'bytes': table_bytes(table_name)
+        }
+    return stats
+
+
+# Cold-read path for archived rows
+
+def _archive_limit():
+    return min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+
+@app.route('/api/archive/notifications')
+@login_required
+def archived_notifications():
+    user_id = session.get('user_id')
+    query = NotificationArchive.query.filter_by(user_id=user_id)
+    before_id = request.args.get('before_id', type=int)
+    if before_id:
+        query = query.filter(NotificationArchive.id < before_id)
+    rows = render_notifications(query.order_by(NotificationArchive.id.desc()).limit(_archive_limit()).all())
+
+    return jsonify({
+        'success': True,
+        'notifications': [{
+            'id': row.id,
+            'appointment_id': row.appointment_id,
+            'message': row.text,
+            'type': row.type,
+            'created_at': row.created_at.isoformat() if row.created_at else None
+        } for row in rows]
+    })
+
+
+@app.route('/api/archive/symptom-checks')
+@login_required
+@patient_required
+def archived_symptom_checks():
+    patient = Patient.query.filter_by(user_id=session.get('user_id')).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+
+    # Listing columns only; payloads are decompressed one at a time on demand
+    query = db.session.query(
+        SymptomCheckArchive.id, SymptomCheckArchive.symptoms, SymptomCheckArchive.severity,
+        SymptomCheckArchive.created_at
+    ).filter(SymptomCheckArchive.patient_id == patient.id)
+    before_id = request.args.get('before_id', type=int)
+    if before_id:
+        query = query.filter(SymptomCheckArchive.id < before_id)
+    rows = query.order_by(SymptomCheckArchive.id.desc()).limit(_archive_limit()).all()
+
+    return jsonify({
+        'success': True,
+        'symptom_checks': [{
+            'id': row.id,
+            'symptoms': row.symptoms,
+            'severity': row.severity,
+            'created_at': row.created_at.isoformat() if row.created_at else None
+        } for row in rows]
+    })
+
+
+@app.route('/api/archive/symptom-checks/<int:check_id>')
+@login_required
+@patient_required
+def archived_symptom_check(check_id):
+    patient = Patient.query.filter_by(user_id=session.get('user_id')).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+
+    row = SymptomCheckArchive.query.filter_by(id=check_id, patient_id=patient.id).first()
+    if not row:
+        return jsonify({'success': False, 'message': 'Symptom check not found'}), 404
+
+    check = decode_payload(row.payload)
+    check['archived_at'] = row.archived_at.isoformat() if row.archived_at else None
+    return jsonify({'success': True, 'symptom_check': check})
+
+
+retention_cli = AppGroup('retention', help='Archive old rows out of the hot tables.')
+
+
+@retention_cli.command('run')
+@click.option('--batch-size', default=RETENTION_BATCH_SIZE, show_default=True)
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per table.')
+@click.option('--pause', default=RETENTION_BATCH_PAUSE, show_default=True, help='Seconds to sleep between batches.')
+def run_command(batch_size, max_batches, pause):
+    """Archive read notifications and old symptom checks; prune delivered outbox events, expired keys and orphan images."""
+    moved = run_retention(batch_size, max_batches, pause)
+    for table_name, count in moved.items():
+        click.echo(f"{table_name}: {count} rows")
+
+
+@retention_cli.command('stats')
+def stats_command():
+    """Show row counts and table sizes for hot and archive tables."""
+    for table_name, stats in retention_stats().items():
+        size = f"{stats['bytes']} bytes" if stats['bytes'] is not None else 'size n/a'
+        click.echo(f"{table_name}: {stats['rows']} rows, {size}")
+    last_run = last_retention_run()
+    if last_run:
+        moved = ', '.join(f"{table_name} {count}" for table_name, count in last_run['moved'].items())
+        click.echo(f"last run: finished {last_run['finished_at']:%Y-%m-%d %H:%M:%S} in {last_run['seconds']}s; "
+                   f"rows moved: {moved}")
+
+
+app.cli.add_command(retention_cli)
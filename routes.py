@@ -9,19 +9,36 @@ import re
 from datetime import datetime, timedelta
 from app import app, db
 from models import User, Doctor, Patient, Appointment, SymptomCheck, ImageAnalysisSection, Notification
-from config import GOOGLE_API_KEY
+from config import GOOGLE_API_KEY, GEMINI_TEXT_MODEL, GEMINI_VISION_MODEL, ROUTING_TOP_K, DOCTOR_STATS_MAX_DAYS
+from prompts import build_symptom_prompt, build_image_prompt, SYMPTOM_PROMPT_VERSION
+from similarity import find_similar
+from doctor_routing import recommend_doctors
+from page_cache import cached_page
+from outbox import enqueue
+from check_summary import SUMMARY_COLUMNS
+from db_routing import read_only
+from idempotency import idempotent, mark_created, new_key
+from doctor_stats import record_booking, record_status_changes, doctor_summary
+from notification_messages import notification_params, render_notifications
+from uploads import validate_image, store_image, open_check_image
 import logging
+from sqlalchemy import insert
+from sqlalchemy.orm import load_only, undefer_group
 from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Configure Gemini API
 genai.configure(api_key=GOOGLE_API_KEY)
 
 # Text model (optimized for faster responses)
-text_model = genai.GenerativeModel('gemini-2.0-flash')
+text_model = genai.GenerativeModel(GEMINI_TEXT_MODEL)
 
 # Vision model (supporting multimodal inputs like images)
-vision_model = genai.GenerativeModel('gemini-pro-vision')
+vision_model = genai.GenerativeModel(GEMINI_VISION_MODEL)
+
+# Recorded with each text analysis; reanalysis.py re-runs checks with an older one
+ANALYSIS_VERSION = f"{GEMINI_TEXT_MODEL}:{SYMPTOM_PROMPT_VERSION}"
 
 # Login required decorator
 def login_required(f):
@@ -55,6 +72,7 @@ def patient_required(f):
 
 # Home route
 @app.route('/')
+@cached_page()
 def home():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
@@ -169,6 +187,7 @@ def logout():
 # Dashboard route
 @app.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
     user_id = session.get('user_id')
     user_type = session.get('user_type')
@@ -239,8 +258,10 @@ def dashboard():
             Appointment.time
         ).limit(5).all()
         
-        # Get recent symptom checks
-        recent_checks = SymptomCheck.query.filter_by(
+        # Get recent symptom checks (summary fields only; the analysis loads on demand)
+        recent_checks = SymptomCheck.query.options(
+            load_only(*SUMMARY_COLUMNS)
+        ).filter_by(
             patient_id=patient.id
         ).order_by(
             SymptomCheck.created_at.desc()
@@ -260,6 +281,7 @@ def dashboard():
 @app.route('/symptom-checker', methods=['GET', 'POST'])
 @login_required
 @patient_required
+@idempotent('symptom_checker')
 def symptom_checker():
     if request.method == 'POST':
         try:
@@ -272,17 +294,35 @@ def symptom_checker():
                     'message': 'Patient profile not found'
                 }), 404
             
-            data = request.json
+            # Multipart form with the image streamed to a spooled, hashed file
+            # (see uploads.py); JSON with a base64 data URL is still accepted
+            upload = None
+            if request.mimetype == 'multipart/form-data':
+                data = request.form
+                upload = request.files.get('image')
+                if upload is not None and not upload.filename:
+                    upload = None
+            else:
+                data = request.json
             symptoms = data.get('symptoms', '')
             age = data.get('age', '')
             gender = data.get('gender', '')
             duration = data.get('duration', '')
             severity = data.get('severity', '')
             medical_history = data.get('medical_history', '')
-            image_data = data.get('image_data', '')  # Base64 encoded image
+            image_data = '' if upload else data.get('image_data', '')  # Base64 encoded image
+            
+            image_mime = None
+            if upload:
+                image_mime = validate_image(upload)
+                if not image_mime:
+                    return jsonify({
+                        'success': False,
+                        'message': 'Please upload a PNG, JPEG, GIF, WebP or BMP image'
+                    }), 415
             
             # Check if an image was uploaded
-            has_image = bool(image_data and image_data.startswith('data:image'))
+            has_image = bool(upload or (image_data and image_data.startswith('data:image')))
             
             # Prepare the symptom check object first (we'll analyze later)
             new_check = SymptomCheck(
@@ -295,8 +335,11 @@ def symptom_checker():
                 medical_history=medical_history
             )
             
-            # Store the image data if provided
-            if has_image:
+            # Store the image if provided
+            if upload:
+                new_check.image_sha256 = store_image(upload, image_mime)
+                new_check.image_mime = image_mime
+            elif has_image:
                 # Extract the base64 part
                 base64_data = re.sub('^data:image/.+;base64,', '', image_data)
                 new_check.image_data = base64_data
@@ -305,45 +348,15 @@ def symptom_checker():
             db.session.add(new_check)
             db.session.flush()
                 
-            # Text analysis prompt
-            prompt = f"""As a medical AI assistant, analyze the following patient information:
-
-Patient Information:
-- Age: {age}
-- Gender: {gender}
-- Symptoms: {symptoms}
-- Duration: {duration}
-- Severity: {severity}
-- Medical History: {medical_history}
-
-Please provide a comprehensive analysis with the following structure:
-
-Possible Conditions:
-[List each condition with confidence level and brief description]
-- Condition (High/Medium/Low confidence): Description and typical presentation
-
-Key Symptoms Analysis:
-- [Analyze each reported symptom and its significance]
-
-Risk Factors:
-- [List relevant risk factors based on patient's profile]
-
-Recommended Next Steps:
-1. [Immediate actions or self-care measures]
-2. [When to seek professional medical care]
-3. [Suggested medical tests or examinations]
-
-Warning Signs:
-- [List specific symptoms or changes that require immediate medical attention]
-
-Preventive Measures:
-1. [Lifestyle modifications]
-2. [Preventive actions]
-3. [General health recommendations]
-
-Note: This is an AI-generated analysis for informational purposes only. Please consult with a healthcare provider for proper medical diagnosis and treatment."""
+            # Text analysis prompt (budgeted; see prompts.py)
+            prompt = build_symptom_prompt(symptoms, age, gender, duration, severity, medical_history)
+            new_check.prompt_tokens = prompt.tokens
+            app.logger.info(
+                f"Symptom prompt: ~{prompt.tokens} tokens "
+                f"(prefix {prompt.prefix_tokens}, truncated: {prompt.truncated_fields or 'none'})"
+            )
 
-            response = text_model.generate_content(prompt)
+            response = text_model.generate_content(prompt.text)
             
             if not response or not response.text:
                 return jsonify({
@@ -351,31 +364,23 @@ Note: This is an AI-generated analysis for informational purposes only. Please c
                     'message': 'No response received from AI. Please try again.'
                 }), 500
             
-            processed_response = response.text.replace("*", "").replace("•", "")
-            
-            sections = [
-                "Possible Conditions:",
-                "Key Symptoms Analysis:",
-                "Risk Factors:",
-                "Recommended Next Steps:",
-                "Warning Signs:",
-                "Preventive Measures:"
-            ]
-            
-            formatted_response = processed_response
-            for section in sections:
-                if section not in formatted_response:
-                    base_section = section.replace(":", "")
-                    formatted_response = formatted_response.replace(base_section, section)
+            formatted_response = format_symptom_analysis(response.text)
             
             # Save the text analysis
             new_check.ai_analysis = formatted_response
+            new_check.analysis_version = ANALYSIS_VERSION
             
             # Process image if provided
             image_analysis_result = None
-            if has_image and new_check.image_data:
+            if has_image:
                 try:
-                    image_analysis_result = analyze_medical_image(new_check.image_data, symptoms, age, gender, medical_history)
+                    image_prompt = build_image_prompt(symptoms, age, gender, medical_history)
+                    new_check.prompt_tokens += image_prompt.tokens
+                    # The spooled upload is passed on as-is; no re-encoding or extra copy
+                    image_file = upload.stream if upload else open_check_image(None, None, new_check.image_data)
+                    image_analysis_result = analyze_medical_image(
+                        image_file, symptoms, age, gender, medical_history, prompt=image_prompt
+                    )
                     new_check.image_analysis = image_analysis_result
                     
                     # Create structured sections for the image analysis
@@ -386,15 +391,27 @@ Note: This is an AI-generated analysis for informational purposes only. Please c
             
             # Commit the changes
             db.session.commit()
+            mark_created(new_check.id)
+            
+            # Route the patient to doctors for the recommended specialties
+            recommended_doctors = []
+            try:
+                _, recommended_doctors = recommend_doctors(new_check, patient)
+            except Exception as route_err:
+                app.logger.error(f"Doctor routing error: {str(route_err)}")
             
             return jsonify({
                 'success': True,
                 'analysis': formatted_response,
                 'has_image': has_image,
                 'image_analysis': image_analysis_result if has_image else None,
-                'check_id': new_check.id
+                'check_id': new_check.id,
+                'recommended_doctors': recommended_doctors
             })
             
+        except RequestEntityTooLarge as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': e.description}), 413
         except Exception as e:
             db.session.rollback()
             app.logger.error(f"Symptom checker error: {str(e)}")
@@ -406,46 +423,122 @@ Note: This is an AI-generated analysis for informational purposes only. Please c
     return render_template('symptom_checker.html')
 
 
-# Function to analyze medical images using Google Gemini's Vision API
-def analyze_medical_image(base64_image, symptoms, age, gender, medical_history):
+# Provisional answer from a similar earlier analysis (shown while a fresh one is generated)
+@app.route('/api/symptom-checker/provisional', methods=['POST'])
+@login_required
+@patient_required
+def symptom_checker_provisional():
+    user_id = session.get('user_id')
+    patient = Patient.query.filter_by(user_id=user_id).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+
+    data = request.json or {}
+    symptoms = data.get('symptoms', '')
+    if not symptoms:
+        return jsonify({'success': False, 'message': 'Symptoms are required'}), 400
+
+    # Only a preview of the real analysis; never fail the request over it
+    match = None
     try:
-        import base64
-        from PIL import Image
-        import io
-        
-        # Decode base64 image data
-        image_data = base64.b64decode(base64_image)
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Create the prompt
-        prompt = f"""As a medical AI assistant, analyze this medical image with the following patient information:
+        match = find_similar(
+            patient.id,
+            symptoms,
+            age=data.get('age'),
+            gender=data.get('gender'),
+            severity=data.get('severity'),
+            duration=data.get('duration')
+        )
+    except Exception as similar_err:
+        app.logger.error(f"Similarity search error: {str(similar_err)}")
+    if not match:
+        return jsonify({'success': True, 'match': None})
 
-Patient Information:
-- Age: {age}
-- Gender: {gender}
-- Reported Symptoms: {symptoms}
-- Medical History: {medical_history}
+    check_id, score = match
+    prior = db.session.query(
+        SymptomCheck.ai_analysis,
+        SymptomCheck.created_at
+    ).filter(
+        SymptomCheck.id == check_id,
+        SymptomCheck.patient_id == patient.id  # never another patient's analysis
+    ).first()
+    if not prior or not prior.ai_analysis:
+        return jsonify({'success': True, 'match': None})
 
-Please provide a detailed analysis of the visible symptoms or conditions in the image.
-Structure your analysis in the following sections:
+    return jsonify({
+        'success': True,
+        'match': {
+            'check_id': check_id,
+            'similarity': round(score, 3),
+            'analysis': prior.ai_analysis,
+            'created_at': prior.created_at.isoformat() if prior.created_at else None
+        }
+    })
 
-Visual Findings:
-[Describe all visible symptoms, abnormalities, or medical conditions shown in the image]
 
-Potential Diagnoses:
-[List possible diagnoses based on the visual findings, ordered by likelihood]
+# Full analysis of a stored symptom check (list views only load its summary)
+@app.route('/api/symptom-checks/<int:check_id>')
+@login_required
+@patient_required
+def get_symptom_check(check_id):
+    user_id = session.get('user_id')
+    patient = Patient.query.filter_by(user_id=user_id).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+    
+    check = SymptomCheck.query.options(
+        undefer_group('analysis')
+    ).filter_by(id=check_id, patient_id=patient.id).first()
+    if not check:
+        return jsonify({'success': False, 'message': 'Symptom check not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'id': check.id,
+        'symptoms': check.symptoms,
+        'severity': check.severity,
+        'analysis': check.ai_analysis,
+        'image_analysis': check.image_analysis,
+        'created_at': check.created_at.isoformat() if check.created_at else None
+    })
 
-Recommended Medical Specialties:
-[Suggest which medical specialists would be appropriate for follow-up care]
 
-Important Notes:
-[Include any critical observations or warnings about the condition]
+# Doctors matching the specialties recommended by a stored symptom check
+@app.route('/api/symptom-checks/<int:check_id>/doctors')
+@login_required
+@patient_required
+def get_recommended_doctors(check_id):
+    user_id = session.get('user_id')
+    patient = Patient.query.filter_by(user_id=user_id).first()
+    if not patient:
+        return jsonify({'success': False, 'message': 'Patient profile not found'}), 404
+    
+    check = SymptomCheck.query.options(
+        undefer_group('analysis')
+    ).filter_by(id=check_id, patient_id=patient.id).first()
+    if not check:
+        return jsonify({'success': False, 'message': 'Symptom check not found'}), 404
+    
+    k = min(request.args.get('k', ROUTING_TOP_K, type=int), 50)
+    specialties, doctors = recommend_doctors(check, patient, k=k)
+    return jsonify({'success': True, 'specialties': specialties, 'doctors': doctors})
+
 
-This is for educational purposes only and not a substitute for professional medical diagnosis.
-"""
+# Function to analyze medical images using Google Gemini's Vision API
+def analyze_medical_image(image_file, symptoms, age, gender, medical_history, prompt=None, model=None):
+    try:
+        from PIL import Image
+        
+        # Read straight from the uploaded (or stored) image file
+        image = Image.open(image_file)
+        
+        # Create the prompt
+        if prompt is None:
+            prompt = build_image_prompt(symptoms, age, gender, medical_history)
+        app.logger.info(f"Image prompt: ~{prompt.tokens} tokens (truncated: {prompt.truncated_fields or 'none'})")
 
         # Generate content with the image using Gemini Pro Vision
-        response = vision_model.generate_content([prompt, image])
+        response = (model or vision_model).generate_content([prompt.text, image])
         
         # Extract and return the analysis
         if response and hasattr(response, 'text'):
@@ -458,51 +551,74 @@ This is for educational purposes only and not a substitute for professional medi
         raise Exception(f"Error analyzing medical image: {str(e)}")
 
 
+# Section headings of a text analysis, in the order the prompt asks for them
+SYMPTOM_SECTIONS = [
+    "Possible Conditions:",
+    "Key Symptoms Analysis:",
+    "Risk Factors:",
+    "Recommended Next Steps:",
+    "Warning Signs:",
+    "Preventive Measures:"
+]
+
+# Section headings of an image analysis and their display order
+IMAGE_SECTIONS = {
+    "Visual Findings:": 1,
+    "Potential Diagnoses:": 2,
+    "Recommended Medical Specialties:": 3,
+    "Important Notes:": 4
+}
+
+
+# Clean up a text analysis from the model: strip markdown and restore section colons
+def format_symptom_analysis(text):
+    formatted = text.replace("*", "").replace("•", "")
+    for section in SYMPTOM_SECTIONS:
+        if section not in formatted:
+            base_section = section.replace(":", "")
+            formatted = formatted.replace(base_section, section)
+    return formatted
+
+
+# Split an image analysis into (title, content, order) for each non-empty section
+def parse_image_sections(analysis_text):
+    current_section = None
+    section_content = {section: "" for section in IMAGE_SECTIONS}
+    
+    # Process the analysis line by line
+    for line in analysis_text.split('\n'):
+        found_section = False
+        for section in IMAGE_SECTIONS:
+            if line.strip().startswith(section):
+                current_section = section
+                found_section = True
+                break
+        
+        if found_section:
+            continue
+            
+        if current_section and line.strip():
+            section_content[current_section] += line + "\n"
+    
+    return [
+        (section, section_content[section].strip(), order)
+        for section, order in IMAGE_SECTIONS.items()
+        if section_content[section].strip()
+    ]
+
+
 # Function to split image analysis into structured sections
 def create_image_analysis_sections(symptom_check_id, analysis_text):
     try:
-        # Define the sections to look for
-        sections = {
-            "Visual Findings:": 1,
-            "Potential Diagnoses:": 2,
-            "Recommended Medical Specialties:": 3,
-            "Important Notes:": 4
-        }
-        
-        # Split the text by sections
-        current_section = None
-        section_content = {}
-        
-        # Initialize all sections with empty content
-        for section in sections:
-            section_content[section] = ""
-        
-        # Process the analysis line by line
-        for line in analysis_text.split('\n'):
-            found_section = False
-            for section in sections:
-                if line.strip().startswith(section):
-                    current_section = section
-                    found_section = True
-                    break
-            
-            if found_section:
-                continue
-                
-            if current_section and line.strip():
-                section_content[current_section] += line + "\n"
-        
         # Create database entries for each section
-        for section, order in sections.items():
-            content = section_content[section].strip()
-            if content:
-                section_entry = ImageAnalysisSection(
-                    symptom_check_id=symptom_check_id,
-                    section_title=section,
-                    section_content=content,
-                    section_order=order
-                )
-                db.session.add(section_entry)
+        for section, content, order in parse_image_sections(analysis_text):
+            section_entry = ImageAnalysisSection(
+                symptom_check_id=symptom_check_id,
+                section_title=section,
+                section_content=content,
+                section_order=order
+            )
+            db.session.add(section_entry)
                 
     except Exception as e:
         app.logger.error(f"Error creating image sections: {str(e)}")
@@ -512,16 +628,17 @@ def create_image_analysis_sections(symptom_check_id, analysis_text):
 @app.route('/doctor-finder')
 @login_required
 @patient_required
+@read_only
 def doctor_finder():
     specialization = request.args.get('specialization', '')
     
     # Get all doctors or filter by specialization
     if specialization:
-        doctors_list = Doctor.query.filter(
+        doctors_list = Doctor.query.options(undefer_group('profile')).filter(
             Doctor.specialization.ilike(f'%{specialization}%')
         ).all()
     else:
-        doctors_list = Doctor.query.all()
+        doctors_list = Doctor.query.options(undefer_group('profile')).all()
     
     return render_template('doctor_finder.html', doctors=doctors_list, specialization=specialization)
 
@@ -620,6 +737,7 @@ def update_profile():
 @app.route('/book-appointment', methods=['GET', 'POST'])
 @login_required
 @patient_required
+@idempotent('book_appointment')
 def book_appointment():
     user_id = session.get('user_id')
     patient = Patient.query.filter_by(user_id=user_id).first()
@@ -663,35 +781,35 @@ def book_appointment():
             db.session.add(new_appointment)
             db.session.flush()  # Get the ID without committing yet
             
-            # Create notification for the doctor
+            # Notifications are rendered from their type and the appointment when read
+            # (see notification_messages.py)
             doctor_user = User.query.get(doctor.user_id)
             if doctor_user:
-                formatted_date = appointment_date.strftime('%A, %B %d, %Y')
-                formatted_time = appointment_time.strftime('%I:%M %p')
-                
-                doctor_notification = Notification(
+                db.session.add(Notification(
                     user_id=doctor_user.id,
                     appointment_id=new_appointment.id,
-                    message=f"New appointment request from {patient.name} for {formatted_date} at {formatted_time}.",
+                    message='',
                     type="appointment_request"
-                )
-                db.session.add(doctor_notification)
+                ))
             
-            # Create notification for the patient
-            # Make sure formatted date and time are defined
-            if not 'formatted_date' in locals() or not 'formatted_time' in locals():
-                formatted_date = appointment_date.strftime('%A, %B %d, %Y')
-                formatted_time = appointment_time.strftime('%I:%M %p')
-                
-            patient_notification = Notification(
+            db.session.add(Notification(
                 user_id=patient.user_id,
                 appointment_id=new_appointment.id,
-                message=f"Your appointment request with Dr. {doctor.name} for {formatted_date} at {formatted_time} has been sent and is pending approval.",
+                message='',
                 type="appointment_pending"
-            )
-            db.session.add(patient_notification)
+            ))
+            
+            # Email delivery is queued in the same transaction and sent by the outbox dispatcher
+            enqueue([
+                {'user_id': n.user_id, 'appointment_id': n.appointment_id, 'type': n.type, 'params': n.params}
+                for n in db.session.new if isinstance(n, Notification)
+            ])
+            
+            # Daily doctor statistics are counted in the same transaction (see doctor_stats.py)
+            record_booking(new_appointment)
             
             db.session.commit()
+            mark_created(new_appointment.id)
             
             flash('Appointment request sent! Waiting for doctor approval.', 'success')
             return redirect(url_for('dashboard'))
@@ -714,7 +832,8 @@ def book_appointment():
     return render_template(
         'book_appointment.html',
         doctors=doctors_list,
-        selected_doctor=selected_doctor
+        selected_doctor=selected_doctor,
+        idempotency_key=new_key()
     )
 
 # Appointments route
@@ -744,6 +863,7 @@ def appointments():
 # API routes for AJAX calls
 @app.route('/api/doctors')
 @login_required
+@read_only
 def get_doctors():
     doctors_list = Doctor.query.all()
     doctors_data = []
@@ -762,6 +882,60 @@ def get_doctors():
     
     return jsonify(doctors_data)
 
+# The current doctor's daily statistics for the last `days` days, read from the rollup rows
+@app.route('/api/doctors/me/stats')
+@login_required
+@read_only
+def get_my_doctor_stats():
+    doctor = Doctor.query.filter_by(user_id=session.get('user_id')).first() \
+        if session.get('user_type') == 'doctor' else None
+    if not doctor:
+        return jsonify({'success': False, 'message': 'Doctor profile not found'}), 403
+    days = min(max(request.args.get('days', 30, type=int), 1), DOCTOR_STATS_MAX_DAYS)
+    return jsonify(dict(doctor_summary(doctor.id, days), success=True, days=days))
+
+APPOINTMENT_STATUSES = ['approved', 'rejected', 'scheduled', 'completed', 'cancelled']
+
+# Maximum number of transitions accepted by the batch endpoint
+APPOINTMENT_BATCH_LIMIT = 100
+
+
+# Returns an error message if the user may not move the appointment to new_status
+def check_status_transition(user_type, new_status):
+    if not new_status or new_status not in APPOINTMENT_STATUSES:
+        return 'Invalid status'
+    # Patients can only cancel appointments, not mark them completed/approved/rejected
+    if user_type != 'doctor' and new_status in ['completed', 'approved', 'rejected']:
+        return f'Not authorized to mark appointment as {new_status}'
+    return None
+
+
+# Builds the notification (as a dict of Notification columns) for a status change, if any.
+# The text is rendered from the type, the appointment and params when it is read.
+def status_change_notification(appointment, old_status, new_status, notes,
+                               doctor_user_id, patient_user_id, user_type):
+    if user_type == 'doctor':
+        if new_status == 'approved' and old_status == 'pending':
+            message_type, user_id, params = "appointment_approved", patient_user_id, None
+        elif new_status == 'rejected' and old_status == 'pending':
+            message_type, user_id, params = "appointment_rejected", patient_user_id, notification_params(notes)
+        elif new_status == 'completed' and old_status == 'scheduled':
+            message_type, user_id, params = "appointment_completed", patient_user_id, None
+        else:
+            return None
+    elif new_status == 'cancelled' and old_status in ['pending', 'scheduled', 'approved']:
+        message_type, user_id, params = "appointment_cancelled", doctor_user_id, notification_params(notes)
+    else:
+        return None
+    return {
+        'user_id': user_id,
+        'appointment_id': appointment.id,
+        'message': '',
+        'type': message_type,
+        'params': params
+    }
+
+
 @app.route('/api/appointments/<int:appointment_id>', methods=['PUT'])
 @login_required
 def update_appointment_status(appointment_id):
@@ -770,7 +944,7 @@ def update_appointment_status(appointment_id):
         new_status = data.get('status')
         notes = data.get('notes', '')
         
-        if not new_status or new_status not in ['approved', 'rejected', 'scheduled', 'completed', 'cancelled']:
+        if not new_status or new_status not in APPOINTMENT_STATUSES:
             return jsonify({'success': False, 'message': 'Invalid status'}), 400
         
         appointment = Appointment.query.get(appointment_id)
@@ -782,69 +956,30 @@ def update_appointment_status(appointment_id):
         user_type = session.get('user_type')
         old_status = appointment.status
         
-        # Formatted date and time for notifications
-        formatted_date = appointment.date.strftime('%A, %B %d, %Y') if appointment.date else "Unknown date"
-        formatted_time = appointment.time.strftime('%I:%M %p') if appointment.time else "Unknown time"
-        
         if user_type == 'doctor':
             doctor = Doctor.query.filter_by(user_id=user_id).first()
             if not doctor or appointment.doctor_id != doctor.id:
                 return jsonify({'success': False, 'message': 'Not authorized'}), 403
-            
-            # Only doctors can approve or reject appointment requests
             patient = Patient.query.get(appointment.patient_id)
-            
-            # Handle status change for doctor
-            if new_status == 'approved' and old_status == 'pending':
-                # Update appointment and create notification for the patient
-                patient_notification = Notification(
-                    user_id=patient.user_id,
-                    appointment_id=appointment.id,
-                    message=f"Dr. {doctor.name} has approved your appointment for {formatted_date} at {formatted_time}.",
-                    type="appointment_approved"
-                )
-                db.session.add(patient_notification)
-                
-            elif new_status == 'rejected' and old_status == 'pending':
-                # Update appointment and create notification for the patient
-                patient_notification = Notification(
-                    user_id=patient.user_id,
-                    appointment_id=appointment.id,
-                    message=f"Dr. {doctor.name} has declined your appointment request for {formatted_date} at {formatted_time}. Reason: {notes}",
-                    type="appointment_rejected"
-                )
-                db.session.add(patient_notification)
-            
-            elif new_status == 'completed' and old_status == 'scheduled':
-                # Create notification for the patient about completed appointment
-                patient_notification = Notification(
-                    user_id=patient.user_id,
-                    appointment_id=appointment.id,
-                    message=f"Your appointment with Dr. {doctor.name} on {formatted_date} at {formatted_time} has been marked as completed.",
-                    type="appointment_completed"
-                )
-                db.session.add(patient_notification)
-                
         else:
             patient = Patient.query.filter_by(user_id=user_id).first()
             if not patient or appointment.patient_id != patient.id:
                 return jsonify({'success': False, 'message': 'Not authorized'}), 403
             
-            # Patients can only cancel appointments, not mark them completed/approved/rejected
-            if new_status in ['completed', 'approved', 'rejected']:
-                return jsonify({'success': False, 'message': f'Not authorized to mark appointment as {new_status}'}), 403
-            
-            # Handle cancellation by patient
-            if new_status == 'cancelled' and old_status in ['pending', 'scheduled', 'approved']:
-                doctor = Doctor.query.get(appointment.doctor_id)
-                # Create notification for the doctor
-                doctor_notification = Notification(
-                    user_id=doctor.user_id,
-                    appointment_id=appointment.id,
-                    message=f"{patient.name} has cancelled their appointment for {formatted_date} at {formatted_time}. Reason: {notes}",
-                    type="appointment_cancelled"
-                )
-                db.session.add(doctor_notification)
+            error = check_status_transition(user_type, new_status)
+            if error:
+                return jsonify({'success': False, 'message': error}), 403
+            doctor = Doctor.query.get(appointment.doctor_id)
+        
+        notification = status_change_notification(
+            appointment, old_status, new_status, notes,
+            doctor.user_id, patient.user_id, user_type
+        )
+        if notification:
+            db.session.add(Notification(**notification))
+            enqueue([notification])
+        
+        record_status_changes([(appointment, old_status, new_status)])
         
         # Update appointment status and notes
         appointment.status = new_status
@@ -860,6 +995,127 @@ def update_appointment_status(appointment_id):
         app.logger.error(f"Appointment update error: {str(e)}")
         return jsonify({'success': False, 'message': 'An error occurred while updating appointment'}), 500
 
+
+# Apply several status transitions in one request.
+# Body: {"items": [{"id": 1, "status": "approved", "notes": ""}, ...], "atomic": true}
+# With atomic (the default) nothing is applied unless every item is valid.
+@app.route('/api/appointments/batch', methods=['PUT'])
+@login_required
+def update_appointment_status_batch():
+    try:
+        data = request.json or {}
+        items = data.get('items')
+        atomic = data.get('atomic', True)
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': 'No appointments given'}), 400
+        if not isinstance(atomic, bool):
+            return jsonify({'success': False, 'message': 'atomic must be true or false'}), 400
+        if len(items) > APPOINTMENT_BATCH_LIMIT:
+            return jsonify({'success': False, 'message': f'At most {APPOINTMENT_BATCH_LIMIT} appointments per request'}), 400
+        
+        user_id = session.get('user_id')
+        user_type = session.get('user_type')
+        
+        ids = set()
+        for item in items:
+            try:
+                ids.add(int(item.get('id')))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        
+        # Authorize every appointment with one query: only rows owned by the
+        # current doctor (or patient) come back, together with the user ids
+        # needed for the notifications.
+        query = db.session.query(
+            Appointment, Doctor.user_id, Patient.user_id
+        ).join(
+            Doctor, Appointment.doctor_id == Doctor.id
+        ).join(
+            Patient, Appointment.patient_id == Patient.id
+        ).filter(
+            Appointment.id.in_(ids)
+        )
+        if user_type == 'doctor':
+            query = query.filter(Doctor.user_id == user_id)
+        else:
+            query = query.filter(Patient.user_id == user_id)
+        owned = {row[0].id: row for row in query.all()}
+        
+        results = []
+        notifications = []
+        applied = []
+        seen = set()
+        for item in items:
+            appointment_id = item.get('id') if isinstance(item, dict) else None
+            new_status = item.get('status') if isinstance(item, dict) else None
+            notes = (item.get('notes') if isinstance(item, dict) else None) or ''
+            
+            try:
+                appointment_id = int(appointment_id)
+            except (TypeError, ValueError):
+                results.append({'id': appointment_id, 'success': False, 'message': 'Invalid appointment id'})
+                continue
+            if appointment_id in seen:
+                results.append({'id': appointment_id, 'success': False, 'message': 'Duplicate appointment in batch'})
+                continue
+            seen.add(appointment_id)
+            
+            row = owned.get(appointment_id)
+            if not row:
+                results.append({'id': appointment_id, 'success': False, 'message': 'Appointment not found or not authorized'})
+                continue
+            error = check_status_transition(user_type, new_status)
+            if error:
+                results.append({'id': appointment_id, 'success': False, 'message': error})
+                continue
+            
+            appointment, doctor_user_id, patient_user_id = row
+            notification = status_change_notification(
+                appointment, appointment.status, new_status, notes,
+                doctor_user_id, patient_user_id, user_type
+            )
+            if notification:
+                notifications.append(notification)
+            applied.append((appointment, new_status, notes))
+            results.append({'id': appointment_id, 'success': True, 'status': new_status})
+        
+        failed = [result for result in results if not result['success']]
+        if failed and atomic:
+            return jsonify({
+                'success': False,
+                'message': f'{len(failed)} of {len(items)} appointments could not be updated; nothing was changed',
+                'results': results
+            }), 409
+        
+        record_status_changes([(appointment, appointment.status, new_status) for appointment, new_status, _ in applied])
+        for appointment, new_status, notes in applied:
+            appointment.status = new_status
+            if notes:
+                appointment.notes = notes
+        
+        # One multi-row insert for all notifications
+        if notifications:
+            now = datetime.utcnow()
+            for notification in notifications:
+                notification['created_at'] = now
+                notification['is_read'] = False
+            db.session.execute(insert(Notification), notifications)
+            enqueue(notifications)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': not failed,
+            'message': f'{len(applied)} of {len(items)} appointments updated',
+            'results': results
+        })
+        
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Batch appointment update error: {str(e)}")
+        return jsonify({'success': False, 'message': 'An error occurred while updating appointments'}), 500
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -873,6 +1129,7 @@ def server_error(e):
 # Notifications route
 @app.route('/notifications')
 @login_required
+@read_only
 def notifications():
     user_id = session.get('user_id')
     
@@ -892,6 +1149,9 @@ def notifications():
         Notification.created_at.desc()
     ).limit(20).all()
     
+    # Message text for both lists, with one appointment lookup
+    render_notifications(user_notifications + read_notifications)
+    
     return render_template(
         'notifications.html',
         unread_notifications=user_notifications,
@@ -928,6 +1188,7 @@ def mark_notification_read(notification_id):
 # API route to get unread notification count
 @app.route('/api/notifications/count')
 @login_required
+@read_only
 def get_notification_count():
     user_id = session.get('user_id')
     
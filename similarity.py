@@ -0,0 +1,335 @@
+#similarity.py
+# Approximate-match reuse of earlier symptom analyses.
+#
+# Past SymptomCheck rows are turned into hashed bag-of-features vectors
+# (symptom words, word pairs and character trigrams plus demographic fields)
+# and kept in a fixed-size NumPy matrix. Cosine search over that matrix finds
+# a close prior analysis of the same patient that can be shown as a
+# provisional answer while a fresh one is generated. Analyses repeat the
+# patient's symptoms and details, so they are never offered to anyone else.
+# With SIMILARITY_IVF_LISTS set, vectors are also partitioned around k-means
+# centroids so a search only scans a few lists.
+#
+# The index is kept current through commit hooks for checks committed in
+# this process, and reloaded when the symptom check table's version (see
+# commit_hooks.py) shows changes made by another process.
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from app import db
+from commit_hooks import after_commit, table_version
+from config import (SIMILARITY_DIM, SIMILARITY_MAX_ITEMS, SIMILARITY_THRESHOLD, SIMILARITY_IVF_LISTS,
+                    SIMILARITY_IVF_PROBES)
+from models import SymptomCheck
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+NUMBER_WORDS = {
+    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6',
+    'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10', 'a couple': '2', 'several': '3'
+}
+
+# Common lay phrasings mapped onto one canonical term
+SYNONYMS = {
+    'head pain': 'headache', 'head ache': 'headache', 'migraine': 'headache',
+    'high temperature': 'fever', 'temperature': 'fever', 'feverish': 'fever', 'pyrexia': 'fever',
+    'throwing up': 'vomiting', 'vomit': 'vomiting', 'puking': 'vomiting',
+    'tummy': 'stomach', 'belly': 'stomach', 'abdominal': 'stomach', 'abdomen': 'stomach',
+    'short of breath': 'breathless', 'shortness of breath': 'breathless', 'breathlessness': 'breathless',
+    'tired': 'fatigue', 'tiredness': 'fatigue', 'exhausted': 'fatigue', 'exhaustion': 'fatigue',
+    'runny nose': 'rhinorrhea', 'sore throat': 'pharyngitis', 'itchy': 'itch', 'itching': 'itch',
+    'dizzy': 'dizziness', 'lightheaded': 'dizziness', 'coughing': 'cough',
+    'feeling sick': 'nausea', 'queasy': 'nausea', 'nauseous': 'nausea',
+    'backache': 'back pain', 'back ache': 'back pain', 'loose stools': 'diarrhea',
+    'blocked nose': 'congestion', 'stuffy nose': 'congestion',
+}
+
+STOP_WORDS = frozenset('a an and the of for with my i have has had been am is are was on in since '
+                       'about from to it me some very really bit'.split())
+
+_SYNONYM_RE = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, SYNONYMS), key=len, reverse=True)) + r')\b')
+_NUMBER_RE = re.compile(r'\b(' + '|'.join(map(re.escape, NUMBER_WORDS)) + r')\b')
+
+# Relative weights of each feature family
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.5
+TRIGRAM_WEIGHT = 0.2
+DEMOGRAPHIC_WEIGHT = 0.6
+
+
+def _stem(word):
+    for suffix in ('ing', 'es', 's'):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _hash(feature):
+    h = zlib.crc32(feature.encode('utf-8'))
+    return h >> 1, 1.0 if h & 1 else -1.0
+
+
+def _age_bucket(age):
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return None
+    for limit, label in ((2, 'infant'), (12, 'child'), (18, 'teen'), (40, 'adult'), (65, 'middle')):
+        if age < limit:
+            return label
+    return 'senior'
+
+
+def features(symptoms, age=None, gender=None, severity=None, duration=None):
+    """Yield (feature, weight) pairs for a symptom description."""
+    text = (symptoms or '').lower()
+    text = _SYNONYM_RE.sub(lambda m: SYNONYMS[m.group(1)], text)
+    text = _NUMBER_RE.sub(lambda m: NUMBER_WORDS[m.group(1)], text)
+    words = [_stem(w) for w in _TOKEN_RE.findall(text) if w not in STOP_WORDS]
+
+    for word in words:
+        yield 'w:' + word, WORD_WEIGHT
+        if len(word) > 3:
+            for i in range(len(word) - 2):
+                yield 'c:' + word[i:i + 3], TRIGRAM_WEIGHT
+    for first, second in zip(words, words[1:]):
+        yield 'b:' + first + '_' + second, BIGRAM_WEIGHT
+
+    bucket = _age_bucket(age)
+    if bucket:
+        yield 'age:' + bucket, DEMOGRAPHIC_WEIGHT
+    if gender:
+        yield 'gender:' + str(gender).lower(), DEMOGRAPHIC_WEIGHT
+    if severity:
+        yield 'severity:' + str(severity).lower(), DEMOGRAPHIC_WEIGHT
+    if duration:
+        yield 'duration:' + str(duration).lower(), DEMOGRAPHIC_WEIGHT
+
+
+def vectorize(symptoms, age=None, gender=None, severity=None, duration=None, dim=SIMILARITY_DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features(symptoms, age, gender, severity, duration):
+        bucket, sign = _hash(feature)
+        vector[bucket % dim] += sign * weight
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class SimilarityIndex:
+    """Bounded in-memory cosine index.
+
+    Rows live in a preallocated (max_items, dim) float32 matrix used as a ring
+    buffer, so memory is fixed at max_items * dim * 4 bytes and the oldest
+    entries are evicted first once it is full.
+    """
+
+    def __init__(self, dim=SIMILARITY_DIM, max_items=SIMILARITY_MAX_ITEMS,
+                 ivf_lists=SIMILARITY_IVF_LISTS, ivf_probes=SIMILARITY_IVF_PROBES):
+        self.dim = dim
+        self.max_items = max_items
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self._vectors = np.zeros((max_items, dim), dtype=np.float32)
+        self._ids = np.full(max_items, -1, dtype=np.int64)
+        self._meta = [None] * max_items
+        self._slot_by_id = {}
+        self._next = 0
+        self._size = 0
+        self._centroids = None
+        self._assignments = np.full(max_items, -1, dtype=np.int32)
+        self._trained_at = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._slot_by_id)
+
+    def __contains__(self, item_id):
+        return item_id in self._slot_by_id
+
+    @property
+    def nbytes(self):
+        return self._vectors.nbytes + self._ids.nbytes + self._assignments.nbytes
+
+    def add(self, item_id, vector, meta=None):
+        with self._lock:
+            slot = self._slot_by_id.get(item_id)
+            if slot is None:
+                slot = self._next
+                evicted = self._ids[slot]
+                if evicted >= 0:
+                    self._slot_by_id.pop(int(evicted), None)
+                self._next = (self._next + 1) % self.max_items
+                self._size = min(self._size + 1, self.max_items)
+            self._vectors[slot] = vector
+            self._ids[slot] = item_id
+            self._meta[slot] = meta
+            self._slot_by_id[item_id] = slot
+            if self._centroids is not None:
+                self._assignments[slot] = int(np.argmax(self._centroids @ vector))
+            self._maybe_train()
+
+    def remove(self, item_id):
+        with self._lock:
+            slot = self._slot_by_id.pop(item_id, None)
+            if slot is not None:
+                self._vectors[slot] = 0
+                self._ids[slot] = -1
+                self._meta[slot] = None
+                self._assignments[slot] = -1
+
+    def _maybe_train(self):
+        # (Re)build the IVF partition whenever the index has doubled in size
+        # since the last training run.
+        if not self.ivf_lists or len(self) < self.ivf_lists * 8:
+            return
+        if self._trained_at and len(self) < self._trained_at * 2:
+            return
+        self.train()
+
+    def train(self, iterations=8, seed=0):
+        with self._lock:
+            live = np.flatnonzero(self._ids[:self._size] >= 0)
+            if len(live) < self.ivf_lists:
+                return
+            data = self._vectors[live]
+            rng = np.random.default_rng(seed)
+            centroids = data[rng.choice(len(data), self.ivf_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                # Sum members per list with one matrix product; empty lists
+                # keep their previous centroid
+                membership = np.zeros((self.ivf_lists, len(data)), dtype=np.float32)
+                membership[assignment, np.arange(len(data))] = 1
+                sums = membership @ data
+                norms = np.linalg.norm(sums, axis=1)
+                filled = norms > 0
+                centroids[filled] = sums[filled] / norms[filled, None]
+            self._centroids = centroids
+            self._assignments[:] = -1
+            self._assignments[live] = np.argmax(data @ centroids.T, axis=1)
+            self._trained_at = len(live)
+
+    def search(self, vector, k=1, predicate=None):
+        """Return up to k (item_id, score, meta) tuples, best first."""
+        with self._lock:
+            if not self._slot_by_id:
+                return []
+            if self._centroids is not None:
+                probes = np.argsort(self._centroids @ vector)[-self.ivf_probes:]
+                candidates = np.flatnonzero(np.isin(self._assignments[:self._size], probes))
+                if not len(candidates):
+                    return []
+                scores = self._vectors[candidates] @ vector
+            else:
+                # Flat scan over a view of the matrix; removed slots are zero
+                # vectors and get filtered out below.
+                candidates = np.arange(self._size)
+                scores = self._vectors[:self._size] @ vector
+                scores[self._ids[:self._size] < 0] = -np.inf
+
+            # Rank a small head of the best scores first; only sort everything
+            # if the predicate rejects the whole head.
+            head = min(len(scores), max(k * 16, 32))
+            order = np.argpartition(scores, -head)[-head:]
+            order = order[np.argsort(scores[order])[::-1]]
+            results = self._collect(candidates, scores, order, k, predicate)
+            if len(results) < k and head < len(scores):
+                order = np.argsort(scores)[::-1]
+                results = self._collect(candidates, scores, order, k, predicate)
+            return results
+
+    def _collect(self, candidates, scores, order, k, predicate):
+        results = []
+        for position in order:
+            slot = candidates[position]
+            if self._ids[slot] < 0:
+                continue  # removed
+            meta = self._meta[slot]
+            if predicate is not None and not predicate(meta):
+                continue
+            results.append((int(self._ids[slot]), float(scores[position]), meta))
+            if len(results) >= k:
+                break
+        return results
+
+
+_index = None
+_index_version = None  # symptom check table version the index reflects
+_index_lock = threading.Lock()
+
+
+_VECTOR_FIELDS = ('patient_id', 'symptoms', 'age', 'gender', 'severity', 'duration')
+
+
+def _check_vector(check):
+    return vectorize(check['symptoms'], check.get('age'), check.get('gender'),
+                     check.get('severity'), check.get('duration'))
+
+
+def _check_meta(check):
+    return {'patient_id': check['patient_id']}
+
+
+def get_index():
+    """Return the process-wide index, loading recent checks on first use."""
+    global _index, _index_version
+    version = table_version(db.session, SymptomCheck)
+    if _index is not None and _index_version == version:
+        return _index
+    with _index_lock:
+        if _index is None or _index_version != version:
+            index = SimilarityIndex()
+            rows = db.session.query(
+                SymptomCheck.id, SymptomCheck.patient_id, SymptomCheck.symptoms, SymptomCheck.age,
+                SymptomCheck.gender, SymptomCheck.severity, SymptomCheck.duration
+            ).filter(
+                SymptomCheck.ai_analysis.isnot(None)
+            ).order_by(
+                SymptomCheck.id.desc()
+            ).limit(index.max_items).all()
+            for row in reversed(rows):
+                check = row._asdict()
+                index.add(check['id'], _check_vector(check), _check_meta(check))
+            _index, _index_version = index, version
+    return _index
+
+
+def find_similar(patient_id, symptoms, age=None, gender=None, severity=None, duration=None, threshold=None):
+    """Return (check_id, score) for the patient's closest prior analysis, or None."""
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    vector = vectorize(symptoms, age, gender, severity, duration)
+    matches = get_index().search(
+        vector,
+        k=1,
+        predicate=lambda meta: meta['patient_id'] == patient_id
+    )
+    if matches and matches[0][1] >= threshold:
+        return matches[0][0], matches[0][1]
+    return None
+
+
+@after_commit(SymptomCheck, ['patient_id', 'symptoms', 'age', 'gender', 'severity', 'duration', 'ai_analysis'],
+              versioned=True)
+def update_similarity_index(changes, versions):
+    global _index_version
+    before, after = versions
+    with _index_lock:
+        # Only maintain an index that is loaded and current; otherwise the
+        # next get_index() reloads the committed rows anyway.
+        if _index is None or _index_version != before:
+            return
+        for op, check in changes:
+            if op == 'delete' or ('ai_analysis' in check and not check['ai_analysis']):
+                _index.remove(check['id'])
+            elif any(name not in check for name in _VECTOR_FIELDS):
+                continue  # fields not loaded were not changed
+            elif 'ai_analysis' in check or check['id'] in _index:
+                # An unloaded (deferred) analysis was not changed, so it is only
+                # re-indexed if it was already in the index, i.e. has an analysis
+                _index.add(check['id'], _check_vector(check), _check_meta(check))
+        _index_version = after
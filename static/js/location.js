@@ -20,8 +20,9 @@ document.addEventListener('DOMContentLoaded', function() {
             userLocationBtn.addEventListener('click', getUserLocation);
         }
         
-        // Load doctors on the map
+        // Load doctors on the map, and again for each new view
         loadDoctorsOnMap();
+        map.on('moveend', scheduleDoctorReload);
     }
     
     // Function to get user's location
@@ -100,38 +101,70 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Function to load doctors on the map
+    // Function to load doctors on the map. The server clusters the doctors in
+    // view for the current zoom (see map_clusters.py); markers are reloaded
+    // whenever the map is moved or zoomed
+    let clusterRequest = 0;
+    let reloadTimer = null;
+    
     function loadDoctorsOnMap() {
-        fetch('/api/doctors')
+        const requestId = ++clusterRequest;
+        const params = new URLSearchParams({
+            bbox: map.getBounds().toBBoxString(),
+            zoom: map.getZoom()
+        });
+        fetch(`/api/doctors/clusters?${params}`)
             .then(response => response.json())
-            .then(doctors => {
+            .then(data => {
+                // Ignore responses overtaken by a later move
+                if (requestId !== clusterRequest || !data.success) return;
+                
                 // Clear existing markers
                 doctorMarkers.forEach(marker => marker.remove());
                 doctorMarkers = [];
                 
-                doctors.forEach(doctor => {
-                    // Only add doctors with valid coordinates
-                    if (doctor.latitude && doctor.longitude) {
-                        const doctorIcon = L.divIcon({
-                            html: '<i class="fas fa-user-md fa-2x text-danger"></i>',
-                            className: 'custom-div-icon',
-                            iconSize: [30, 30],
-                            iconAnchor: [15, 15]
-                        });
-                        
-                        const marker = L.marker([doctor.latitude, doctor.longitude], {
-                            icon: doctorIcon
-                        }).addTo(map);
-                        
-                        marker.bindPopup(`
-                            <strong>${doctor.name}</strong><br>
-                            ${doctor.specialization}<br>
-                            ${doctor.address || ''} ${doctor.city || ''}, ${doctor.state || ''}<br>
-                            <a href="/book-appointment?doctor_id=${doctor.id}" class="btn btn-sm btn-primary mt-2">Book Appointment</a>
-                        `);
-                        
-                        doctorMarkers.push(marker);
-                    }
+                data.clusters.forEach(cluster => {
+                    const size = cluster.count < 10 ? 32 : cluster.count < 100 ? 40 : 48;
+                    const clusterIcon = L.divIcon({
+                        html: `<div class="doctor-cluster" style="width: ${size}px; height: ${size}px; line-height: ${size}px;">${cluster.count}</div>`,
+                        className: 'custom-div-icon',
+                        iconSize: [size, size],
+                        iconAnchor: [size / 2, size / 2]
+                    });
+                    
+                    const marker = L.marker([cluster.latitude, cluster.longitude], {
+                        icon: clusterIcon,
+                        title: `${cluster.count} doctors`
+                    }).addTo(map);
+                    
+                    // Zoom in towards the cluster to split it up
+                    marker.on('click', () => {
+                        map.setView([cluster.latitude, cluster.longitude], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+                    });
+                    
+                    doctorMarkers.push(marker);
+                });
+                
+                data.doctors.forEach(doctor => {
+                    const doctorIcon = L.divIcon({
+                        html: '<i class="fas fa-user-md fa-2x text-danger"></i>',
+                        className: 'custom-div-icon',
+                        iconSize: [30, 30],
+                        iconAnchor: [15, 15]
+                    });
+                    
+                    const marker = L.marker([doctor.latitude, doctor.longitude], {
+                        icon: doctorIcon
+                    }).addTo(map);
+                    
+                    marker.bindPopup(`
+                        <strong>${doctor.name}</strong><br>
+                        ${doctor.specialization}<br>
+                        ${doctor.address || ''} ${doctor.city || ''}, ${doctor.state || ''}<br>
+                        <a href="/book-appointment?doctor_id=${doctor.id}" class="btn btn-sm btn-primary mt-2">Book Appointment</a>
+                    `);
+                    
+                    doctorMarkers.push(marker);
                 });
                 
                 // Update doctor distances if user location is available
@@ -144,6 +177,11 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    function scheduleDoctorReload() {
+        clearTimeout(reloadTimer);
+        reloadTimer = setTimeout(loadDoctorsOnMap, 200);
+    }
+    
     // Function to update doctor distances from user location
     function updateDoctorDistances(userLocation) {
         const doctorCards = document.querySelectorAll('.doctor-card');
@@ -35,6 +35,19 @@ document.addEventListener('DOMContentLoaded', function() {
     
     if (!symptomForm) return;
     
+    // One idempotency key per distinct submission, kept until the server gives a
+    // final answer so resending after a dropped connection, a 409 (still being
+    // processed) or a 5xx does not run a second analysis
+    let idempotencyKey = null;
+    let idempotencyInputs = null;
+    
+    function newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+    }
+    
     // Initialize image upload functionality
     if (imageUploadInput) {
         imageUploadInput.addEventListener('change', function(e) {
@@ -54,14 +67,13 @@ document.addEventListener('DOMContentLoaded', function() {
                     return;
                 }
                 
-                // Show preview
-                const reader = new FileReader();
-                reader.onload = function(e) {
-                    imagePreview.src = e.target.result;
-                    imagePreviewContainer.classList.remove('d-none');
-                    removeImageBtn.classList.remove('d-none');
-                };
-                reader.readAsDataURL(file);
+                // Show preview (an object URL avoids reading the file into a data URL)
+                if (imagePreview.src.startsWith('blob:')) {
+                    URL.revokeObjectURL(imagePreview.src);
+                }
+                imagePreview.src = URL.createObjectURL(file);
+                imagePreviewContainer.classList.remove('d-none');
+                removeImageBtn.classList.remove('d-none');
             }
         });
         
@@ -69,6 +81,9 @@ document.addEventListener('DOMContentLoaded', function() {
         if (removeImageBtn) {
             removeImageBtn.addEventListener('click', function() {
                 imageUploadInput.value = '';
+                if (imagePreview.src.startsWith('blob:')) {
+                    URL.revokeObjectURL(imagePreview.src);
+                }
                 imagePreview.src = '';
                 imagePreviewContainer.classList.add('d-none');
                 this.classList.add('d-none');
@@ -101,33 +116,67 @@ document.addEventListener('DOMContentLoaded', function() {
             imageAnalysisResults.innerHTML = '';
         }
         
-        // Get image data if uploaded
-        let imageData = '';
+        // Prepare data for API call; the image is sent as a multipart file
+        const formData = new FormData();
+        formData.append('symptoms', symptomsInput);
+        formData.append('age', ageInput);
+        formData.append('gender', genderInput);
+        formData.append('duration', durationInput);
+        formData.append('severity', severityInput);
+        formData.append('medical_history', medicalHistoryInput);
         if (imageUploadInput && imageUploadInput.files.length > 0) {
-            imageData = imagePreview.src;
+            formData.append('image', imageUploadInput.files[0]);
         }
         
-        // Prepare data for API call
-        const data = {
-            symptoms: symptomsInput,
-            age: ageInput,
-            gender: genderInput,
-            duration: durationInput,
-            severity: severityInput,
-            medical_history: medicalHistoryInput,
-            image_data: imageData
-        };
+        const submittedInputs = JSON.stringify([
+            symptomsInput, ageInput, genderInput, durationInput, severityInput, medicalHistoryInput,
+            imageUploadInput && imageUploadInput.files.length > 0 ? imageUploadInput.files[0].name : ''
+        ]);
+        if (!idempotencyKey || submittedInputs !== idempotencyInputs) {
+            idempotencyKey = newIdempotencyKey();
+            idempotencyInputs = submittedInputs;
+        }
         
-        // Send API request
-        fetch('/symptom-checker', {
+        // Ask for a similar earlier analysis to show while the fresh one is generated
+        let finalReceived = false;
+        fetch('/api/symptom-checker/provisional', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify(data)
+            body: JSON.stringify({
+                symptoms: symptomsInput,
+                age: ageInput,
+                gender: genderInput,
+                duration: durationInput,
+                severity: severityInput
+            })
         })
         .then(response => response.json())
         .then(data => {
+            if (finalReceived || !data.success || !data.match) return;
+            displayProvisionalResults(data.match);
+        })
+        .catch(error => console.warn('Provisional analysis unavailable:', error));
+        
+        // Send API request
+        fetch('/symptom-checker', {
+            method: 'POST',
+            headers: {
+                'Idempotency-Key': idempotencyKey
+            },
+            body: formData
+        })
+        .then(response => {
+            // Final answer; the next submission gets a new key
+            if (response.status !== 409 && response.status < 500) {
+                idempotencyKey = null;
+            }
+            return response.json();
+        })
+        .then(data => {
+            finalReceived = true;
+            
             // Hide loading state
             loadingSpinner.classList.add('d-none');
             submitButton.disabled = false;
@@ -164,12 +213,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 
                 // Show the doctor finder suggestion
+                displayRecommendedDoctors(data.recommended_doctors || []);
                 document.getElementById('doctor-finder-suggestion').classList.remove('d-none');
             } else {
                 showError(data.message || 'An error occurred during analysis');
             }
         })
         .catch(error => {
+            finalReceived = true;
             console.error('Error:', error);
             loadingSpinner.classList.add('d-none');
             submitButton.disabled = false;
@@ -236,6 +287,58 @@ document.addEventListener('DOMContentLoaded', function() {
         resultsElement.scrollIntoView({ behavior: 'smooth' });
     }
     
+    function displayRecommendedDoctors(doctors) {
+        const container = document.getElementById('recommended-doctors');
+        if (!container) return;
+        
+        if (!doctors.length) {
+            container.replaceChildren();
+            container.classList.add('d-none');
+            return;
+        }
+        
+        // Names and places are doctor-editable; set them as text, never as HTML
+        container.replaceChildren(...doctors.map(doctor => {
+            const item = document.createElement('a');
+            item.href = '/book-appointment?doctor_id=' + encodeURIComponent(doctor.id);
+            item.className = 'list-group-item list-group-item-action d-flex justify-content-between align-items-center';
+            
+            const details = document.createElement('div');
+            const name = document.createElement('strong');
+            name.textContent = 'Dr. ' + doctor.name;
+            const specialty = document.createElement('div');
+            specialty.className = 'small text-muted';
+            specialty.textContent = doctor.specialization + (doctor.city ? ' \u00b7 ' + doctor.city : '');
+            details.append(name, specialty);
+            
+            const badge = document.createElement('span');
+            badge.className = 'badge bg-primary rounded-pill';
+            badge.textContent = doctor.distance_km !== null ? doctor.distance_km + ' km' : 'Book';
+            
+            item.append(details, badge);
+            return item;
+        }));
+        container.classList.remove('d-none');
+    }
+    
+    function displayProvisionalResults(match) {
+        const resultsTabs = document.getElementById('results-tabs');
+        if (resultsTabs) {
+            resultsTabs.classList.remove('d-none');
+        }
+        
+        displayAnalysisResults(match.analysis);
+        
+        // Mark the result as provisional until the fresh analysis replaces it
+        analysisResults.insertAdjacentHTML('afterbegin', `
+            <div class="alert alert-info" id="provisional-notice">
+                <i class="fas fa-hourglass-half me-2"></i>
+                <strong>Provisional result:</strong> based on a similar earlier analysis
+                (${Math.round(match.similarity * 100)}% match). A fresh analysis of your symptoms is in progress and will replace this shortly.
+            </div>
+        `);
+    }
+    
     function displayImageAnalysisResults(analysis) {
         if (!imageAnalysisResults) return;
         
@@ -0,0 +1,156 @@
+#static_assets.py
+# Fingerprinted, precompressed static assets.
+#
+# `flask assets build` copies every file under static/ to static/dist/ with a
+# content hash in its name (css/custom.css -> dist/css/custom.3f2a9c1b7e.css),
+# writes .gz (and .br when the brotli package is installed) variants of text
+# assets, and records the mapping in static/dist/manifest.json. When the
+# manifest exists, url_for('static', ...) resolves to the fingerprinted name,
+# and those files are served precompressed with far-future cache headers.
+# Without a build, static files are served exactly as before.
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import request, send_from_directory
+from flask.cli import AppGroup
+
+from app import app
+from config import STATIC_MAX_AGE
+
+try:
+    import brotli
+except ImportError:  # optional; only gzip variants are built without it
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.html', '.txt', '.map'}
+
+# Minimum size worth compressing; tiny files gain nothing over the headers
+MIN_COMPRESS_BYTES = 512
+
+manifest = {}
+
+
+def _dist_path():
+    return os.path.join(app.static_folder, DIST_DIR)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:10]
+
+
+def build_assets(static_folder=None):
+    """Write fingerprinted and precompressed copies of all static files."""
+    static_folder = static_folder or app.static_folder
+    dist = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+
+    entries = {}
+    stats = {'files': 0, 'bytes': 0, 'gzip_bytes': 0, 'brotli_bytes': 0}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{DIST_DIR}/{stem}.{_file_hash(source)}{ext}"
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            entries[rel] = hashed
+            stats['files'] += 1
+
+            with open(source, 'rb') as f:
+                data = f.read()
+            stats['bytes'] += len(data)
+            if ext.lower() not in COMPRESSIBLE_EXTENSIONS or len(data) < MIN_COMPRESS_BYTES:
+                continue
+            # mtime=0 keeps the .gz output byte-identical between builds
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            with open(target + '.gz', 'wb') as f:
+                f.write(compressed)
+            stats['gzip_bytes'] += len(compressed)
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                with open(target + '.br', 'wb') as f:
+                    f.write(compressed)
+                stats['brotli_bytes'] += len(compressed)
+
+    with open(os.path.join(dist, MANIFEST_NAME), 'w') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    load_manifest(static_folder)
+    return stats
+
+
+def load_manifest(static_folder=None):
+    path = os.path.join(static_folder or app.static_folder, DIST_DIR, MANIFEST_NAME)
+    manifest.clear()
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest.update(json.load(f))
+    return manifest
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and manifest:
+        filename = values.get('filename')
+        if filename in manifest:
+            values['filename'] = manifest[filename]
+
+
+_send_static_file = app.view_functions['static']
+
+
+def serve_static(filename):
+    if not filename.startswith(DIST_DIR + '/'):
+        return _send_static_file(filename=filename)
+
+    # Pick the best precompressed variant the client accepts
+    served = filename
+    encoding = None
+    accepted = request.accept_encodings
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[candidate] and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+            served, encoding = filename + suffix, candidate
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(app.static_folder, served, mimetype=mimetype, max_age=STATIC_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+app.view_functions['static'] = serve_static
+
+assets_cli = AppGroup('assets', help='Build fingerprinted static assets.')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint and precompress everything under static/."""
+    stats = build_assets()
+    click.echo(
+        f"Built {stats['files']} files ({stats['bytes']} bytes); "
+        f"gzip {stats['gzip_bytes']} bytes, brotli {stats['brotli_bytes'] or 'n/a'}"
+    )
+
+
+app.cli.add_command(assets_cli)
+
+load_manifest()
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Configured before the app is imported: a throwaway SQLite database and no background threads
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['DATABASE_REPLICA_URLS'] = ''
+os.environ['OUTBOX_DISPATCHER_THREAD'] = ''
+os.environ.setdefault('SESSION_SECRET', 'test')
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402,F401
+from app import app as flask_app  # noqa: E402
+
+
+class FakeModel:
+    """Stands in for the Gemini model; counts calls and can be made to fail."""
+
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return type('Response', (), {'text': "Possible Conditions:\n- Migraine (High confidence): head pain\n"
+                                             "Recommended Medical Specialties:\n- Neurologist\n"})()
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    import routes
+    model = FakeModel()
+    monkeypatch.setattr(routes, 'text_model', model)
+    return model
+
+
+@pytest.fixture
+def patient_client(app, request):
+    """A test client signed in as a new patient."""
+    client = app.test_client()
+    email = f"{request.node.name}@example.com"
+    client.post('/register', data={'email': email, 'password': 'pw', 'confirm_password': 'pw',
+                                   'user_type': 'patient', 'name': 'Test Patient'})
+    with client.session_transaction() as session:
+        assert session.get('user_id'), 'registration did not sign in'
+    return client
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from app import db
+from idempotency import KEY_HEADER, REPLAYED_HEADER
+from models import IdempotencyKey, SymptomCheck
+
+CHECK = {'symptoms': 'headache, nausea', 'age': '30', 'gender': 'female', 'duration': '2 days',
+         'severity': 'moderate'}
+
+
+def post_check(client, key, **fields):
+    return client.post('/symptom-checker', json=dict(CHECK, **fields), headers={KEY_HEADER: key})
+
+
+def check_count(app):
+    with app.app_context():
+        return SymptomCheck.query.count()
+
+
+def test_replay_returns_stored_response(app, patient_client, fake_model):
+    first = post_check(patient_client, 'replay-key-0001')
+    assert first.status_code == 200 and first.get_json()['success']
+    checks = check_count(app)
+
+    second = post_check(patient_client, 'replay-key-0001')
+    assert second.status_code == 200
+    assert second.headers[REPLAYED_HEADER] == 'true'
+    assert second.get_json() == first.get_json()
+    assert fake_model.calls == 1
+    assert check_count(app) == checks
+
+
+def test_key_reused_for_different_request_is_rejected(patient_client, fake_model):
+    assert post_check(patient_client, 'reused-key-0001').status_code == 200
+
+    response = post_check(patient_client, 'reused-key-0001', symptoms='rash')
+    assert response.status_code == 422
+    assert not response.get_json()['success']
+    assert fake_model.calls == 1
+
+
+def test_failure_releases_key(app, patient_client, fake_model):
+    fake_model.error = RuntimeError('model unavailable')
+    failed = post_check(patient_client, 'failed-key-0001')
+    assert failed.status_code == 500
+    with app.app_context():
+        assert IdempotencyKey.query.filter_by(key='failed-key-0001').count() == 0
+
+    fake_model.error = None
+    retried = post_check(patient_client, 'failed-key-0001')
+    assert retried.status_code == 200 and retried.get_json()['success']
+    assert REPLAYED_HEADER not in retried.headers
+    assert fake_model.calls == 2
+
+
+def test_expired_claim_is_taken_over(app, patient_client, fake_model):
+    with patient_client.session_transaction() as session:
+        user_id = session['user_id']
+    # Claimed by a worker that died before finishing
+    with app.app_context():
+        claimed_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.add(IdempotencyKey(user_id=user_id, scope='symptom_checker', key='orphan-key-0001',
+                                      fingerprint='abandoned', status='in_flight', created_at=claimed_at,
+                                      expires_at=claimed_at + timedelta(seconds=1)))
+        db.session.commit()
+
+    response = post_check(patient_client, 'orphan-key-0001')
+    assert response.status_code == 200 and response.get_json()['success']
+    assert REPLAYED_HEADER not in response.headers
+    assert fake_model.calls == 1
+    with app.app_context():
+        row = IdempotencyKey.query.filter_by(user_id=user_id, key='orphan-key-0001').one()
+        assert row.status == 'completed'
@@ -0,0 +1,36 @@
+from app import db
+from models import SymptomCheck
+from similarity import SimilarityIndex, find_similar, vectorize
+
+CHECK = {'symptoms': 'headache, nausea', 'age': '30', 'gender': 'female', 'duration': '2 days',
+         'severity': 'moderate'}
+
+
+def test_search_skips_removed_entries():
+    index = SimilarityIndex(max_items=8, ivf_lists=0)
+    vector = vectorize('headache and nausea', 30, 'female', 'moderate', '2 days')
+    index.add(1, vector, {'patient_id': 1})
+    index.add(2, vector, {'patient_id': 2})
+    index.remove(1)
+
+    def same_patient(meta):
+        return meta['patient_id'] == 1
+
+    assert index.search(vector, k=1, predicate=same_patient) == []
+    assert [item_id for item_id, _, _ in index.search(vector, k=2)] == [2]
+
+
+def test_provisional_after_check_removed(app, patient_client, fake_model):
+    created = patient_client.post('/symptom-checker', json=CHECK).get_json()
+    assert created['success']
+    with app.app_context():
+        patient_id = db.session.get(SymptomCheck, created['check_id']).patient_id
+        assert find_similar(patient_id, CHECK['symptoms'], age=30, gender='female', severity='moderate',
+                            duration='2 days')
+        # Leaves the index through the commit hook
+        db.session.delete(db.session.get(SymptomCheck, created['check_id']))
+        db.session.commit()
+
+    response = patient_client.post('/api/symptom-checker/provisional', json=CHECK)
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True, 'match': None}
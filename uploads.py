@@ -0,0 +1,149 @@
+#uploads.py
+# Streaming image uploads.
+#
+# File fields in multipart requests are written by the form parser straight
+# into a HashingSpooledFile: kept in memory up to UPLOAD_SPOOL_BYTES, then
+# spilled to a temporary file, with the SHA-256 computed as chunks arrive and
+# the size limit enforced while reading. Accepted images are stored
+# content-addressed under UPLOAD_FOLDER (identical uploads share one file) and
+# referenced from SymptomCheck.image_sha256 / image_mime. Checks created before
+# this keep their base64 image_data, which open_check_image() still reads.
+#
+# A file is written before the check that refers to it is committed, so a
+# failed commit leaves it behind; `flask retention run` deletes files that no
+# live or archived check refers to once they are UPLOAD_ORPHAN_GRACE_SECONDS
+# old (see retention.prune_orphan_images).
+import base64
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app import app
+from config import UPLOAD_FOLDER, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES
+
+# Accepted image types and the extension they are stored with
+IMAGE_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/bmp': 'bmp',
+}
+
+# Leading bytes of each type; the client's Content-Type is not trusted
+_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+SNIFF_BYTES = 16
+
+COPY_CHUNK = 64 * 1024
+
+
+def sniff_image_type(head):
+    """MIME type of an image from its first bytes, or None if it is not a supported image."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+class HashingSpooledFile:
+    """Spooled temporary file that hashes and counts bytes as they are written."""
+
+    def __init__(self, max_bytes=UPLOAD_MAX_BYTES, spool_bytes=UPLOAD_SPOOL_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._hash = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Uploads are limited to {self.max_bytes // (1024 * 1024)} MB")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile()
+
+
+app.request_class = UploadRequest
+
+
+def image_path(sha256, mime):
+    return os.path.join(UPLOAD_FOLDER, sha256[:2], sha256[2:4], f"{sha256}.{IMAGE_TYPES[mime]}")
+
+
+def validate_image(file_storage):
+    """Return the sniffed MIME type of an uploaded image, or None if it is not one."""
+    stream = file_storage.stream
+    stream.seek(0)
+    mime = sniff_image_type(stream.read(SNIFF_BYTES))
+    stream.seek(0)
+    return mime
+
+
+def store_image(file_storage, mime):
+    """Store an upload under its content hash; returns the hash. The stream is left at 0."""
+    stream = file_storage.stream
+    sha256 = stream.hexdigest()
+    path = image_path(sha256, mime)
+    if os.path.exists(path):
+        # Reused by a new check: restart its grace period so the orphan
+        # cleanup can't delete it before that check is committed
+        os.utime(path)
+    else:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary name and rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                stream.seek(0)
+                shutil.copyfileobj(stream, out, COPY_CHUNK)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    stream.seek(0)
+    return sha256
+
+
+def iter_stored_images():
+    """(path, sha256 or None for partial writes) for every file under UPLOAD_FOLDER."""
+    for directory, _, names in os.walk(UPLOAD_FOLDER):
+        for name in names:
+            yield os.path.join(directory, name), (None if name.endswith('.part') else name.partition('.')[0])
+
+
+def open_check_image(image_sha256, image_mime, image_data=None):
+    """Open the image of a symptom check for reading, or return None if it has none."""
+    if image_sha256:
+        return open(image_path(image_sha256, image_mime), 'rb')
+    if image_data:
+        return io.BytesIO(base64.b64decode(image_data))
+    return None